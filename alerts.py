@@ -0,0 +1,100 @@
+"""
+New-ticket alerts for the admin inbox.
+
+In ``immediate`` mode every ticket queues its own email, as before. In
+``digest`` mode the first ``immediate_threshold`` tickets of an error type
+within a rolling ``window`` are still sent right away (so a new problem is
+noticed at once); anything beyond that is recorded in ``admin_alerts`` and
+summarised by the ``admin-digest`` periodic job, one email per window with
+a section per error type. Either way the submission only performs inserts
+in its own transaction.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Digest emails list at most this many tickets per error type.
+DIGEST_LIST_LIMIT = 25
+
+
+class AdminAlerts:
+    """
+    ``ticket_template(ticket_id, name, account, error_type, tracking_link)``
+    and ``digest_template(groups, window)`` return (subject, html); ``groups``
+    is a list of (error_type, count, rows) with rows as dicts.
+    """
+
+    def __init__(self, outbox, recipient, ticket_template, digest_template,
+                 mode="immediate", window=300.0, immediate_threshold=1, keep_days=7):
+        self.outbox = outbox
+        self.recipient = recipient
+        self.ticket_template = ticket_template
+        self.digest_template = digest_template
+        self.mode = mode
+        self.window = window
+        self.immediate_threshold = immediate_threshold
+        self.keep_days = keep_days
+
+    def record(self, cursor, ticket_id, name, account, error_type, tracking_link):
+        """Queue or record the alert for a new ticket using the caller's transaction."""
+        if not self.recipient:
+            logger.warning("MAIL_USERNAME not set; skipping admin alert.")
+            return
+
+        immediate = True
+        if self.mode == "digest":
+            cursor.execute("""
+                INSERT INTO admin_alerts (ticket_id, error_type, fullname, account_number, tracking_link,
+                                          immediate, digested_at)
+                SELECT %(ticket_id)s, %(error_type)s, %(name)s, %(account)s, %(link)s,
+                       recent.n < %(threshold)s,
+                       CASE WHEN recent.n < %(threshold)s THEN NOW() END
+                FROM (
+                    SELECT COUNT(*) AS n FROM admin_alerts
+                    WHERE error_type = %(error_type)s
+                      AND created_at > NOW() - make_interval(secs => %(window)s)
+                ) recent
+                RETURNING immediate
+            """, {"ticket_id": ticket_id, "error_type": error_type, "name": name, "account": account,
+                  "link": tracking_link, "threshold": self.immediate_threshold, "window": self.window})
+            immediate = cursor.fetchone()[0]
+
+        if immediate:
+            subject, html_content = self.ticket_template(ticket_id, name, account, error_type, tracking_link)
+            self.outbox.enqueue(cursor, self.recipient, subject, html_content)
+
+    def flush_digest(self, conn):
+        """Periodic job: fold pending alerts into one digest email. Returns the number digested."""
+        cursor = conn.cursor()
+        cursor.execute(
+            "DELETE FROM admin_alerts WHERE digested_at < NOW() - make_interval(days => %s)",
+            (self.keep_days,))
+
+        cursor.execute("""
+            UPDATE admin_alerts SET digested_at = NOW()
+            WHERE id IN (
+                SELECT id FROM admin_alerts WHERE digested_at IS NULL
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING ticket_id, error_type, fullname, account_number, tracking_link, created_at
+        """)
+        rows = cursor.fetchall()
+        if not rows or not self.recipient:
+            conn.commit()
+            return len(rows)
+
+        by_type = {}
+        for ticket_id, error_type, fullname, account, link, created_at in sorted(rows, key=lambda r: r[5]):
+            by_type.setdefault(error_type, []).append({
+                "ticket_id": ticket_id, "fullname": fullname, "account_number": account,
+                "tracking_link": link, "created_at": created_at,
+            })
+        groups = sorted(((error_type, len(items), items[:DIGEST_LIST_LIMIT])
+                         for error_type, items in by_type.items()),
+                        key=lambda g: -g[1])
+
+        subject, html_content = self.digest_template(groups, self.window)
+        self.outbox.enqueue(cursor, self.recipient, subject, html_content)
+        conn.commit()
+        self.outbox.wake()
+        return len(rows)
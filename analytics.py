@@ -0,0 +1,205 @@
+"""
+Support analytics served from rollup tables.
+
+The rollups are updated by the same transactions that write tickets, so the
+analytics page never aggregates ``tickets`` or ``messages``:
+
+* ``ticket_daily_stats``   tickets opened and closed per day and error type
+* ``ticket_backlog``       open tickets per error type
+* ``ticket_duration_stats`` time to first admin reply and time to close, as
+  counts per log-scaled bucket (each bucket is 25% wider than the last), per
+  day and error type. Medians and p90s are read off the bucket counts, which
+  keeps them within about 12% of the exact value.
+
+Reopening a ticket puts it back in the backlog; its earlier close still
+counts in that day's ``closed``. Deleting an open ticket removes it from the
+backlog but not from history.
+
+``rebuild`` recomputes everything from ``tickets``, ``messages`` and the
+archive tables; run it once after adding the tables (``flask --app app
+analytics-rebuild``) and whenever the rollups are suspected to have drifted.
+"""
+import math
+
+import psycopg2.extras
+
+BUCKET_GROWTH = 1.25
+
+# Metrics in ticket_duration_stats.
+FIRST_REPLY = "first_reply"
+CLOSE = "close"
+
+_ADD_DURATIONS = """
+INSERT INTO ticket_duration_stats (metric, day, error_type, bucket, count)
+SELECT %s, CURRENT_DATE, d.error_type, analytics_bucket(d.seconds), COUNT(*)
+FROM unnest(%s::text[], %s::float8[]) AS d (error_type, seconds)
+GROUP BY 1, 2, 3, 4
+ON CONFLICT (metric, day, error_type, bucket)
+    DO UPDATE SET count = ticket_duration_stats.count + EXCLUDED.count
+"""
+
+
+def bucket_seconds(bucket):
+    """Representative duration for a bucket: the geometric middle of its range."""
+    return BUCKET_GROWTH ** (bucket + 0.5)
+
+
+def percentile_from_buckets(counts, pct):
+    """``counts`` is {bucket: n}; returns seconds, or None when empty."""
+    total = sum(counts.values())
+    if not total:
+        return None
+    rank = math.ceil(total * pct / 100)
+    seen = 0
+    for bucket in sorted(counts):
+        seen += counts[bucket]
+        if seen >= rank:
+            return round(bucket_seconds(bucket), 1)
+
+
+# History for rebuilds: active tickets plus those moved by archive.py.
+_ALL_TICKETS = """
+    SELECT error_type, created_at, closed_at, first_admin_reply_at FROM tickets
+    UNION ALL
+    SELECT error_type, created_at, closed_at, first_admin_reply_at FROM tickets_archive
+"""
+
+
+class TicketAnalytics:
+    """Rollup writers take the caller's cursor; the caller commits."""
+
+    def ticket_opened(self, cursor, error_type):
+        cursor.execute("""
+            WITH daily AS (
+                INSERT INTO ticket_daily_stats (day, error_type, opened) VALUES (CURRENT_DATE, %(error_type)s, 1)
+                ON CONFLICT (day, error_type) DO UPDATE SET opened = ticket_daily_stats.opened + 1
+            )
+            INSERT INTO ticket_backlog (error_type, open_count) VALUES (%(error_type)s, 1)
+            ON CONFLICT (error_type) DO UPDATE SET open_count = ticket_backlog.open_count + 1
+        """, {"error_type": error_type})
+
+    def admin_replied(self, cursor, ticket_id):
+        """Stamp the first admin reply on a ticket and record how long it took."""
+        cursor.execute("""
+            WITH replied AS (
+                UPDATE tickets SET first_admin_reply_at = NOW()
+                WHERE ticket_id = %s AND first_admin_reply_at IS NULL
+                RETURNING error_type, EXTRACT(EPOCH FROM first_admin_reply_at - created_at) AS seconds
+            )
+            INSERT INTO ticket_duration_stats (metric, day, error_type, bucket, count)
+            SELECT %s, CURRENT_DATE, error_type, analytics_bucket(seconds), 1 FROM replied
+            ON CONFLICT (metric, day, error_type, bucket)
+                DO UPDATE SET count = ticket_duration_stats.count + 1
+        """, (ticket_id, FIRST_REPLY))
+
+    def tickets_changed(self, cursor, action, rows):
+        """
+        Apply a close, reopen or delete. ``rows`` are (error_type, was_open,
+        seconds_open) for each ticket the statement changed; ``seconds_open``
+        is only used for closes.
+        """
+        if not rows:
+            return
+        backlog, closed = {}, {}
+        for error_type, was_open, _ in rows:
+            if action == 'reopen':
+                backlog[error_type] = backlog.get(error_type, 0) + 1
+            elif was_open:
+                backlog[error_type] = backlog.get(error_type, 0) - 1
+            if action == 'close':
+                closed[error_type] = closed.get(error_type, 0) + 1
+
+        if backlog:
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO ticket_backlog (error_type, open_count) VALUES %s
+                ON CONFLICT (error_type) DO UPDATE SET open_count = ticket_backlog.open_count + EXCLUDED.open_count
+            """, list(backlog.items()))
+        if closed:
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO ticket_daily_stats (day, error_type, closed) VALUES %s
+                ON CONFLICT (day, error_type) DO UPDATE SET closed = ticket_daily_stats.closed + EXCLUDED.closed
+            """, list(closed.items()), template="(CURRENT_DATE, %s, %s)")
+            cursor.execute(_ADD_DURATIONS, (CLOSE, [r[0] for r in rows], [float(r[2] or 0) for r in rows]))
+
+    # ---- Reading ---- #
+    def report(self, cursor, days=30):
+        """Volume, backlog and duration percentiles for the last ``days`` days."""
+        cursor.execute("""
+            SELECT day, error_type, opened, closed FROM ticket_daily_stats
+            WHERE day > CURRENT_DATE - %s
+            ORDER BY day, error_type
+        """, (days,))
+        volume = [{"day": day.isoformat(), "error_type": error_type, "opened": opened, "closed": closed}
+                  for day, error_type, opened, closed in cursor.fetchall()]
+
+        cursor.execute("SELECT error_type, open_count FROM ticket_backlog WHERE open_count <> 0 ORDER BY error_type")
+        backlog = dict(cursor.fetchall())
+
+        cursor.execute("""
+            SELECT metric, error_type, bucket, SUM(count) FROM ticket_duration_stats
+            WHERE day > CURRENT_DATE - %s
+            GROUP BY metric, error_type, bucket
+        """, (days,))
+        buckets = {}
+        for metric, error_type, bucket, count in cursor.fetchall():
+            for key in (error_type, "all"):
+                counts = buckets.setdefault(metric, {}).setdefault(key, {})
+                counts[bucket] = counts.get(bucket, 0) + int(count)
+
+        durations = {}
+        for metric in (FIRST_REPLY, CLOSE):
+            durations[metric] = {
+                key: {"count": sum(counts.values()),
+                      "median_seconds": percentile_from_buckets(counts, 50),
+                      "p90_seconds": percentile_from_buckets(counts, 90)}
+                for key, counts in sorted(buckets.get(metric, {}).items())
+            }
+
+        return {
+            "days": days,
+            "volume": volume,
+            "backlog": {"total": sum(backlog.values()), "by_error_type": backlog},
+            "durations": durations,
+        }
+
+    # ---- Maintenance ---- #
+    def rebuild(self, conn):
+        """Recompute every rollup from the base and archive tables in one transaction."""
+        cursor = conn.cursor()
+        # Holds off ticket writes (not reads) until the rollups are consistent again.
+        cursor.execute("LOCK TABLE tickets IN SHARE ROW EXCLUSIVE MODE")
+        cursor.execute("TRUNCATE ticket_daily_stats, ticket_backlog, ticket_duration_stats")
+        cursor.execute("""
+            UPDATE tickets t SET first_admin_reply_at = m.first_at
+            FROM (
+                SELECT ticket_id, MIN(created_at) AS first_at FROM messages
+                WHERE sender_type = 'admin' GROUP BY ticket_id
+            ) m
+            WHERE m.ticket_id = t.ticket_id AND t.first_admin_reply_at IS DISTINCT FROM m.first_at
+        """)
+        cursor.execute(f"""
+            INSERT INTO ticket_daily_stats (day, error_type, opened, closed)
+            SELECT day, error_type, SUM(opened), SUM(closed) FROM (
+                SELECT created_at::date AS day, error_type, 1 AS opened, 0 AS closed FROM ({_ALL_TICKETS}) t
+                UNION ALL
+                SELECT closed_at::date, error_type, 0, 1 FROM ({_ALL_TICKETS}) t WHERE closed_at IS NOT NULL
+            ) events
+            GROUP BY day, error_type
+        """)
+        cursor.execute("""
+            INSERT INTO ticket_backlog (error_type, open_count)
+            SELECT error_type, COUNT(*) FROM tickets WHERE status <> 'Closed' GROUP BY error_type
+        """)
+        cursor.execute(f"""
+            INSERT INTO ticket_duration_stats (metric, day, error_type, bucket, count)
+            SELECT metric, day, error_type, analytics_bucket(seconds), COUNT(*) FROM (
+                SELECT %s AS metric, first_admin_reply_at::date AS day, error_type,
+                       EXTRACT(EPOCH FROM first_admin_reply_at - created_at) AS seconds
+                FROM ({_ALL_TICKETS}) t WHERE first_admin_reply_at IS NOT NULL
+                UNION ALL
+                SELECT %s, closed_at::date, error_type, EXTRACT(EPOCH FROM closed_at - created_at)
+                FROM ({_ALL_TICKETS}) t WHERE closed_at IS NOT NULL
+            ) durations
+            GROUP BY 1, 2, 3, 4
+        """, (FIRST_REPLY, CLOSE))
+        conn.commit()
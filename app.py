@@ -1,23 +1,44 @@
-from flask import Flask, render_template, request, redirect, flash, url_for, session, jsonify, abort
+from flask import Flask, Response, render_template, request, redirect, flash, url_for, session, jsonify, abort, g
 from flask_wtf import FlaskForm
 from flask_wtf.csrf import CSRFProtect
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from wtforms import StringField, TextAreaField, SelectField
+from wtforms import StringField, TextAreaField, SelectField, HiddenField
 from flask_wtf.file import FileField, FileAllowed
-from wtforms.validators import DataRequired, Email, Length, Regexp
+from wtforms.validators import DataRequired, Email, Length, Regexp, Optional
 from werkzeug.utils import secure_filename
+from werkzeug.exceptions import RequestEntityTooLarge
 from dotenv import load_dotenv
-from supabase import create_client, Client
 import psycopg2
+import psycopg2.errors
 import psycopg2.extras
-import random
-from datetime import datetime, timedelta
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+from db import ConnectionPool, PoolError, PoolTimeout
+from outbox import EmailOutbox
+from alerts import AdminAlerts
+from jobs import PeriodicJobs
+from otp import OtpStore
+from events import TicketEventHub, StreamLimitReached
+from cache import TicketCache, LocalVersionStore, RedisVersionStore
+from analytics import TicketAnalytics
+from archive import TicketArchive
+from dashboard import TicketDashboard
+from replica import ReplicaRouter
+import search
+import export
+from storage import SupabaseStorage, LocalStorage, UploadManager, UploadRejected, stage_upload
+from thumbnails import DerivativeManager
+import metrics
+import schema
+import secrets
+from datetime import datetime, date, timedelta
 import uuid
 import os
+import json
+import time
+import base64
 import logging
-import requests
 
 load_dotenv()
 
@@ -28,6 +49,8 @@ app.secret_key = os.getenv('SECRET_KEY', 'fallback-dev-key')
 # ---- Configuration ---- #
 
 # Security & Rate Limiting
+# RATELIMIT_ENABLED=false is only meant for load tests (see bench/).
+app.config['RATELIMIT_ENABLED'] = os.getenv('RATELIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
 csrf = CSRFProtect(app)
 limiter = Limiter(key_func=get_remote_address, app=app)
 
@@ -40,9 +63,48 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 DATABASE_URL = os.getenv("DATABASE_URL")
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+# Attachment storage: "supabase" in production, "local" writes under LOCAL_UPLOAD_DIR
+# (useful for development and offline benchmarks).
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'supabase' if SUPABASE_URL else 'local')
+LOCAL_UPLOAD_DIR = os.getenv('LOCAL_UPLOAD_DIR', os.path.join(app.root_path, 'static', 'uploads'))
+LOCAL_UPLOAD_URL = os.getenv('LOCAL_UPLOAD_URL', '/static/uploads')
+MAX_UPLOAD_MB = int(os.getenv('MAX_UPLOAD_MB', 10))
+UPLOAD_ASYNC = os.getenv('UPLOAD_ASYNC', 'true').lower() in ('1', 'true', 'yes')  # write the ticket first, upload in background
+UPLOAD_WORKERS = int(os.getenv('UPLOAD_WORKERS', 2))
+UPLOAD_TMP_DIR = os.getenv('UPLOAD_TMP_DIR') or None
+THUMBNAILS_ENABLED = os.getenv('THUMBNAILS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', 1))  # processes per web worker
+THUMBNAIL_SIZE = int(os.getenv('THUMBNAIL_SIZE', 320))  # px, longest edge
+PREVIEW_SIZE = int(os.getenv('PREVIEW_SIZE', 1280))
+
+# Whole request body limit; the extra megabyte leaves room for the form fields.
+app.config['MAX_CONTENT_LENGTH'] = (MAX_UPLOAD_MB + 1) * 1024 * 1024
+
 ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
 
+# Connection pool (one per gunicorn worker process).
+# Size it to the number of request threads per worker (gunicorn --threads);
+# total Postgres connections = workers * DB_POOL_MAX_SIZE.
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', 5))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))  # seconds to wait for a free connection
+DB_POOL_MAX_LIFETIME = float(os.getenv('DB_POOL_MAX_LIFETIME', 1800))
+DB_POOL_MAX_IDLE = float(os.getenv('DB_POOL_MAX_IDLE', 300))
+DB_POOL_CHECK_AFTER = float(os.getenv('DB_POOL_CHECK_AFTER', 30))  # ping idle connections older than this
+
+# Optional streaming replica for ticket pages, lists and chat polling. Reads go to the
+# primary while the replica is unreachable or more than REPLICA_MAX_LAG seconds behind,
+# and for REPLICA_PIN_SECONDS after a session writes, so people always see their own changes.
+DATABASE_REPLICA_URL = os.getenv('DATABASE_REPLICA_URL') or None
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 5))  # seconds
+REPLICA_CHECK_INTERVAL = float(os.getenv('REPLICA_CHECK_INTERVAL', 2))  # seconds between lag checks
+REPLICA_PIN_SECONDS = float(os.getenv('REPLICA_PIN_SECONDS', REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL))
+
+# Metrics at /metrics (Prometheus text format). With several gunicorn workers, point
+# METRICS_DIR at a directory they share (empty it on deploy) so every scrape sees all of them.
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+METRICS_DIR = os.getenv('METRICS_DIR') or None
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', 1000))  # log a timing breakdown above this; 0 disables
+
 # SMTP configuration
 SMTP_SERVER = os.getenv('SMTP_SERVER', 'smtp.gmail.com')
 SMTP_PORT = int(os.getenv('SMTP_PORT', 587))
@@ -52,40 +114,207 @@ SMTP_USE_STARTTLS = os.getenv('SMTP_USE_STARTTLS', 'true').lower() in ('1', 'tru
 #URL mail microservice
 EMAIL_SERVICE_URL = os.getenv("EMAIL_SERVICE_URL")  # e.g. "https://droid.pythonanywhere.com/"
 
-# ---- EMAIL HELPER FUNCTION (SMTP) ---- #
-def send_email_via_smtp(recipient, subject, html_body):
+# Email outbox delivery (background threads per worker; 0 disables in-process delivery
+# so a separate `flask outbox-worker` process can drain the queue instead)
+EMAIL_OUTBOX_CONCURRENCY = int(os.getenv('EMAIL_OUTBOX_CONCURRENCY', 2))
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv('EMAIL_OUTBOX_BATCH_SIZE', 20))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv('EMAIL_OUTBOX_MAX_ATTEMPTS', 8))
+EMAIL_OUTBOX_BACKOFF_BASE = float(os.getenv('EMAIL_OUTBOX_BACKOFF_BASE', 30))  # seconds, doubled per attempt
+EMAIL_OUTBOX_BACKOFF_MAX = float(os.getenv('EMAIL_OUTBOX_BACKOFF_MAX', 3600))
+EMAIL_OUTBOX_POLL_INTERVAL = float(os.getenv('EMAIL_OUTBOX_POLL_INTERVAL', 5))
+
+# New-ticket alerts to MAIL_USERNAME: "immediate" emails every ticket; "digest" emails the
+# first ADMIN_DIGEST_IMMEDIATE tickets per error type in a window and summarises the rest.
+ADMIN_ALERT_MODE = os.getenv('ADMIN_ALERT_MODE', 'immediate')
+ADMIN_DIGEST_WINDOW = float(os.getenv('ADMIN_DIGEST_WINDOW', 300))  # seconds
+ADMIN_DIGEST_IMMEDIATE = int(os.getenv('ADMIN_DIGEST_IMMEDIATE', 1))
+
+# New tickets with the same account, reference and error type as one filed within this
+# many seconds are flagged as possible duplicates (0 disables)
+NEAR_DUPLICATE_WINDOW = float(os.getenv('NEAR_DUPLICATE_WINDOW', 600))
+
+# Login codes
+OTP_TTL = int(os.getenv('OTP_TTL', 600))  # seconds
+OTP_MAX_ATTEMPTS = int(os.getenv('OTP_MAX_ATTEMPTS', 5))  # wrong guesses before a code is void
+OTP_SWEEP_INTERVAL = float(os.getenv('OTP_SWEEP_INTERVAL', 300))  # seconds between expired-code cleanups
+
+# Tickets opened from the embeddable widget (static/sdk.js) are accessed with a signed
+# token instead of a session; it expires after this many seconds
+WIDGET_TOKEN_MAX_AGE = int(os.getenv('WIDGET_TOKEN_MAX_AGE', 30 * 86400))
+
+# Periodic jobs (digests, cleanup) run on a scheduler thread in each worker; set to false
+# and run `flask jobs-worker` to keep them out of the web processes.
+JOBS_ENABLED = os.getenv('JOBS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+# Tickets closed longer than this move to the archive tables (0 disables archival)
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', 180))
+ARCHIVE_BATCH_SIZE = int(os.getenv('ARCHIVE_BATCH_SIZE', 500))  # tickets per transaction
+ARCHIVE_INTERVAL = float(os.getenv('ARCHIVE_INTERVAL', 3600))  # seconds between archival runs
+
+# Chat push (Server-Sent Events). Each open stream holds one request thread,
+# so run gunicorn with --worker-class gthread and --threads comfortably above
+# SSE_MAX_STREAMS; clients fall back to polling once a worker is full.
+SSE_MAX_STREAMS = int(os.getenv('SSE_MAX_STREAMS', 20))  # per worker process
+SSE_HEARTBEAT = float(os.getenv('SSE_HEARTBEAT', 15))  # seconds between keep-alive comments
+SSE_MAX_DURATION = float(os.getenv('SSE_MAX_DURATION', 600))  # streams are recycled after this
+
+# Read cache for ticket pages and chat threads (per worker process). With CACHE_REDIS_URL
+# the version counters are shared through Redis; otherwise workers invalidate each
+# other over the ticket_events NOTIFY channel and the TTL bounds any staleness.
+TICKET_CACHE_SIZE = int(os.getenv('TICKET_CACHE_SIZE', 500))  # tickets per worker; 0 disables
+TICKET_CACHE_TTL = float(os.getenv('TICKET_CACHE_TTL', 30))  # seconds
+# Chat polls only need each ticket's owner and newest message id; those small "heads"
+# are cached separately so a poll never reloads a whole thread (0 disables)
+TICKET_HEAD_CACHE_SIZE = int(os.getenv('TICKET_HEAD_CACHE_SIZE', 5000))  # tickets per worker
+CACHE_REDIS_URL = os.getenv('CACHE_REDIS_URL')  # optional, needs the redis package
+
+# ---- Email Templates ---- #
+def new_ticket_email(ticket_id, name, account, error_type, tracking_link):
+    subject = f"New Ticket: {ticket_id}"
+    html_content = f"""
+        <h3>New Ticket Received</h3>
+        <p><strong>From:</strong> {name}</p>
+        <p><strong>Account:</strong> {account}</p>
+        <p><strong>Issue:</strong> {error_type}</p>
+        <br>
+        <a href="{tracking_link}" style="background-color: #007bff; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px;">View Ticket</a>
+        <p style="margin-top:20px; font-size:12px; color:#666;">Or copy link: {tracking_link}</p>
     """
-    Sends email by calling the FastAPI email microservice.
-    Returns True if successful, False otherwise.
+    return subject, html_content
+
+def otp_email(code, verify_link):
+    subject = "Your Access Code"
+
+    # --- PROFESSIONAL OTP TEMPLATE --- #
+    html_content = f"""
+    <!DOCTYPE html>
+    <html>
+    <body style="margin: 0; padding: 0; font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background-color: #f4f6f8;">
+        <div style="max-width: 600px; margin: 0 auto; padding: 40px 20px;">
+            <div style="background-color: #ffffff; padding: 30px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); text-align: center;">
+
+                <h2 style="color: #333333; margin-top: 0;">Verify Your Login</h2>
+                <p style="color: #666666; font-size: 16px;">
+                    Use the code below to access your dashboard.
+                </p>
+
+                <div style="background-color: #eef2f7; padding: 20px; margin: 30px 0; border-radius: 8px; letter-spacing: 5px;">
+                    <span style="font-size: 32px; font-weight: bold; color: #2c3e50; font-family: monospace;">{code}</span>
+                </div>
+
+                <a href="{verify_link}" 
+                   style="background-color: #28a745; color: #ffffff; padding: 12px 30px; text-decoration: none; border-radius: 5px; font-weight: bold; display: inline-block;">
+                    Verify Automatically
+                </a>
+
+                <p style="margin-top: 30px; font-size: 12px; color: #999999;">
+                    This code will expire in {OTP_TTL // 60} minutes.<br>
+                    If you didn't request this code, you can safely ignore this email.
+                </p>
+            </div>
+        </div>
+    </body>
+    </html>
     """
-    if not EMAIL_SERVICE_URL:
-        logger.error("EMAIL_SERVICE_URL not set in environment variables")
-        return False
+    # --------------------------------- #
+    return subject, html_content
+
+def reply_email(ticket_id, message_content, tracking_link):
+    subject = f"Update on Ticket {ticket_id}"
+
+    # --- NEW PROFESSIONAL HTML TEMPLATE --- #
+    html_content = f"""
+    <!DOCTYPE html>
+    <html>
+    <body style="margin: 0; padding: 0; font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background-color: #f4f6f8;">
+        <div style="max-width: 600px; margin: 0 auto; padding: 40px 20px;">
+            <div style="background-color: #ffffff; padding: 30px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1);">
+
+                <h2 style="color: #333333; margin-top: 0; font-size: 24px;">New Reply Received</h2>
+                <p style="color: #666666; font-size: 16px; line-height: 1.5;">
+                    There is a new update regarding your ticket <strong>#{ticket_id}</strong>.
+                </p>
+
+                <div style="background-color: #f8f9fa; border-left: 5px solid #007bff; padding: 15px 20px; margin: 25px 0; border-radius: 4px;">
+                    <p style="margin: 0; color: #555555; font-style: italic; font-size: 16px;">
+                        "{message_content}"
+                    </p>
+                </div>
 
-    try:
-        response = requests.post(
-            EMAIL_SERVICE_URL,
-            json={
-                "to": recipient,
-                "subject": subject,
-                "html": html_body
-            },
-            timeout=10  # avoid hanging
-        )
-        res_json = response.json()
-
-        if res_json.get("success"):
-            logger.info(f"Email sent successfully to {recipient} via service")
-            return True
-        else:
-            logger.error(f"Email service returned error: {res_json.get('error')}")
-            return False
+                <div style="text-align: center; margin-top: 30px;">
+                    <a href="{tracking_link}" 
+                       style="background-color: #007bff; color: #ffffff; padding: 12px 25px; text-decoration: none; border-radius: 5px; font-weight: bold; display: inline-block;">
+                        View Full Conversation
+                    </a>
+                </div>
+
+                <p style="margin-top: 30px; font-size: 12px; color: #999999; text-align: center;">
+                    If you did not submit this ticket, please ignore this email.
+                </p>
+            </div>
+        </div>
+    </body>
+    </html>
+    """
+    # ------------------------------------- #
+    return subject, html_content
+
+def status_email(status, tickets):
+    """One email per user for a bulk close/reopen; ``tickets`` is [(ticket_id, tracking_link), ...]."""
+    verb = "closed" if status == 'Closed' else "reopened"
+    if len(tickets) == 1:
+        subject = f"Ticket {tickets[0][0]} has been {verb}"
+    else:
+        subject = f"{len(tickets)} of your tickets have been {verb}"
+    items = "".join(f'<li><a href="{link}">{ticket_id}</a></li>' for ticket_id, link in tickets)
+    html_content = f"""
+        <h3>Ticket Update</h3>
+        <p>The following ticket{'s have' if len(tickets) != 1 else ' has'} been {verb} by our support team:</p>
+        <ul>{items}</ul>
+        <p style="margin-top:20px; font-size:12px; color:#666;">Reply from the ticket page if you still need help.</p>
+    """
+    return subject, html_content
+
+def upload_failed_email(ticket_id, filename):
+    """Sent to the ticket owner and the admin when a background upload gives up."""
+    subject = f"Attachment for ticket {ticket_id} could not be saved"
+    html_content = f"""
+        <h3>Attachment Not Saved</h3>
+        <p>Ticket <strong>{ticket_id}</strong> was received, but its attachment (<code>{filename}</code>)
+           could not be stored.</p>
+        <p>Please open a new ticket with the file if support still needs it.</p>
+    """
+    return subject, html_content
+
+def admin_digest_email(groups, window):
+    total = sum(count for _, count, _ in groups)
+    labels = dict(ERROR_TYPES)
+    subject = f"{total} new tickets in the last {round(window / 60)} min"
+
+    sections = []
+    for error_type, count, rows in groups:
+        items = "".join(
+            f'<li><a href="{row["tracking_link"]}">{row["ticket_id"]}</a> - {row["fullname"]} ({row["account_number"]})</li>'
+            for row in rows)
+        more = f"<p style=\"color:#666;\">...and {count - len(rows)} more</p>" if count > len(rows) else ""
+        sections.append(f"<h4>{labels.get(error_type, error_type)}: {count}</h4><ul>{items}</ul>{more}")
+
+    html_content = f"""
+        <h3>New Tickets Digest</h3>
+        <p>{total} tickets arrived that were not alerted individually.</p>
+        {''.join(sections)}
+    """
+    return subject, html_content
 
-    except Exception as e:
-        logger.error(f"Failed to contact email service: {e}")
-        return False
-        
 # ---- Form Class ---- #
+ERROR_TYPES = [
+    ('payment_failed', 'Payment Failed'),
+    ('wrong_deduction', 'Wrong Deduction'),
+    ('not_credited', 'Not Credited'),
+    ('bank_one_loading', 'BankOne Issue'),
+    ('other', 'Other'),
+]
+
 class TicketForm(FlaskForm):
     name = StringField('Name', validators=[DataRequired()])
     account = StringField('Account',
@@ -105,104 +334,632 @@ class TicketForm(FlaskForm):
         ])
     email = StringField('Email', validators=[DataRequired(), Email()])
     reference = StringField('Reference')
-    error_type = SelectField('Error Type', choices=[
-        ('', 'Select Error Type'),
-        ('payment_failed', 'Payment Failed'),
-        ('wrong_deduction', 'Wrong Deduction'),
-        ('not_credited', 'Not Credited'),
-        ('bank_one_loading', 'BankOne Issue'),
-        ('other', 'Other'),
-    ], validators=[DataRequired()])
+    error_type = SelectField('Error Type', choices=[('', 'Select Error Type')] + ERROR_TYPES,
+                             validators=[DataRequired()])
     description = TextAreaField('Description', validators=[DataRequired()])
     file = FileField('Upload Screenshot (Optional)', validators=[
         FileAllowed(['jpg', 'png', 'pdf'], 'Only images and PDFs are allowed.')
     ])
+    # Issued with the form and kept across re-renders, so resubmitting the same
+    # form (double-click, refresh, retry) maps back to the first ticket.
+    idempotency_key = HiddenField(default=lambda: secrets.token_urlsafe(16),
+                                  validators=[Optional(), Length(max=64), Regexp('^[A-Za-z0-9_-]+$')])
+
+# ---- Metrics ---- #
+metrics.REGISTRY.directory = METRICS_DIR
+
+def start_request_metrics():
+    if not METRICS_ENABLED:
+        return
+    metrics.REGISTRY.ensure_exporter()
+    metrics.begin_trace()
+    metrics.HTTP_REQUESTS_IN_FLIGHT.inc()
+    g.request_in_flight = True
+    g.request_started = time.perf_counter()
+
+# Run ahead of CSRFProtect's and the limiter's hooks, which were registered first, so
+# requests they reject (400, 429) are timed and counted like any other.
+app.before_request_funcs.setdefault(None, []).insert(0, start_request_metrics)
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.HTTP_REQUEST_SECONDS.observe(elapsed, method=request.method, route=route,
+                                         status=response.status_code)
+    if response.status_code >= 500:
+        metrics.HTTP_REQUEST_ERRORS.inc(method=request.method, route=route)
+
+    trace = metrics.end_trace()
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        parts = [f"{name} {seconds * 1000:.0f} ms/{calls}" for name, (seconds, calls) in sorted(trace.items())]
+        other = elapsed - sum(seconds for seconds, _ in trace.values())
+        parts.append(f"other {other * 1000:.0f} ms")
+        logger.warning(f"Slow request {request.method} {request.path} -> {response.status_code} "
+                       f"in {elapsed * 1000:.0f} ms: {', '.join(parts)}")
+    return response
+
+@app.teardown_request
+def finish_request_metrics(exc):
+    if g.pop('request_in_flight', False):
+        metrics.HTTP_REQUESTS_IN_FLIGHT.dec()
+        metrics.end_trace()
+
+@app.route('/metrics')
+@limiter.exempt
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
 
 # ---- Database Helper ---- #
-def get_db_connection():
+db_pool = ConnectionPool(
+    DATABASE_URL,
+    max_size=DB_POOL_MAX_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    max_lifetime=DB_POOL_MAX_LIFETIME,
+    max_idle=DB_POOL_MAX_IDLE,
+    check_after=DB_POOL_CHECK_AFTER,
+    connect_kwargs={"connect_timeout": 5,
+                    "connection_factory": metrics.TimedConnection if METRICS_ENABLED else None},
+)
+
+replica_pool = ConnectionPool(
+    DATABASE_REPLICA_URL,
+    max_size=DB_POOL_MAX_SIZE,
+    timeout=DB_POOL_TIMEOUT,
+    max_lifetime=DB_POOL_MAX_LIFETIME,
+    max_idle=DB_POOL_MAX_IDLE,
+    check_after=DB_POOL_CHECK_AFTER,
+    connect_kwargs={"connect_timeout": 5,
+                    "connection_factory": metrics.TimedConnection if METRICS_ENABLED else None},
+) if DATABASE_REPLICA_URL else None
+replica_router = ReplicaRouter(db_pool, replica_pool, max_lag=REPLICA_MAX_LAG,
+                               check_interval=REPLICA_CHECK_INTERVAL, pin_seconds=REPLICA_PIN_SECONDS)
+
+def read_pool():
+    """Pool for a read-only route: the replica unless it is lagging or this session just wrote."""
+    return replica_router.pool(session.get('wrote_at'))
+
+def note_write():
+    """Pin this session to the primary for a while so it reads its own write."""
+    if replica_router.enabled:
+        session['wrote_at'] = time.time()
+
+@app.errorhandler(PoolError)
+def handle_pool_error(e):
+    logger.error(f"Database unavailable for {request.path}: {e}")
+    status = 503 if isinstance(e, PoolTimeout) else 500
+    if request.path.startswith('/api/'):
+        return jsonify({"error": "Database error"}), status
+    return "Database Error", status
+
+@app.route('/healthz/db')
+@limiter.exempt
+def db_pool_stats():
+    return jsonify(db_pool.stats())
+
+@app.route('/healthz/replica')
+@limiter.exempt
+def replica_stats():
+    return jsonify(replica_router.stats())
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create or upgrade the tables and indexes the app relies on."""
+    applied = schema.migrate(db_pool)
+    if applied:
+        print(f"Applied migrations {', '.join(map(str, applied))}.")
+    print(f"Schema is at version {schema.current_version(db_pool)}.")
+
+# ---- Email Outbox ---- #
+email_outbox = EmailOutbox(
+    db_pool,
+    EMAIL_SERVICE_URL,
+    concurrency=EMAIL_OUTBOX_CONCURRENCY,
+    batch_size=EMAIL_OUTBOX_BATCH_SIZE,
+    max_attempts=EMAIL_OUTBOX_MAX_ATTEMPTS,
+    backoff_base=EMAIL_OUTBOX_BACKOFF_BASE,
+    backoff_max=EMAIL_OUTBOX_BACKOFF_MAX,
+    poll_interval=EMAIL_OUTBOX_POLL_INTERVAL,
+)
+
+@app.before_request
+def start_background_workers():
+    # Started lazily so each forked gunicorn worker gets its own threads.
+    email_outbox.ensure_started()
+    periodic_jobs.ensure_started()
+    if (ticket_cache.max_entries or ticket_heads.max_entries) and not cache_versions.shared:
+        # Cache invalidations from other workers arrive over LISTEN.
+        ticket_events.start()
+
+@app.route('/healthz/outbox')
+@limiter.exempt
+def outbox_stats():
+    return jsonify(email_outbox.stats())
+
+@app.cli.command('outbox-worker')
+def outbox_worker_command():
+    """Drain the email outbox in the foreground."""
+    if email_outbox.concurrency <= 0:
+        email_outbox.concurrency = 2
+    email_outbox.run_forever()
+
+@app.cli.command('outbox-requeue')
+def outbox_requeue_command():
+    """Retry every dead-lettered email."""
+    print(f"Requeued {email_outbox.requeue_dead()} emails.")
+
+# ---- Admin Alerts & Periodic Jobs ---- #
+admin_alerts = AdminAlerts(
+    email_outbox,
+    os.getenv('MAIL_USERNAME'),
+    new_ticket_email,
+    admin_digest_email,
+    mode=ADMIN_ALERT_MODE,
+    window=ADMIN_DIGEST_WINDOW,
+    immediate_threshold=ADMIN_DIGEST_IMMEDIATE,
+)
+
+otp_store = OtpStore(app.secret_key, ttl=OTP_TTL, max_attempts=OTP_MAX_ATTEMPTS)
+
+periodic_jobs = PeriodicJobs(db_pool, enabled=JOBS_ENABLED)
+if ADMIN_ALERT_MODE == 'digest':
+    periodic_jobs.register('admin-digest', ADMIN_DIGEST_WINDOW, admin_alerts.flush_digest)
+periodic_jobs.register('otp-sweep', OTP_SWEEP_INTERVAL, otp_store.sweep)
+
+@app.route('/healthz/jobs')
+@limiter.exempt
+def jobs_stats():
+    return jsonify(periodic_jobs.stats())
+
+@app.cli.command('jobs-worker')
+def jobs_worker_command():
+    """Run the periodic jobs scheduler in the foreground."""
+    periodic_jobs.run_forever()
+
+# ---- Chat Events ---- #
+ticket_events = TicketEventHub(DATABASE_URL, max_streams=SSE_MAX_STREAMS)
+
+@app.route('/healthz/events')
+@limiter.exempt
+def events_stats():
+    return jsonify(ticket_events.stats())
+
+# ---- Read Cache ---- #
+if CACHE_REDIS_URL:
+    cache_versions = RedisVersionStore(CACHE_REDIS_URL)
+else:
+    # Versions of tickets nobody has written to lately are forgotten, bounding memory in
+    # long-running workers; keep far more of them than both caches hold.
+    cache_versions = LocalVersionStore(max_keys=10 * max(TICKET_CACHE_SIZE, TICKET_HEAD_CACHE_SIZE, 1000))
+ticket_cache = TicketCache(cache_versions, max_entries=TICKET_CACHE_SIZE, ttl=TICKET_CACHE_TTL)
+# Shares the version counters, so every bump that drops a thread drops its head too.
+ticket_heads = TicketCache(cache_versions, max_entries=TICKET_HEAD_CACHE_SIZE, ttl=TICKET_CACHE_TTL)
+
+def invalidate_cached_ticket(event):
+    """
+    Listener for other workers' writes. ``ticket_cache`` bumps the shared
+    version once; heads are dropped as well so that a resync (no ticket_id),
+    which cannot bump every version, clears both caches.
+    """
+    ticket_cache.handle_event(event)
+    ticket_heads.invalidate_local(event.get('ticket_id'))
+
+ticket_events.add_listener(invalidate_cached_ticket)
+
+TICKET_COLUMNS = ("ticket_id, fullname, account_number, email, reference, error_type, description, "
+                  "status, file_path, thumbnail_path, preview_path, created_at, closed_at")
+
+TICKET_SQL = f"SELECT {TICKET_COLUMNS} FROM tickets WHERE ticket_id = %s"
+
+THREAD_MESSAGES_SQL = "SELECT id, sender_type, content, created_at FROM messages WHERE ticket_id = %s ORDER BY id ASC"
+
+# Owner and newest message of an active or archived ticket: one index probe per table.
+THREAD_HEAD_SQL = """
+(SELECT t.email, last_msg.id AS last_id, last_msg.created_at AS last_at, FALSE AS archived
+ FROM tickets t
+ LEFT JOIN LATERAL (
+     SELECT id, created_at FROM messages WHERE ticket_id = t.ticket_id ORDER BY id DESC LIMIT 1
+ ) last_msg ON TRUE
+ WHERE t.ticket_id = %(ticket_id)s)
+UNION ALL
+(SELECT t.email, last_msg.id, last_msg.created_at, TRUE
+ FROM tickets_archive t
+ LEFT JOIN LATERAL (
+     SELECT id, created_at FROM messages_archive WHERE ticket_id = t.ticket_id ORDER BY id DESC LIMIT 1
+ ) last_msg ON TRUE
+ WHERE t.ticket_id = %(ticket_id)s)
+LIMIT 1
+"""
+
+MESSAGES_SINCE_SQL = ("SELECT id, sender_type, content, created_at FROM {messages} "
+                      "WHERE ticket_id = %s AND id > %s ORDER BY id ASC")
+
+def load_ticket_thread(ticket_id, pool=None):
+    """
+    The ticket row and its messages (oldest first) as {'ticket', 'messages'},
+    or None for an unknown ticket. Archived tickets are read from the archive
+    tables and carry ``archived_at``. Served from the read cache when current;
+    the result is shared between requests, so treat it as read-only.
+
+    ``pool`` defaults to the primary. Threads read from the replica are cached
+    for at most REPLICA_MAX_LAG seconds, and primary reads never use them.
+    """
+    pool = pool or db_pool
+    from_replica = pool is not db_pool
+    thread, version = ticket_cache.lookup(ticket_id, replica_ok=from_replica)
+    if thread is not None:
+        return thread
+
+    with pool.connection() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute(TICKET_SQL, (ticket_id,))
+        ticket = cursor.fetchone()
+        if ticket:
+            cursor.execute(THREAD_MESSAGES_SQL, (ticket_id,))
+            thread = {'ticket': ticket, 'messages': cursor.fetchall()}
+        else:
+            thread = ticket_archive.load_thread(cursor, ticket_id)
+            if not thread:
+                return None
+
+    ticket_cache.store(ticket_id, version, thread, ttl=REPLICA_MAX_LAG if from_replica else None,
+                       from_replica=from_replica)
+    return thread
+
+def load_thread_head(ticket_id, pool=None, min_last_id=None):
+    """
+    {'email', 'last_id', 'last_at', 'archived'} for a ticket, or None. Enough
+    to authorise a chat poll and answer it with a 304; cached like threads,
+    and a miss costs one indexed row rather than the whole conversation.
+    A cached head older than ``min_last_id`` is reloaded.
+    """
+    pool = pool or db_pool
+    from_replica = pool is not db_pool
+    head, version = ticket_heads.lookup(ticket_id, replica_ok=from_replica)
+    if head is not None and (min_last_id is None or (head['last_id'] or 0) >= min_last_id):
+        return head
+
+    with pool.connection() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute(THREAD_HEAD_SQL, {"ticket_id": ticket_id})
+        head = cursor.fetchone()
+    if head is None:
+        return None
+
+    ticket_heads.store(ticket_id, version, head, ttl=REPLICA_MAX_LAG if from_replica else None,
+                       from_replica=from_replica)
+    return head
+
+def load_messages_since(ticket_id, since, archived=False, pool=None):
+    """Messages newer than ``since`` (oldest first), straight from the database."""
+    with (pool or db_pool).connection() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        cursor.execute(MESSAGES_SINCE_SQL.format(messages='messages_archive' if archived else 'messages'),
+                       (ticket_id, since))
+        return cursor.fetchall()
+
+@app.route('/healthz/cache')
+@limiter.exempt
+def cache_stats():
+    # Top level is the thread cache; chat polls show up under "heads".
+    stats = ticket_cache.stats()
+    stats['heads'] = ticket_heads.stats()
+    return jsonify(stats)
+
+# ---- Archival ---- #
+ticket_archive = TicketArchive(after_days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE,
+                               on_change=ticket_cache.bump, events=ticket_events)
+if ARCHIVE_AFTER_DAYS > 0:
+    periodic_jobs.register('ticket-archive', ARCHIVE_INTERVAL, ticket_archive.run)
+
+@app.route('/healthz/archive')
+@limiter.exempt
+def archive_stats():
+    with db_pool.connection() as conn:
+        return jsonify(ticket_archive.stats(conn.cursor()))
+
+# ---- Analytics ---- #
+ticket_analytics = TicketAnalytics()
+ANALYTICS_MAX_DAYS = 365
+
+def _analytics_report(args):
+    days = min(max(args.get('days', 30, type=int), 1), ANALYTICS_MAX_DAYS)
+    with db_pool.connection() as conn:
+        return ticket_analytics.report(conn.cursor(), days)
+
+@app.route('/tickets/analytics')
+def analytics_view():
+    if not session.get('admin_authenticated'): return redirect('/tickets')
+    return render_template('analytics.html', report=_analytics_report(request.args))
+
+@app.route('/api/admin/analytics')
+def api_analytics():
+    if not session.get('admin_authenticated'):
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify(_analytics_report(request.args))
+
+@app.cli.command('analytics-rebuild')
+def analytics_rebuild_command():
+    """Recompute the analytics rollups from tickets and messages."""
+    with db_pool.connection() as conn:
+        ticket_analytics.rebuild(conn)
+    print("Analytics rollups rebuilt.")
+
+# ---- Dashboard ---- #
+ticket_dashboard = TicketDashboard()
+
+def mark_thread_read(thread):
+    """Advance the owner's read marker to the newest message in ``thread``."""
+    messages = thread['messages']
+    if messages and 'archived_at' not in thread['ticket']:
+        mark_ticket_read(thread['ticket']['ticket_id'], messages[-1]['id'])
+
+def mark_ticket_read(ticket_id, last_read_id):
+    """Advance the owner's read marker on an active ticket to ``last_read_id``."""
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        return conn
-    except Exception as e:
-        logger.error(f"Database connection failed: {e}")
+        with db_pool.connection() as conn:
+            moved = ticket_dashboard.mark_read(conn.cursor(), ticket_id, last_read_id)
+            conn.commit()
+    except (psycopg2.Error, PoolError) as e:
+        # The page is still worth showing; the badge just stays until the next visit.
+        logger.warning(f"Could not update read marker for {ticket_id}: {e}")
+        return
+    if moved:
+        note_write()
+
+# ---- Pagination & Filters ---- #
+TICKETS_PAGE_SIZE = int(os.getenv('TICKETS_PAGE_SIZE', 50))
+TICKETS_MAX_PAGE_SIZE = 200
+SEARCH_PAGE_SIZE = 25
+SEARCH_MAX_PAGE = 40  # deep OFFSETs get expensive; refine the query instead
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', 2000))  # rows per server-side cursor fetch
+
+# Open tickets first. Ranked so that every sort key is DESC, which lets a
+# single row comparison drive keyset pagination off one composite index.
+OPEN_RANK_SQL = "(CASE WHEN status = 'Open' THEN 1 ELSE 0 END)"
+
+# Walks tickets_admin_list_idx; ``where`` is empty or a WHERE clause built from the filters
+# and ADMIN_LIST_AFTER_SQL.
+ADMIN_LIST_SQL = f"""
+SELECT ticket_id, fullname, error_type, status, LEFT(description, 200) AS description,
+       file_path, thumbnail_path, account_number, email, reference, created_at, closed_at,
+       duplicate_of, {OPEN_RANK_SQL} AS open_rank
+FROM tickets
+{{where}}
+ORDER BY open_rank DESC, created_at DESC, ticket_id DESC
+LIMIT %s
+"""
+ADMIN_LIST_AFTER_SQL = f"({OPEN_RANK_SQL}, created_at, ticket_id) < (%s, %s, %s)"
+MY_TICKETS_AFTER_SQL = "(created_at, ticket_id) < (%s, %s)"
+
+def encode_cursor(*values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(token, *kinds):
+    """
+    Returns the cursor values as ``kinds`` (int, datetime or str, one per
+    value), or None (first page) for a missing, tampered or malformed cursor,
+    so a bad cursor never reaches the query.
+    """
+    if not token:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or len(values) != len(kinds):
         return None
+    decoded = []
+    for value, kind in zip(values, kinds):
+        if kind is datetime:
+            try:
+                value = datetime.fromisoformat(value)
+            except (ValueError, TypeError):
+                return None
+        elif type(value) is not kind:  # exact match: JSON true/false must not pass as an int rank
+            return None
+        decoded.append(value)
+    return decoded
+
+def _parse_date(value):
+    try:
+        return date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+def ticket_filters(args):
+    """
+    Translate admin list filters from a query string into SQL conditions.
+    Returns (clauses, params, active_filters).
+    """
+    clauses, params, active = [], [], {}
+
+    status = args.get('status', '').strip()
+    if status in ('Open', 'Closed'):
+        # The rank lets the admin list start inside tickets_admin_list_idx.
+        clauses.append(f"status = %s AND {OPEN_RANK_SQL} = %s")
+        params.extend([status, 1 if status == 'Open' else 0])
+        active['status'] = status
+
+    error_type = args.get('error_type', '').strip()
+    if error_type in dict(ERROR_TYPES):
+        clauses.append("error_type = %s")
+        params.append(error_type)
+        active['error_type'] = error_type
+
+    date_from = _parse_date(args.get('from', '').strip())
+    if date_from:
+        clauses.append("created_at >= %s")
+        params.append(date_from)
+        active['from'] = date_from.isoformat()
+
+    date_to = _parse_date(args.get('to', '').strip())
+    if date_to:
+        clauses.append("created_at < %s")
+        params.append(date_to + timedelta(days=1))
+        active['to'] = date_to.isoformat()
+
+    account = args.get('account', '').strip()
+    if account:
+        clauses.append("account_number = %s")
+        params.append(account)
+        active['account'] = account
+
+    return clauses, params, active
+
+def _page_size(args):
+    per_page = args.get('per_page', TICKETS_PAGE_SIZE, type=int)
+    return max(1, min(per_page, TICKETS_MAX_PAGE_SIZE))
+
+# ---- Attachment Storage ---- #
+if STORAGE_BACKEND == 'supabase':
+    storage_backend = SupabaseStorage(SUPABASE_URL, SUPABASE_KEY, bucket="uploads")
+else:
+    storage_backend = LocalStorage(LOCAL_UPLOAD_DIR, LOCAL_UPLOAD_URL)
+
+derivatives = None
+if THUMBNAILS_ENABLED:
+    derivatives = DerivativeManager(storage_backend, db_pool, workers=THUMBNAIL_WORKERS,
+                                    thumbnail_size=THUMBNAIL_SIZE, preview_size=PREVIEW_SIZE,
+                                    on_change=ticket_cache.bump, events=ticket_events)
+
+def notify_upload_failed(ticket_id, filename):
+    """The form has already said "submitted", so tell the owner and the admin by email."""
+    subject, html_content = upload_failed_email(ticket_id, filename)
+    try:
+        with db_pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT email FROM tickets WHERE ticket_id = %s", (ticket_id,))
+            row = cursor.fetchone()
+            for recipient in {row[0] if row else None, admin_alerts.recipient} - {None}:
+                email_outbox.enqueue(cursor, recipient, subject, html_content)
+            conn.commit()
+    except (psycopg2.Error, PoolError) as e:
+        logger.error(f"Could not queue the upload failure notice for {ticket_id}: {e}")
+        return
+    email_outbox.wake()
+
+uploads = UploadManager(storage_backend, db_pool, background=UPLOAD_ASYNC, workers=UPLOAD_WORKERS,
+                        derivatives=derivatives, on_change=ticket_cache.bump, events=ticket_events,
+                        on_failure=notify_upload_failed)
+
+@app.errorhandler(RequestEntityTooLarge)
+def handle_upload_too_large(e):
+    message = f"File is larger than {MAX_UPLOAD_MB} MB."
+    if request.path.startswith('/api/'):
+        return jsonify({"error": message}), 413
+    flash(message)
+    return redirect('/')
 
 # =====================================================
 #  1. PUBLIC ROUTES (Create Ticket)
 # =====================================================
+# A reused idempotency key inserts nothing; a recent ticket with the same account, error
+# type and reference is recorded as the one this duplicates (tickets_near_duplicate_idx).
+INSERT_TICKET_SQL = """
+INSERT INTO tickets (ticket_id, fullname, account_number, email, reference, error_type, description,
+                     status, idempotency_key, duplicate_of)
+VALUES (%(ticket_id)s, %(name)s, %(account)s, %(email)s, %(reference)s, %(error_type)s, %(description)s,
+        'Open', %(key)s, (
+            SELECT ticket_id FROM tickets
+            WHERE account_number = %(account)s AND %(account)s <> '' AND error_type = %(error_type)s
+              AND reference IS NOT DISTINCT FROM %(reference)s
+              AND created_at > NOW() - make_interval(secs => %(window)s)
+            ORDER BY created_at LIMIT 1
+        ))
+ON CONFLICT (idempotency_key) DO NOTHING
+RETURNING ticket_id
+"""
+
+def insert_ticket(cursor, ticket_id, tracking_link, idempotency_key, **fields):
+    """
+    Insert a ticket with its first message, admin alert and analytics in the
+    caller's transaction. ``fields`` are name, account, email, reference,
+    error_type and description. Returns False, having written nothing, when
+    ``idempotency_key`` was already used.
+    """
+    # store account as string to preserve leading zeros
+    cursor.execute(INSERT_TICKET_SQL,
+                   {**fields, "ticket_id": ticket_id, "key": idempotency_key, "window": NEAR_DUPLICATE_WINDOW})
+    if cursor.fetchone() is None:
+        return False
+
+    # Add initial message
+    cursor.execute("INSERT INTO messages (ticket_id, sender_type, content) VALUES (%s, 'user', %s)",
+                   (ticket_id, fields['description']))
+    admin_alerts.record(cursor, ticket_id, fields['name'], fields['account'], fields['error_type'], tracking_link)
+    ticket_analytics.ticket_opened(cursor, fields['error_type'])
+    return True
+
 @app.route('/', methods=['GET', 'POST'])
 def form_view():
     form = TicketForm()
     if form.validate_on_submit():
         ticket_id = f"TICKET-{str(uuid.uuid4())[:8]}"
-        public_url = None
         uploaded_file = form.file.data
+        staged = None
 
-        # 1. Upload to Supabase
+        # 1. Stage the attachment on disk (chunked, size-limited, type-sniffed)
         if uploaded_file:
+            filename = f"{ticket_id}_{secure_filename(uploaded_file.filename)}"
             try:
-                filename = f"{ticket_id}_{secure_filename(uploaded_file.filename)}"
-                file_content = uploaded_file.read()
-                res = supabase.storage.from_("uploads").upload(filename, file_content, {"content-type": uploaded_file.content_type})
-                public_url = supabase.storage.from_("uploads").get_public_url(filename)
-            except Exception as e:
-                logger.error(f"Supabase upload error: {e}")
-                flash("Error uploading file. Please try again.")
+                staged = stage_upload(uploaded_file, filename, MAX_UPLOAD_MB * 1024 * 1024, UPLOAD_TMP_DIR)
+            except UploadRejected as e:
+                form.file.errors.append(str(e))
+                return render_template('index.html', form=form)
 
-        # 2. Insert into DB
-        conn = get_db_connection()
-        if not conn:
-            flash("System error. Please try again later.")
-            return render_template('index.html', form=form)
+        tracking_link = url_for('ticket_detail', ticket_id=ticket_id, _external=True)
+        idempotency_key = form.idempotency_key.data or None
 
+        # 2. Insert into DB (admin alert is queued in the same transaction)
         try:
-            cursor = conn.cursor()
-            # store account as string to preserve leading zeros
-            cursor.execute("""
-                INSERT INTO tickets (ticket_id, fullname, account_number, email, reference, error_type, description, file_path, status)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 'Open')
-            """, (ticket_id, form.name.data, form.account.data, form.email.data.lower(), form.reference.data, form.error_type.data, form.description.data, public_url))
-
-            # Add initial message
-            cursor.execute("INSERT INTO messages (ticket_id, sender_type, content) VALUES (%s, 'user', %s)", (ticket_id, form.description.data))
+            with db_pool.connection() as conn:
+                try:
+                    cursor = conn.cursor()
+                    created = insert_ticket(cursor, ticket_id, tracking_link, idempotency_key,
+                                            name=form.name.data, account=form.account.data,
+                                            email=form.email.data.lower(), reference=form.reference.data,
+                                            error_type=form.error_type.data, description=form.description.data)
+                    if not created:
+                        # Same form submitted again: point at the first ticket and
+                        # skip the upload, alert and messages.
+                        cursor.execute("SELECT ticket_id FROM tickets WHERE idempotency_key = %s", (idempotency_key,))
+                        original = cursor.fetchone()
+                        conn.rollback()
+                        if staged:
+                            staged.discard()
+                        flash(f"Ticket {original[0]} submitted successfully." if original
+                              else "Your ticket was already submitted.")
+                        return redirect('/')
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    logger.error(f"Database insertion error: {e}")
+                    flash("An error occurred while submitting your ticket.")
+                    if staged:
+                        staged.discard()
+                    return render_template('index.html', form=form)
+        except PoolError:
+            flash("System error. Please try again later.")
+            if staged:
+                staged.discard()
+            return render_template('index.html', form=form)
 
-            conn.commit()
+        email_outbox.wake()
+        note_write()
 
-            # 3. Send Email Alert to Admin (SYNCHRONOUS with timeout & safety)
-            admin_email = os.getenv('MAIL_USERNAME')
-            tracking_link = url_for('ticket_detail', ticket_id=ticket_id, _external=True)
-
-            subject = f"New Ticket: {ticket_id}"
-            html_content = f"""
-                <h3>New Ticket Received</h3>
-                <p><strong>From:</strong> {form.name.data}</p>
-                <p><strong>Account:</strong> {form.account.data}</p>
-                <p><strong>Issue:</strong> {form.error_type.data}</p>
-                <br>
-                <a href="{tracking_link}" style="background-color: #007bff; color: white; padding: 10px 20px; text-decoration: none; border-radius: 5px;">View Ticket</a>
-                <p style="margin-top:20px; font-size:12px; color:#666;">Or copy link: {tracking_link}</p>
-            """
+        # 3. Hand the attachment to storage; file_path is filled in once it lands
+        if staged:
+            stored_url = uploads.submit(ticket_id, staged, filename)
+            if not uploads.background and not stored_url:
+                flash("Error uploading file. Please try again.")
 
-            try:
-                ok = send_email_via_smtp(admin_email, subject, html_content)
-                if not ok:
-                    # already logged inside helper; surface an info message if needed
-                    logger.warning("Admin alert email failed to send.")
-            except Exception as e:
-                logger.error(f"Unexpected error sending admin alert: {e}")
-
-            flash(f"Ticket {ticket_id} submitted successfully.")
-            return redirect('/')
-        except Exception as e:
-            conn.rollback()
-            logger.error(f"Database insertion error: {e}")
-            flash("An error occurred while submitting your ticket.")
-        finally:
-            try:
-                cursor.close()
-            except Exception:
-                pass
-            conn.close()
+        flash(f"Ticket {ticket_id} submitted successfully.")
+        return redirect('/')
 
     return render_template('index.html', form=form)
 
@@ -219,86 +976,26 @@ def user_login():
             flash("Please enter a valid email.")
             return render_template('login_email.html')
 
-        conn = get_db_connection()
-        if not conn:
-            flash("Service unavailable.")
-            return render_template('login_email.html')
+        # Generate OTP
+        code = str(secrets.randbelow(900000) + 100000)
+        verify_link = url_for('verify_code', email=email, _external=True)
+        subject, html_content = otp_email(code, verify_link)
 
+        # One statement: checks the email owns a ticket, stores the code, queues the email
         try:
-            cursor = conn.cursor()
-            cursor.execute("SELECT 1 FROM tickets WHERE email = %s LIMIT 1", (email,))
-            exists = cursor.fetchone()
-
-            if not exists:
-                return render_template('login_verify.html', email=email)
-
-            # Generate & Store OTP
-            code = str(random.randint(100000, 999999))
-            expires = datetime.now() + timedelta(minutes=10)
-            cursor.execute("""
-                INSERT INTO otps (email, code, expires_at) VALUES (%s, %s, %s)
-                ON CONFLICT (email) DO UPDATE SET code = EXCLUDED.code, expires_at = EXCLUDED.expires_at;
-            """, (email, code, expires))
-            conn.commit()
-            conn.close()
-
-           # Inside /auth/login route...
-
-            # Email Code (SYNCHRONOUS)
-            verify_link = url_for('verify_code', email=email, _external=True)
-
-            subject = "Your Access Code"
-            
-            # --- PROFESSIONAL OTP TEMPLATE --- #
-            html_content = f"""
-            <!DOCTYPE html>
-            <html>
-            <body style="margin: 0; padding: 0; font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background-color: #f4f6f8;">
-                <div style="max-width: 600px; margin: 0 auto; padding: 40px 20px;">
-                    <div style="background-color: #ffffff; padding: 30px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1); text-align: center;">
-                        
-                        <h2 style="color: #333333; margin-top: 0;">Verify Your Login</h2>
-                        <p style="color: #666666; font-size: 16px;">
-                            Use the code below to access your dashboard.
-                        </p>
-
-                        <div style="background-color: #eef2f7; padding: 20px; margin: 30px 0; border-radius: 8px; letter-spacing: 5px;">
-                            <span style="font-size: 32px; font-weight: bold; color: #2c3e50; font-family: monospace;">{code}</span>
-                        </div>
-
-                        <a href="{verify_link}" 
-                           style="background-color: #28a745; color: #ffffff; padding: 12px 30px; text-decoration: none; border-radius: 5px; font-weight: bold; display: inline-block;">
-                            Verify Automatically
-                        </a>
-
-                        <p style="margin-top: 30px; font-size: 12px; color: #999999;">
-                            This code will expire in 10 minutes.<br>
-                            If you didn't request this code, you can safely ignore this email.
-                        </p>
-                    </div>
-                </div>
-            </body>
-            </html>
-            """
-            # --------------------------------- #
-
-            try:
-                ok = send_email_via_smtp(email, subject, html_content)
-                if not ok:
-                    logger.warning("OTP email failed to send to %s", email)
-                    flash("Could not send OTP email. Please try again.")
-            except Exception as e:
-                logger.error(f"Error sending OTP: {e}")
-                flash("Could not send OTP email. Please try again.")
-
+            with db_pool.connection() as conn:
+                cursor = conn.cursor()
+                issued = otp_store.issue(cursor, email, code, subject, html_content)
+                conn.commit()
+        except PoolError:
+            flash("Service unavailable.")
+            return render_template('login_email.html')
         except Exception as e:
             logger.error(f"Login error: {e}")
-        finally:
-            if conn:
-                try:
-                    conn.close()
-                except Exception:
-                    pass
+            return render_template('login_verify.html', email=email)
+
+        if issued:
+            email_outbox.wake()
 
         return render_template('login_verify.html', email=email)
     return render_template('login_email.html')
@@ -314,21 +1011,18 @@ def verify_code():
         return render_template('login_verify.html', email=email)
 
     # HANDLE POST (Form Submission)
-    email = request.form.get('email')
-    code = request.form.get('code')
+    email = request.form.get('email', '').lower().strip()
+    code = request.form.get('code', '').strip()
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM otps WHERE email = %s AND code = %s AND expires_at > NOW()", (email, code))
+    with db_pool.connection() as conn:
+        cursor = conn.cursor()
+        verified = otp_store.verify(cursor, email, code)
+        conn.commit()
 
-    if cursor.fetchone():
+    if verified:
         session['user_email'] = email
-        cursor.execute("DELETE FROM otps WHERE email = %s", (email,))
-        conn.commit()
-        conn.close()
         return redirect('/my-tickets')
 
-    conn.close()
     flash("Invalid or expired code.")
     return render_template('login_verify.html', email=email)
 
@@ -340,43 +1034,63 @@ def logout():
 # =====================================================
 #  3. USER DASHBOARD ROUTES
 # =====================================================
+def _my_ticket_summaries(args):
+    per_page = _page_size(args)
+    clauses, params = ["email = %s"], [session['user_email']]
+    after = decode_cursor(args.get('cursor'), datetime, str)
+    if after:
+        clauses.append(MY_TICKETS_AFTER_SQL)
+        params.extend(after)
+
+    with read_pool().connection() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        tickets = ticket_dashboard.summaries(cursor, clauses, params, per_page + 1)
+
+    next_cursor = None
+    if len(tickets) > per_page:
+        tickets = tickets[:per_page]
+        next_cursor = encode_cursor(tickets[-1]['created_at'], tickets[-1]['ticket_id'])
+    return tickets, next_cursor
+
 @app.route('/my-tickets')
 def my_tickets():
     if 'user_email' not in session: return redirect('/auth/login')
 
-    conn = get_db_connection()
-    if not conn: return "Database Error", 500
+    tickets, next_cursor = _my_ticket_summaries(request.args)
+    return render_template('my_tickets_list.html', tickets=tickets, user_email=session['user_email'],
+                           next_cursor=next_cursor)
 
-    try:
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute("SELECT * FROM tickets WHERE email = %s ORDER BY created_at DESC", (session['user_email'],))
-        tickets = cursor.fetchall()
-        return render_template('my_tickets_list.html', tickets=tickets, user_email=session['user_email'])
-    finally:
-        conn.close()
+@app.route('/api/my-tickets/summary')
+def api_my_tickets_summary():
+    """
+    Status, last activity and unread admin replies for a page of the user's
+    tickets (same ``cursor``/``per_page`` as /my-tickets), in one query. The
+    dashboard refreshes from this instead of polling each ticket.
+    """
+    if 'user_email' not in session:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    tickets, next_cursor = _my_ticket_summaries(request.args)
+    response = jsonify({
+        "tickets": tickets,
+        "unread_total": sum(t['unread'] for t in tickets),
+        "next_cursor": next_cursor,
+    })
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.add_etag()
+    return response.make_conditional(request)
 
 @app.route('/track/<ticket_id>')
 def track_ticket(ticket_id):
     if 'user_email' not in session:
         return redirect('/auth/login')
 
-    conn = get_db_connection()
-    if not conn: return "Database Error", 500
-
-    try:
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute("SELECT * FROM tickets WHERE ticket_id = %s", (ticket_id,))
-        ticket = cursor.fetchone()
-
-        if not ticket or ticket['email'] != session['user_email']:
-             conn.close()
-             abort(404)
-
-        cursor.execute("SELECT * FROM messages WHERE ticket_id = %s ORDER BY created_at ASC", (ticket_id,))
-        messages = cursor.fetchall()
-        return render_template('track_ticket.html', ticket=ticket, messages=messages)
-    finally:
-        conn.close()
+    thread = load_ticket_thread(ticket_id, read_pool())
+    if not thread or thread['ticket']['email'] != session['user_email']:
+        abort(404)
+    mark_thread_read(thread)
+    return render_template('track_ticket.html', ticket=thread['ticket'], messages=thread['messages'])
 
 # =====================================================
 #  4. ADMIN ROUTES
@@ -384,15 +1098,26 @@ def track_ticket(ticket_id):
 @app.route('/tickets', methods=['GET', 'POST'])
 def view_tickets():
     if session.get('admin_authenticated'):
-        conn = get_db_connection()
-        if not conn: return "Database Error", 500
-        try:
+        per_page = _page_size(request.args)
+        clauses, params, filters = ticket_filters(request.args)
+        after = decode_cursor(request.args.get('cursor'), int, datetime, str)
+        if after:
+            clauses.append(ADMIN_LIST_AFTER_SQL)
+            params.extend(after)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+
+        with read_pool().connection() as conn:
             cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            cursor.execute("SELECT * FROM tickets ORDER BY CASE WHEN status='Open' THEN 0 ELSE 1 END, created_at DESC")
+            cursor.execute(ADMIN_LIST_SQL.format(where=where), params + [per_page + 1])
             tickets = cursor.fetchall()
-            return render_template('tickets.html', tickets=tickets)
-        finally:
-            conn.close()
+
+        next_cursor = None
+        if len(tickets) > per_page:
+            tickets = tickets[:per_page]
+            last = tickets[-1]
+            next_cursor = encode_cursor(last['open_rank'], last['created_at'], last['ticket_id'])
+        return render_template('tickets.html', tickets=tickets, filters=filters, next_cursor=next_cursor,
+                               error_types=ERROR_TYPES, is_first_page=not after)
 
     if request.method == 'POST':
         if request.form.get('password') == ADMIN_PASSWORD:
@@ -405,48 +1130,170 @@ def view_tickets():
 def ticket_detail(ticket_id):
     if not session.get('admin_authenticated'): return redirect('/tickets')
 
-    conn = get_db_connection()
-    if not conn: return "Database Error", 500
-    try:
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute("SELECT * FROM tickets WHERE ticket_id = %s", (ticket_id,))
-        ticket = cursor.fetchone()
-        if ticket:
-            cursor.execute("SELECT * FROM messages WHERE ticket_id = %s ORDER BY created_at ASC", (ticket_id,))
-            messages = cursor.fetchall()
-            return render_template('ticket_detail.html', ticket=ticket, messages=messages)
-    finally:
-        conn.close()
+    thread = load_ticket_thread(ticket_id, read_pool())
+    if thread:
+        return render_template('ticket_detail.html', ticket=thread['ticket'], messages=thread['messages'])
     return redirect('/tickets')
 
+def _run_search(args):
+    q = args.get('q', '').strip()[:200]
+    page = max(1, min(args.get('page', 1, type=int), SEARCH_MAX_PAGE))
+    if not q:
+        return q, page, [], False
+
+    with db_pool.connection() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        results = search.search_tickets(cursor, q, SEARCH_PAGE_SIZE + 1, (page - 1) * SEARCH_PAGE_SIZE)
+
+    has_next = len(results) > SEARCH_PAGE_SIZE and page < SEARCH_MAX_PAGE
+    return q, page, results[:SEARCH_PAGE_SIZE], has_next
+
+@app.route('/tickets/search')
+def search_tickets_view():
+    if not session.get('admin_authenticated'): return redirect('/tickets')
+
+    q, page, results, has_next = _run_search(request.args)
+    for row in results:
+        row['snippet'] = search.highlight(row['snippet'])
+    return render_template('ticket_search.html', q=q, page=page, results=results, has_next=has_next)
+
+@app.route('/api/admin/search')
+def api_search_tickets():
+    if not session.get('admin_authenticated'):
+        return jsonify({"error": "Unauthorized"}), 403
+
+    q, page, results, has_next = _run_search(request.args)
+    for row in results:
+        row['rank'] = float(row['rank'])
+    return jsonify({"q": q, "page": page, "has_next": has_next, "results": results})
+
+@app.route('/tickets/export')
+def export_tickets():
+    """
+    Stream every ticket matching the list filters, with its messages, as CSV
+    (default) or NDJSON (``?format=ndjson``). Memory use does not grow with
+    the size of the export.
+    """
+    if not session.get('admin_authenticated'): return redirect('/tickets')
+
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.FORMATS:
+        abort(400)
+    clauses, params, _ = ticket_filters(request.args)
+    filename = f"tickets_{date.today().isoformat()}.{fmt}"
+    return Response(export.stream_export(db_pool, clauses, params, fmt, EXPORT_BATCH_SIZE),
+                    content_type=export.FORMATS[fmt], headers={
+                        'Content-Disposition': f'attachment; filename="{filename}"',
+                        'X-Accel-Buffering': 'no',
+                    })
+
+# Set-based ticket actions: (statement, event type, new status). Each returns
+# (ticket_id, email) plus the analytics columns (error_type, was_open,
+# seconds_open) for every ticket it actually changed.
+TICKET_ACTIONS = {
+    'close': ("UPDATE tickets SET status = 'Closed', closed_at = NOW() WHERE {where} AND status <> 'Closed' "
+              "RETURNING ticket_id, email, error_type, TRUE, EXTRACT(EPOCH FROM closed_at - created_at)",
+              "status", 'Closed'),
+    'reopen': ("UPDATE tickets SET status = 'Open', closed_at = NULL WHERE {where} AND status <> 'Open' "
+               "RETURNING ticket_id, email, error_type, FALSE, NULL", "status", 'Open'),
+    'delete': ("DELETE FROM tickets WHERE {where} "
+               "RETURNING ticket_id, email, error_type, status <> 'Closed', NULL", "deleted", None),
+}
+
+def apply_ticket_action(cursor, action, clauses, params):
+    """Run the action, update the analytics rollups and publish events. Returns (ticket_id, email) pairs."""
+    sql, kind, _ = TICKET_ACTIONS[action]
+    cursor.execute(sql.format(where=' AND '.join(clauses)), params)
+    rows = cursor.fetchall()
+    ticket_analytics.tickets_changed(cursor, action, [row[2:] for row in rows])
+    ticket_events.publish_many(cursor, [row[0] for row in rows], kind)
+    return [row[:2] for row in rows]
+
+def queue_status_emails(cursor, changed, status):
+    """One notification per user, however many of their tickets changed, in one INSERT."""
+    by_email = {}
+    for ticket_id, email in changed:
+        by_email.setdefault(email, []).append(
+            (ticket_id, url_for('track_ticket', ticket_id=ticket_id, _external=True)))
+    email_outbox.enqueue_many(cursor, [(email, *status_email(status, tickets))
+                                       for email, tickets in by_email.items()])
+
 @app.route('/close_ticket/<ticket_id>', methods=['POST'])
 def close_ticket(ticket_id):
     if not session.get('admin_authenticated'): return redirect('/tickets')
 
-    conn = get_db_connection()
-    if not conn: return "Database Error", 500
-    try:
+    with db_pool.connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("UPDATE tickets SET status = 'Closed', closed_at = NOW() WHERE ticket_id = %s", (ticket_id,))
+        apply_ticket_action(cursor, 'close', ["ticket_id = %s"], [ticket_id])
         conn.commit()
-    finally:
-        conn.close()
+    ticket_cache.bump(ticket_id)
+    note_write()
     return redirect('/tickets')
 
 @app.route('/delete_ticket/<ticket_id>', methods=['POST'])
 def delete_ticket(ticket_id):
     if not session.get('admin_authenticated'): return redirect('/tickets')
 
-    conn = get_db_connection()
-    if not conn: return "Database Error", 500
-    try:
+    with db_pool.connection() as conn:
         cursor = conn.cursor()
-        cursor.execute("DELETE FROM tickets WHERE ticket_id = %s", (ticket_id,))
+        apply_ticket_action(cursor, 'delete', ["ticket_id = %s"], [ticket_id])
         conn.commit()
-    finally:
-        conn.close()
+    ticket_cache.bump(ticket_id)
+    note_write()
     return redirect('/tickets')
 
+@app.route('/tickets/bulk', methods=['POST'])
+def bulk_ticket_action():
+    """
+    Close, reopen or delete the checked tickets, or every ticket matching the
+    current filters (scope=filter), in one statement. Users get one email per
+    person for close/reopen when ``notify`` is checked.
+    """
+    if not session.get('admin_authenticated'): return redirect('/tickets')
+
+    action = request.form.get('action')
+    clauses, params, filters = ticket_filters(request.form)
+    if action not in TICKET_ACTIONS:
+        flash("Choose an action.")
+        return redirect(url_for('view_tickets', **filters))
+
+    if request.form.get('scope') == 'filter':
+        if not filters:
+            flash("Apply at least one filter before acting on all matching tickets.")
+            return redirect(url_for('view_tickets'))
+    else:
+        ticket_ids = request.form.getlist('ticket_ids')[:TICKETS_MAX_PAGE_SIZE]
+        if not ticket_ids:
+            flash("No tickets selected.")
+            return redirect(url_for('view_tickets', **filters))
+        clauses, params = ["ticket_id = ANY(%s)"], [ticket_ids]
+
+    new_status = TICKET_ACTIONS[action][2]
+    notify = new_status is not None and request.form.get('notify') == '1'
+
+    with db_pool.connection() as conn:
+        try:
+            cursor = conn.cursor()
+            changed = apply_ticket_action(cursor, action, clauses, params)
+            if notify:
+                queue_status_emails(cursor, changed, new_status)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Bulk {action} failed: {e}")
+            flash("Bulk action failed; nothing was changed.")
+            return redirect(url_for('view_tickets', **filters))
+
+    for ticket_id, _ in changed:
+        ticket_cache.bump(ticket_id)
+    note_write()
+    if notify and changed:
+        email_outbox.wake()
+
+    done = {'close': 'Closed', 'reopen': 'Reopened', 'delete': 'Deleted'}[action]
+    flash(f"{done} {len(changed)} ticket{'s' if len(changed) != 1 else ''}.")
+    return redirect(url_for('view_tickets', **filters))
+
 # =====================================================
 #  5. API (Chat)
 # =====================================================
@@ -473,105 +1320,290 @@ def api_reply():
         if 'user_email' not in session:
              return jsonify({"error": "Unauthorized"}), 403
 
-    conn = get_db_connection()
-    if not conn:
-        return jsonify({"error": "Database connection failed"}), 500
-
-    try:
-        cursor = conn.cursor()
-        cursor.execute("INSERT INTO messages (ticket_id, sender_type, content) VALUES (%s, %s, %s)",
-                       (ticket_id, sender_type, message_content))
-        conn.commit()
+    return save_reply(ticket_id, sender_type, message_content)
 
-        # If Admin replied, email User (SYNCHRONOUS)
-        if sender_type == 'admin':
-            cursor.execute("SELECT email FROM tickets WHERE ticket_id = %s", (ticket_id,))
-            result = cursor.fetchone()
-            
-            if result:
-                user_email = result[0]
-                tracking_link = url_for('track_ticket', ticket_id=ticket_id, _external=True)
-
-                subject = f"Update on Ticket {ticket_id}"
-
-                # --- NEW PROFESSIONAL HTML TEMPLATE --- #
-                html_content = f"""
-                <!DOCTYPE html>
-                <html>
-                <body style="margin: 0; padding: 0; font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; background-color: #f4f6f8;">
-                    <div style="max-width: 600px; margin: 0 auto; padding: 40px 20px;">
-                        <div style="background-color: #ffffff; padding: 30px; border-radius: 8px; box-shadow: 0 2px 4px rgba(0,0,0,0.1);">
-                            
-                            <h2 style="color: #333333; margin-top: 0; font-size: 24px;">New Reply Received</h2>
-                            <p style="color: #666666; font-size: 16px; line-height: 1.5;">
-                                There is a new update regarding your ticket <strong>#{ticket_id}</strong>.
-                            </p>
-
-                            <div style="background-color: #f8f9fa; border-left: 5px solid #007bff; padding: 15px 20px; margin: 25px 0; border-radius: 4px;">
-                                <p style="margin: 0; color: #555555; font-style: italic; font-size: 16px;">
-                                    "{message_content}"
-                                </p>
-                            </div>
-
-                            <div style="text-align: center; margin-top: 30px;">
-                                <a href="{tracking_link}" 
-                                   style="background-color: #007bff; color: #ffffff; padding: 12px 25px; text-decoration: none; border-radius: 5px; font-weight: bold; display: inline-block;">
-                                    View Full Conversation
-                                </a>
-                            </div>
-
-                            <p style="margin-top: 30px; font-size: 12px; color: #999999; text-align: center;">
-                                If you did not submit this ticket, please ignore this email.
-                            </p>
-                        </div>
-                    </div>
-                </body>
-                </html>
-                """
-                # ------------------------------------- #
+def save_reply(ticket_id, sender_type, message_content):
+    """Store a chat message, notify listeners and email the user about admin replies."""
+    with db_pool.connection() as conn:
+        try:
+            cursor = conn.cursor()
+            cursor.execute("INSERT INTO messages (ticket_id, sender_type, content) VALUES (%s, %s, %s) RETURNING id",
+                           (ticket_id, sender_type, message_content))
+            ticket_events.publish(cursor, ticket_id, cursor.fetchone()[0])
+
+            # If Admin replied, queue an email to the User
+            if sender_type == 'admin':
+                ticket_analytics.admin_replied(cursor, ticket_id)
+                cursor.execute("SELECT email FROM tickets WHERE ticket_id = %s", (ticket_id,))
+                result = cursor.fetchone()
+                if result:
+                    tracking_link = url_for('track_ticket', ticket_id=ticket_id, _external=True)
+                    subject, html_content = reply_email(ticket_id, message_content, tracking_link)
+                    email_outbox.enqueue(cursor, result[0], subject, html_content)
+            conn.commit()
+        except psycopg2.errors.ForeignKeyViolation:
+            # Unknown or archived ticket; archived conversations are read-only.
+            conn.rollback()
+            return jsonify({"error": "Ticket not found or archived"}), 404
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"API Error: {e}")
+            return jsonify({"error": "Internal server error"}), 500
 
-                try:
-                    ok = send_email_via_smtp(user_email, subject, html_content)
-                    if not ok:
-                        logger.warning("Failed to send reply notification to %s", user_email)
-                except Exception as e:
-                    logger.error(f"Error sending reply notification: {e}")
+    ticket_cache.bump(ticket_id)
+    note_write()
+    email_outbox.wake()
+    return jsonify({"status": "success"})
 
-        return jsonify({"status": "success"})
-    except Exception as e:
-        conn.rollback()
-        logger.error(f"API Error: {e}")
-        return jsonify({"error": "Internal server error"}), 500
-    finally:
-        conn.close()
 @app.route('/api/ticket/<ticket_id>/messages', methods=['GET'])
 def get_ticket_messages(ticket_id):
+    """
+    Chat polling endpoint.
+
+    ``?since=<message id>`` returns only messages newer than that id. The
+    response carries an ETag and Last-Modified derived from the newest
+    message, and a matching If-None-Match is answered with 304. The check
+    uses the cached thread head (newest id), and a poll with ``since`` only
+    ever reads the messages after it.
+    """
     is_admin = session.get('admin_authenticated')
     user_email = session.get('user_email')
+    since = request.args.get('since', type=int)
+    # Pages send ``latest`` (the announced message id, 0 for other events) when an
+    # event stream push prompted the fetch. The write behind it may not have reached
+    # the replica or this worker's cache yet, so such fetches read the primary.
+    latest = request.args.get('latest', type=int)
+    pushed = latest is not None and (since is None or since < latest or latest == 0)
+    pool = db_pool if pushed else read_pool()
 
-    conn = get_db_connection()
-    if not conn: return jsonify({"error": "Database error"}), 500
+    try:
+        head = load_thread_head(ticket_id, pool, min_last_id=latest if pushed else None)
+        if not head:
+            return jsonify({"error": "Ticket not found"}), 404
+        if not is_admin and (not user_email or head['email'] != user_email):
+            return jsonify({"error": "Unauthorized"}), 403
+
+        last_id, last_at = head['last_id'] or 0, head['last_at']
+        etag = str(last_id)
+        # Last-Modified has one-second resolution, so only the ETag is
+        # trusted to decide that nothing changed.
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+            _set_chat_cache_headers(response, etag, last_at)
+            return response
+
+        if since is not None and since >= last_id:
+            messages = []
+        elif since is not None:
+            messages = load_messages_since(ticket_id, since, head['archived'], pool)
+        else:
+            thread = load_ticket_thread(ticket_id, pool)
+            messages = thread['messages'] if thread else []
+    except psycopg2.Error as e:
+        logger.error(f"Error fetching messages: {e}")
+        return jsonify({"error": "Internal server error"}), 500
+
+    # The page already showed (and marked) everything up to ``since``.
+    if not is_admin and not head['archived'] and last_id and (since is None or since < last_id):
+        mark_ticket_read(ticket_id, last_id)
+
+    response = jsonify(messages)
+    _set_chat_cache_headers(response, etag, last_at)
+    return response
+
+def _set_chat_cache_headers(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    # Let the browser keep the body but always revalidate with the server.
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+
+@app.route('/api/ticket/<ticket_id>/events', methods=['GET'])
+@limiter.exempt
+def ticket_event_stream(ticket_id):
+    """
+    Server-Sent Events stream that announces new messages on a ticket.
+
+    Events only carry the message id; clients fetch the content through
+    ``/messages?since=``. Returns 503 when this worker is at SSE_MAX_STREAMS
+    so the client falls back to polling.
+    """
+    is_admin = session.get('admin_authenticated')
+    user_email = session.get('user_email')
+
+    thread = load_ticket_thread(ticket_id)
+    if not thread:
+        return jsonify({"error": "Ticket not found"}), 404
+    if not is_admin and (not user_email or thread['ticket']['email'] != user_email):
+        return jsonify({"error": "Unauthorized"}), 403
 
     try:
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        cursor.execute("SELECT email FROM tickets WHERE ticket_id = %s", (ticket_id,))
-        ticket = cursor.fetchone()
+        subscription = ticket_events.subscribe(ticket_id)
+    except StreamLimitReached as e:
+        logger.warning(f"Rejecting event stream for {ticket_id}: {e}")
+        return jsonify({"error": "Too many open streams"}), 503
 
-        if not ticket:
-            return jsonify({"error": "Ticket not found"}), 404
+    def stream():
+        try:
+            yield "retry: 5000\n\n"
+            deadline = time.monotonic() + SSE_MAX_DURATION
+            while time.monotonic() < deadline:
+                event = subscription.get(timeout=SSE_HEARTBEAT)
+                if event is None:
+                    # Comment line keeps proxies from timing out and lets us
+                    # notice disconnected clients.
+                    yield ": keep-alive\n\n"
+                else:
+                    yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            ticket_events.unsubscribe(subscription)
 
-        if not is_admin and (not user_email or ticket['email'] != user_email):
-             return jsonify({"error": "Unauthorized"}), 403
+    return Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+    })
 
-        cursor.execute("SELECT sender_type, content, created_at FROM messages WHERE ticket_id = %s ORDER BY created_at ASC", (ticket_id,))
-        messages = cursor.fetchall()
+# =====================================================
+#  6. API (Embeddable Widget)
+# =====================================================
+# static/sdk.js runs on other sites, so it has neither the session cookie nor a CSRF
+# token. Opening a ticket returns a signed token for it, which the widget sends back in
+# the X-Ticket-Token header.
+widget_tokens = URLSafeTimedSerializer(app.secret_key, salt='ticket-widget')
 
-        return jsonify(messages)
-    except Exception as e:
-        logger.error(f"Error fetching messages: {e}")
-        return jsonify({"error": str(e)}), 500
-    finally:
-        conn.close()
+def widget_ticket_id():
+    """The ticket id carried by a valid X-Ticket-Token header, or None."""
+    try:
+        return widget_tokens.loads(request.headers.get('X-Ticket-Token', ''), max_age=WIDGET_TOKEN_MAX_AGE)
+    except BadSignature:
+        return None
+
+def _widget_error(message, status):
+    return jsonify({"status": "error", "message": message}), status
+
+@app.route('/api/init_ticket', methods=['POST'])
+@csrf.exempt
+@limiter.limit("5 per minute")
+def api_init_ticket():
+    data = request.get_json(silent=True) or {}
+    name, email, account, description = (str(data.get(field) or '').strip()
+                                          for field in ('name', 'email', 'account', 'description'))
+    email = email.lower()
+    if not name or not description or '@' not in email:
+        return _widget_error("Please fill in all required fields.", 400)
+    if account and not (len(account) == 10 and account.isdigit()):
+        return _widget_error("Account number must be 10 digits.", 400)
+    idempotency_key = str(data.get('idempotency_key') or '')[:100] or None
+
+    ticket_id = f"TICKET-{str(uuid.uuid4())[:8]}"
+    tracking_link = url_for('ticket_detail', ticket_id=ticket_id, _external=True)
+    with db_pool.connection() as conn:
+        try:
+            cursor = conn.cursor()
+            created = insert_ticket(cursor, ticket_id, tracking_link, idempotency_key,
+                                    name=name, account=account, email=email, reference=None,
+                                    error_type='other', description=description)
+            if not created:
+                # A retried request: hand back the ticket the first one opened.
+                cursor.execute("SELECT ticket_id, email FROM tickets WHERE idempotency_key = %s", (idempotency_key,))
+                original = cursor.fetchone()
+                conn.rollback()
+                if not original or original[1] != email:
+                    return _widget_error("This request was already used.", 409)
+                ticket_id = original[0]
+            else:
+                conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error(f"Widget ticket error: {e}")
+            return _widget_error("Could not open a ticket. Please try again.", 500)
+
+    if created:
+        email_outbox.wake()
+    return jsonify({"status": "success", "ticket_id": ticket_id, "token": widget_tokens.dumps(ticket_id)})
+
+@app.route('/api/ticket/<ticket_id>/history', methods=['GET'])
+def api_ticket_history(ticket_id):
+    """
+    Widget polling endpoint: {"ticket": status and unread replies, "messages"}.
+    Revalidates with an ETag like /messages, so an unchanged thread costs no query.
+    """
+    if widget_ticket_id() != ticket_id:
+        return jsonify({"error": "Unauthorized"}), 403
+
+    pool = read_pool()
+    thread = load_ticket_thread(ticket_id, pool)
+    if not thread:
+        return jsonify({"error": "Ticket not found"}), 404
+
+    messages = thread['messages']
+    last = messages[-1] if messages else None
+    last_at = last['created_at'] if last else None
+    etag = f"{last['id'] if last else 0}-{thread['ticket']['status']}"
+    if request.if_none_match.contains_weak(etag):
+        response = app.response_class(status=304)
+        _set_chat_cache_headers(response, etag, last_at)
+        return response
+
+    with pool.connection() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        summary = ticket_dashboard.summaries(cursor, ["ticket_id = %s"], [ticket_id], 1)
+    mark_thread_read(thread)
+
+    response = jsonify({
+        "ticket": {
+            "ticket_id": ticket_id,
+            "status": thread['ticket']['status'],
+            "last_message_at": last_at,
+            "unread": summary[0]['unread'] if summary else 0,
+        },
+        "messages": messages,
+    })
+    _set_chat_cache_headers(response, etag, last_at)
+    return response
+
+@app.route('/api/ticket/<ticket_id>/reply', methods=['POST'])
+@csrf.exempt
+def api_ticket_reply(ticket_id):
+    if widget_ticket_id() != ticket_id:
+        return jsonify({"error": "Unauthorized"}), 403
+    data = request.get_json(silent=True) or {}
+    message_content = str(data.get('message') or '').strip()
+    if not message_content:
+        return jsonify({"error": "Missing field: message"}), 400
+    return save_reply(ticket_id, 'user', message_content)
+
+# ---- Application Entry Point ---- #
+# Flask config that is captured at import: otp_store and widget_tokens hold SECRET_KEY, and
+# MAX_CONTENT_LENGTH is derived from MAX_UPLOAD_MB, which the upload checks also use.
+IMPORT_TIME_CONFIG = ('SECRET_KEY', 'MAX_CONTENT_LENGTH')
+
+def create_app(config=None):
+    """
+    Return the module-level ``app`` with ``config`` (Flask config keys such as
+    TESTING or WTF_CSRF_ENABLED) applied. Used by gunicorn
+    (``app:create_app()``), the benchmarks and tests.
+
+    This is not a factory: every call returns the same app. Deployment
+    settings (DATABASE_URL, storage, pool and replica sizes, ...) are module
+    constants read from the environment at import, as are the Flask keys in
+    IMPORT_TIME_CONFIG, so passing one here raises ValueError instead of
+    being silently ignored or half-applied. Importing this module
+    opens no connections and starts no threads. The database pool, storage and
+    HTTP clients, LISTEN connection and background workers are all created
+    on first use in each process. That makes the app safe to import once in
+    the gunicorn master (``--preload``) and fork.
+    """
+    if config:
+        env_only = sorted(key for key in config
+                          if key in IMPORT_TIME_CONFIG or (key.isupper() and key in globals()))
+        if env_only:
+            raise ValueError(f"{', '.join(env_only)} must be set in the environment before importing app")
+        app.config.update(config)
+        if 'RATELIMIT_ENABLED' in config:
+            limiter.enabled = bool(config['RATELIMIT_ENABLED'])
+    return app
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
@@ -0,0 +1,113 @@
+"""
+Archival of long-closed tickets.
+
+``tickets`` and ``messages`` should hold the active backlog, not every
+ticket ever filed. The ``ticket-archive`` periodic job moves tickets closed
+more than ``after_days`` ago, with their messages, into ``tickets_archive``
+and ``messages_archive`` in batches of ``batch_size`` tickets, one
+transaction per batch. Rows are claimed with ``FOR UPDATE SKIP LOCKED``, so
+the job never waits on a ticket that is being edited.
+
+Archived tickets keep their ids and stay readable through ``load_thread``.
+Closing or replying to them is not possible. The archive tables have no
+``search_vector`` columns, so admin search only covers active tickets.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Stored columns copied on archival. Generated columns (search_vector) are
+# left behind; Postgres rejects explicit values for them anyway.
+TICKET_COLUMNS = ("ticket_id, fullname, account_number, email, reference, error_type, description, "
+                  "status, file_path, thumbnail_path, preview_path, first_admin_reply_at, created_at, closed_at")
+MESSAGE_COLUMNS = "id, ticket_id, sender_type, content, created_at"
+
+# Oldest-closed first; rows another run already holds are skipped, not waited on.
+CANDIDATES_SQL = """
+SELECT ticket_id FROM tickets
+WHERE status = 'Closed' AND closed_at < NOW() - make_interval(days => %s)
+ORDER BY closed_at
+LIMIT %s
+FOR UPDATE SKIP LOCKED
+"""
+
+
+class TicketArchive:
+    def __init__(self, after_days=180, batch_size=500, max_batches=20, on_change=None, events=None):
+        self.after_days = after_days
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        # Called with each ticket_id once it has moved, e.g. to drop cached threads.
+        self.on_change = on_change
+        # TicketEventHub: an "archived" event per ticket, sent with the batch, tells
+        # other workers to drop their cached copies too.
+        self.events = events
+
+    def archive_batch(self, conn):
+        """Move one batch of tickets and their messages. Returns the number of tickets moved."""
+        cursor = conn.cursor()
+        cursor.execute(CANDIDATES_SQL, (self.after_days, self.batch_size))
+        ticket_ids = [row[0] for row in cursor.fetchall()]
+        if not ticket_ids:
+            conn.commit()
+            return 0
+
+        cursor.execute(f"""
+            INSERT INTO tickets_archive ({TICKET_COLUMNS})
+            SELECT {TICKET_COLUMNS} FROM tickets WHERE ticket_id = ANY(%s)
+        """, (ticket_ids,))
+        cursor.execute(f"""
+            INSERT INTO messages_archive ({MESSAGE_COLUMNS})
+            SELECT {MESSAGE_COLUMNS} FROM messages WHERE ticket_id = ANY(%s)
+        """, (ticket_ids,))
+        # Deleted explicitly: older deployments may lack the messages -> tickets cascade.
+        cursor.execute("DELETE FROM messages WHERE ticket_id = ANY(%s)", (ticket_ids,))
+        cursor.execute("DELETE FROM tickets WHERE ticket_id = ANY(%s)", (ticket_ids,))
+        if self.events is not None:
+            self.events.publish_many(cursor, ticket_ids, "archived")
+        conn.commit()
+        if self.on_change:
+            for ticket_id in ticket_ids:
+                self.on_change(ticket_id)
+        return len(ticket_ids)
+
+    def run(self, conn):
+        """Periodic job: archive up to ``max_batches`` batches. Returns tickets moved."""
+        total = 0
+        for _ in range(self.max_batches):
+            moved = self.archive_batch(conn)
+            total += moved
+            if moved < self.batch_size:
+                break
+        if total:
+            logger.info(f"Archived {total} tickets closed more than {self.after_days} days ago")
+        return total
+
+    def load_thread(self, cursor, ticket_id):
+        """An archived ticket and its messages as {'ticket', 'messages'}, or None."""
+        cursor.execute(f"SELECT {TICKET_COLUMNS}, archived_at FROM tickets_archive WHERE ticket_id = %s",
+                       (ticket_id,))
+        ticket = cursor.fetchone()
+        if not ticket:
+            return None
+        cursor.execute("SELECT id, sender_type, content, created_at FROM messages_archive "
+                       "WHERE ticket_id = %s ORDER BY id ASC", (ticket_id,))
+        return {'ticket': ticket, 'messages': cursor.fetchall()}
+
+    def stats(self, cursor):
+        cursor.execute("""
+            SELECT (SELECT reltuples::bigint FROM pg_class WHERE oid = 'tickets_archive'::regclass),
+                   pg_total_relation_size('tickets'), pg_total_relation_size('messages'),
+                   pg_total_relation_size('tickets_archive'), pg_total_relation_size('messages_archive')
+        """)
+        archived, tickets_bytes, messages_bytes, archive_bytes, messages_archive_bytes = cursor.fetchone()
+        return {
+            "after_days": self.after_days,
+            "archived_tickets_estimate": archived,
+            "bytes": {
+                "tickets": tickets_bytes,
+                "messages": messages_bytes,
+                "tickets_archive": archive_bytes,
+                "messages_archive": messages_archive_bytes,
+            },
+        }
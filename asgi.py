@@ -0,0 +1,336 @@
+"""
+Optional ASGI entry point that moves the two chat endpoints onto asyncio:
+
+    pip install -r requirements-async.txt
+    uvicorn asgi:app --workers 4
+
+Only these endpoints are async. They hold connections open and are hit most
+often, so they run on the event loop:
+
+* ``GET /api/ticket/<id>/events`` streams over one asyncpg ``LISTEN``
+  connection per process. An open stream costs a coroutine and a queue, not
+  a request thread, so ``ASYNC_MAX_STREAMS`` can be in the thousands.
+* ``GET /api/ticket/<id>/messages`` answers polls from an asyncpg pool with
+  the same ``since``/``latest``/ETag/304 behaviour as the Flask route,
+  including reads from ``DATABASE_REPLICA_URL`` while the app's replica
+  router considers it usable, and advances the owner's read marker the same
+  way.
+
+Every other route (ticket form, OTP login, replies, admin pages, uploads) is
+still synchronous. The regular Flask app serves them through a WSGI bridge on
+``WSGI_THREADS`` threads, so they behave and scale exactly as under a
+threaded gunicorn worker, templates, Flask-WTF forms, CSRF and sessions
+included. Their concurrency stays capped by workers x WSGI_THREADS. Moving
+them would need async ports of the forms, sessions, storage and email
+clients, and is deliberately out of scope: they are short requests, and
+their slow I/O already runs on background workers (the email outbox and
+UploadManager), off the request path in both modes.
+"""
+import asyncio
+import json
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import timezone
+from email.utils import format_datetime
+
+import asyncpg
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+import dashboard
+from app import (create_app, DATABASE_URL, DATABASE_REPLICA_URL, SSE_HEARTBEAT, SSE_MAX_DURATION,
+                 replica_router, ticket_events)
+
+logger = logging.getLogger(__name__)
+
+flask_app = create_app()
+
+ASYNC_DB_POOL_MAX_SIZE = int(os.getenv('ASYNC_DB_POOL_MAX_SIZE', 10))  # per process
+ASYNC_MAX_STREAMS = int(os.getenv('ASYNC_MAX_STREAMS', 5000))  # per process
+WSGI_THREADS = int(os.getenv('WSGI_THREADS', 16))  # threads serving the bridged Flask routes
+
+
+# ---- Sessions ---- #
+_session_serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+
+
+def load_session(request):
+    """Read the Flask session cookie (signed with SECRET_KEY) without a Flask request."""
+    cookie = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if not cookie or _session_serializer is None:
+        return {}
+    try:
+        return _session_serializer.loads(cookie, max_age=int(flask_app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+
+def authorized(session, ticket_email):
+    return bool(session.get('admin_authenticated')) or (
+        session.get('user_email') is not None and session.get('user_email') == ticket_email)
+
+
+# ---- Event fan-out ---- #
+class AsyncEventHub:
+    """asyncio counterpart of events.TicketEventHub, fed by one LISTEN connection."""
+
+    def __init__(self, dsn, channel, max_streams):
+        self.dsn = dsn
+        self.channel = channel
+        self.max_streams = max_streams
+        self._subscribers = {}   # ticket_id -> set of asyncio.Queue
+        self._count = 0
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._listen_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    def subscribe(self, ticket_id):
+        if self._count >= self.max_streams:
+            return None
+        queue = asyncio.Queue(maxsize=100)
+        self._subscribers.setdefault(ticket_id, set()).add(queue)
+        self._count += 1
+        return queue
+
+    def unsubscribe(self, ticket_id, queue):
+        subs = self._subscribers.get(ticket_id)
+        if subs and queue in subs:
+            subs.discard(queue)
+            self._count -= 1
+            if not subs:
+                del self._subscribers[ticket_id]
+
+    async def _listen_forever(self):
+        backoff = 1
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(self.dsn)
+                lost = asyncio.Event()
+                conn.add_termination_listener(lambda _: lost.set())
+                await conn.add_listener(self.channel, self._on_notify)
+                logger.info(f"Listening for ticket events on '{self.channel}' (asyncio, pid {os.getpid()})")
+                backoff = 1
+                # Anything published while we were disconnected was missed.
+                for ticket_id, queues in list(self._subscribers.items()):
+                    for queue in list(queues):
+                        self._push(queue, {"type": "resync", "ticket_id": ticket_id})
+                await lost.wait()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Async ticket event listener error: {e}; reconnecting in {backoff}s")
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        for queue in list(self._subscribers.get(event.get("ticket_id"), ())):
+            self._push(queue, event)
+
+    @staticmethod
+    def _push(queue, event):
+        try:
+            queue.put_nowait(event)
+        except asyncio.QueueFull:
+            pass
+
+
+db = None
+replica_db = None
+hub = AsyncEventHub(DATABASE_URL, ticket_events.channel, ASYNC_MAX_STREAMS)
+
+
+# ---- Routes ---- #
+def _http_date(value):
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True) if value else None
+
+
+def _chat_headers(etag, last_at):
+    headers = {"ETag": f'W/"{etag}"', "Cache-Control": "private, no-cache"}
+    if last_at:
+        headers["Last-Modified"] = _http_date(last_at)
+    return headers
+
+
+def _etag_matches(request, etag):
+    header = request.headers.get("if-none-match", "")
+    tags = {tag.strip().removeprefix("W/").strip('"') for tag in header.split(",")}
+    return etag in tags or "*" in tags
+
+
+async def ticket_messages(request):
+    """Same contract as app.get_ticket_messages."""
+    ticket_id = request.path_params["ticket_id"]
+    session = load_session(request)
+    since = _int_param(request, "since")
+    # Sent by pages when an event stream push prompted the fetch; see app.get_ticket_messages.
+    latest = _int_param(request, "latest")
+    pushed = latest is not None and (since is None or since < latest or latest == 0)
+
+    try:
+        pool = _read_pool(session, pushed)
+        async with pool.acquire() as conn:
+            # Marker writes go to the primary; reuse the connection when it is one.
+            writer = conn if pool is db else db
+            return await _ticket_messages(request, conn, writer, ticket_id, session, since)
+    except asyncpg.PostgresError as e:
+        logger.error(f"Error fetching messages: {e}")
+        return JSONResponse({"error": "Internal server error"}, status_code=500)
+
+
+def _int_param(request, name):
+    try:
+        return int(request.query_params[name]) if name in request.query_params else None
+    except ValueError:
+        return None
+
+
+def _read_pool(session, pushed):
+    """The replica pool while the app's router would use the replica for this session, else the primary."""
+    if replica_db is None or pushed:
+        return db
+    use_replica = replica_router.pool(session.get('wrote_at')) is not replica_router.primary
+    return replica_db if use_replica else db
+
+
+_THREAD_HEAD_SQL = """
+    SELECT t.email, last_msg.id AS last_id, last_msg.created_at AS last_at
+    FROM {tickets} t
+    LEFT JOIN LATERAL (
+        SELECT id, created_at FROM {messages}
+        WHERE ticket_id = t.ticket_id
+        ORDER BY id DESC LIMIT 1
+    ) last_msg ON TRUE
+    WHERE t.ticket_id = $1
+"""
+
+# (tickets, messages) tables to look in: active first, then archived.
+_THREAD_TABLES = [("tickets", "messages"), ("tickets_archive", "messages_archive")]
+
+# dashboard's marker upsert with asyncpg's numbered placeholders.
+_MARK_READ_SQL = dashboard.MARK_READ_SQL.replace("%s", "${}").format(1, 2, 3)
+
+
+async def _ticket_messages(request, conn, writer, ticket_id, session, since):
+    for tickets_table, messages_table in _THREAD_TABLES:
+        ticket = await conn.fetchrow(
+            _THREAD_HEAD_SQL.format(tickets=tickets_table, messages=messages_table), ticket_id)
+        if ticket:
+            break
+    else:
+        return JSONResponse({"error": "Ticket not found"}, status_code=404)
+    if not authorized(session, ticket["email"]):
+        return JSONResponse({"error": "Unauthorized"}, status_code=403)
+
+    etag = str(ticket["last_id"] or 0)
+    headers = _chat_headers(etag, ticket["last_at"])
+    if _etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+
+    if since is not None and since >= (ticket["last_id"] or 0):
+        rows = []
+    else:
+        rows = await conn.fetch(
+            f"SELECT id, sender_type, content, created_at FROM {messages_table} "
+            "WHERE ticket_id = $1 AND id > $2 ORDER BY id ASC", ticket_id, since or 0)
+
+    # The page already showed (and marked) everything up to ``since``; archived
+    # tickets have no marker.
+    last_id = ticket["last_id"] or 0
+    if (not session.get('admin_authenticated') and tickets_table == "tickets" and last_id
+            and (since is None or since < last_id)):
+        await writer.execute(_MARK_READ_SQL, ticket_id, "user", last_id)
+
+    messages = [{"id": r["id"], "sender_type": r["sender_type"], "content": r["content"],
+                 "created_at": _http_date(r["created_at"])} for r in rows]
+    return JSONResponse(messages, headers=headers)
+
+
+async def ticket_event_stream(request):
+    """Same contract as app.ticket_event_stream, without a thread per stream."""
+    ticket_id = request.path_params["ticket_id"]
+    session = load_session(request)
+    async with db.acquire() as conn:
+        email = await conn.fetchval(
+            "SELECT email FROM tickets WHERE ticket_id = $1 "
+            "UNION ALL SELECT email FROM tickets_archive WHERE ticket_id = $1 LIMIT 1", ticket_id)
+    if email is None:
+        return JSONResponse({"error": "Ticket not found"}, status_code=404)
+    if not authorized(session, email):
+        return JSONResponse({"error": "Unauthorized"}, status_code=403)
+
+    queue = hub.subscribe(ticket_id)
+    if queue is None:
+        return JSONResponse({"error": "Too many open streams"}, status_code=503)
+
+    async def stream():
+        try:
+            yield "retry: 5000\n\n"
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + SSE_MAX_DURATION
+            while loop.time() < deadline:
+                try:
+                    event = await asyncio.wait_for(queue.get(), SSE_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            hub.unsubscribe(ticket_id, queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def async_stats(request):
+    """Streams and asyncpg pool of the async chat routes only; bridged routes use the other /healthz pages."""
+    return JSONResponse({
+        "open_streams": hub._count,
+        "max_streams": hub.max_streams,
+        "tickets_watched": len(hub._subscribers),
+        "db_pool_size": db.get_size() if db else 0,
+        "db_pool_idle": db.get_idle_size() if db else 0,
+    })
+
+
+@asynccontextmanager
+async def lifespan(_):
+    global db, replica_db
+    db = await asyncpg.create_pool(DATABASE_URL, min_size=1, max_size=ASYNC_DB_POOL_MAX_SIZE)
+    if DATABASE_REPLICA_URL:
+        replica_db = await asyncpg.create_pool(DATABASE_REPLICA_URL, min_size=0, max_size=ASYNC_DB_POOL_MAX_SIZE)
+    hub.start()
+    try:
+        yield
+    finally:
+        await hub.stop()
+        await db.close()
+        if replica_db is not None:
+            await replica_db.close()
+
+
+app = Starlette(
+    routes=[
+        Route("/api/ticket/{ticket_id}/messages", ticket_messages, methods=["GET"]),
+        Route("/api/ticket/{ticket_id}/events", ticket_event_stream, methods=["GET"]),
+        Route("/healthz/async", async_stats, methods=["GET"]),
+        Mount("/", app=WSGIMiddleware(flask_app, workers=WSGI_THREADS)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,145 @@
+"""
+Cold-start and worker-restart times for the app under gunicorn.
+
+For each mode (without and with ``--preload``) this measures:
+
+* import     seconds for ``python -c "import app; app.create_app()"``
+* cold start seconds from spawning gunicorn to the first 200 from /healthz/db
+* restart    seconds from SIGKILLing the worker to the first 200 from its
+             replacement (one worker, so every request lands on the new one)
+
+Each figure is the median of ``--runs`` attempts. Usage:
+
+    BENCH_DATABASE_URL=postgresql://localhost/ticket_bench python -m bench.coldstart --runs 5
+
+Results are printed and written to ``bench/results/coldstart-<time>-<rev>.json``.
+"""
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import requests
+
+from bench.run import ROOT, app_env, git_revision
+from bench.fake_email import FakeEmailService
+
+
+def wait_healthy(url, process, deadline):
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            if requests.get(url, timeout=1).status_code == 200:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.02)
+    return False
+
+
+def worker_pids(master_pid):
+    try:
+        with open(f"/proc/{master_pid}/task/{master_pid}/children") as f:
+            return [int(pid) for pid in f.read().split()]
+    except OSError:
+        out = subprocess.run(["pgrep", "-P", str(master_pid)], capture_output=True, text=True).stdout
+        return [int(pid) for pid in out.split()]
+
+
+def measure_import(env):
+    started = time.monotonic()
+    subprocess.run([sys.executable, "-c", "import app; app.create_app()"], cwd=ROOT, env=env, check=True)
+    return time.monotonic() - started
+
+
+def measure_server(args, env, preload, log):
+    cmd = [sys.executable, "-m", "gunicorn", "app:create_app()", "-b", f"127.0.0.1:{args.port}",
+           "-w", "1", "--worker-class", "gthread", "--threads", "4"]
+    if preload:
+        cmd.append("--preload")
+    url = f"http://127.0.0.1:{args.port}/healthz/db"
+
+    started = time.monotonic()
+    process = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        if not wait_healthy(url, process, started + 60):
+            raise SystemExit(f"gunicorn did not become healthy; see {log.name}")
+        cold_start = time.monotonic() - started
+
+        pids = worker_pids(process.pid)
+        if not pids:
+            raise SystemExit("could not find the gunicorn worker")
+        killed_at = time.monotonic()
+        os.kill(pids[0], signal.SIGKILL)
+        # Wait until the master has reaped it, so the next 200 comes from the replacement.
+        while pids[0] in worker_pids(process.pid) and time.monotonic() - killed_at < 5:
+            time.sleep(0.005)
+        if not wait_healthy(url, process, killed_at + 60):
+            raise SystemExit(f"worker was not replaced; see {log.name}")
+        restart = time.monotonic() - killed_at
+    finally:
+        process.terminate()
+        try:
+            process.wait(15)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    return cold_start, restart
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure app import, cold-start and worker-restart times.")
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--port", type=int, default=5056)
+    parser.add_argument("--output", help="JSON results path")
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("set BENCH_DATABASE_URL or pass --database-url")
+
+    revision = git_revision()
+    started_at = datetime.now(timezone.utc)
+    workdir = tempfile.mkdtemp(prefix="ticket-coldstart-")
+    email_service = FakeEmailService().start()
+    # The only run.py options app_env reads.
+    env = app_env(argparse.Namespace(database_url=args.database_url, thumbnails=False, threads=4),
+                  email_service, os.path.join(workdir, "uploads"))
+
+    results = {"import_s": []}
+    try:
+        with open(os.path.join(workdir, "gunicorn.log"), "wb") as log:
+            for _ in range(args.runs):
+                results["import_s"].append(measure_import(env))
+                for preload in (False, True):
+                    mode = "preload" if preload else "default"
+                    cold_start, restart = measure_server(args, env, preload, log)
+                    results.setdefault(f"{mode}_cold_start_s", []).append(cold_start)
+                    results.setdefault(f"{mode}_restart_s", []).append(restart)
+    finally:
+        email_service.stop()
+
+    summary = {name: round(statistics.median(values), 3) for name, values in results.items()}
+    report = {
+        "summary": summary,
+        "runs": {name: [round(v, 3) for v in values] for name, values in results.items()},
+        "meta": {"revision": revision, "started_at": started_at.isoformat(), "python": sys.version.split()[0]},
+    }
+    output = args.output or os.path.join(
+        ROOT, "bench", "results", f"coldstart-{started_at:%Y%m%d-%H%M%S}-{revision}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    for name, value in summary.items():
+        print(f"{name:<24} {value:>8.3f}s")
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
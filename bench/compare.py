@@ -0,0 +1,57 @@
+"""
+Compare two benchmark result files route by route.
+
+    python -m bench.compare bench/results/old.json bench/results/new.json
+
+Exits with status 1 if any route's p95 got slower by more than --threshold
+(default 15%), so it can gate a CI job.
+"""
+import argparse
+import json
+import sys
+
+
+def change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two bench.run result files.")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.15, help="allowed p95 slowdown (fraction)")
+    parser.add_argument("--min-count", type=int, default=20, help="ignore routes with fewer samples")
+    args = parser.parse_args()
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+
+    print(f"baseline  {baseline['meta']['revision']}  ({baseline['total_throughput_rps']} req/s)")
+    print(f"candidate {candidate['meta']['revision']}  ({candidate['total_throughput_rps']} req/s)\n")
+    print(f"{'route':<44} {'p50 ms':>17} {'p95 ms':>17} {'p99 ms':>17} {'p95 change':>11}")
+
+    regressions = []
+    for label in sorted(set(baseline["routes"]) | set(candidate["routes"])):
+        old = baseline["routes"].get(label, {})
+        new = candidate["routes"].get(label, {})
+        cells = [f"{old.get(k) or '-':>8}>{new.get(k) or '-':<8}" for k in ("p50_ms", "p95_ms", "p99_ms")]
+        delta = change(old.get("p95_ms"), new.get("p95_ms"))
+        flag = ""
+        if (delta is not None and delta > args.threshold
+                and min(old.get("count", 0), new.get("count", 0)) >= args.min_count):
+            flag = "  REGRESSION"
+            regressions.append(label)
+        shown = f"{delta:+.1%}" if delta is not None else "-"
+        print(f"{label:<44} {cells[0]} {cells[1]} {cells[2]} {shown:>11}{flag}")
+
+    if regressions:
+        print(f"\n{len(regressions)} route(s) regressed beyond {args.threshold:.0%} at p95.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
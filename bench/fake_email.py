@@ -0,0 +1,122 @@
+"""
+Stand-in for the email microservice (EMAIL_SERVICE_URL).
+
+Accepts the same JSON POST as the real service, sleeps for a configurable
+latency and answers ``{"success": true}``. Recent messages are kept per
+recipient so the benchmark can read OTP codes out of them.
+
+Standalone: python -m bench.fake_email --port 8025 --latency 0.3
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeEmailService:
+    def __init__(self, host="127.0.0.1", port=0, latency=0.2, jitter=0.1, failure_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.received = 0
+        self.failed = 0
+        self._inbox = {}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-email", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def last_message(self, recipient):
+        with self._lock:
+            messages = self._inbox.get(recipient)
+            return messages[-1] if messages else None
+
+    def wait_for_message(self, recipient, after=0, timeout=15.0):
+        """Wait for a message to ``recipient`` received after ``after`` (a time.time() value)."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            message = self.last_message(recipient)
+            if message and message["received_at"] > after:
+                return message
+            time.sleep(0.05)
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {"received": self.received, "failed": self.failed, "latency": self.latency}
+
+    def _record(self, payload):
+        with self._lock:
+            self.received += 1
+            payload["received_at"] = time.time()
+            self._inbox.setdefault(payload.get("to"), deque(maxlen=5)).append(payload)
+
+    def _handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    payload = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    payload = {}
+                time.sleep(max(0.0, service.latency + random.uniform(-service.jitter, service.jitter)))
+
+                if random.random() < service.failure_rate:
+                    with service._lock:
+                        service.failed += 1
+                    body = {"success": False, "error": "simulated failure"}
+                else:
+                    service._record(payload)
+                    body = {"success": True}
+
+                data = json.dumps(body).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.1)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    service = FakeEmailService(args.host, args.port, args.latency, args.jitter, args.failure_rate)
+    print(f"Fake email service listening on {service.url}")
+    try:
+        service._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
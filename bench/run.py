@@ -0,0 +1,500 @@
+"""
+Offline load test for the ticket app.
+
+Boots the app (gunicorn, uvicorn with ``asgi:app``, or the Flask dev server)
+against a local Postgres, with ``LocalStorage`` in place of Supabase storage
+and ``FakeEmailService`` in place of EMAIL_SERVICE_URL, then drives a mix of
+virtual users:
+
+* submitters  fill in the ticket form, half of them with a PNG attachment
+* logins      run the OTP flow (code read from the fake inbox), then open
+              My Tickets and one of their tickets
+* pollers     sit on an admin ticket page and poll the chat every 3 seconds,
+              replying now and then
+* streamers   hold a live event stream open on a ticket, as an open chat
+              window does
+* admins      browse the ticket list, follow pagination and filters, open
+              tickets and search
+
+Latency percentiles and throughput per route are written to a JSON file;
+compare two runs with ``python -m bench.compare old.json new.json``.
+
+Usage:
+    BENCH_DATABASE_URL=postgresql://localhost/ticket_bench python -m bench.run --duration 60
+
+The database should be a dedicated one: the run creates the schema and seeds
+tickets for ``*@bench.example`` users.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import re
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+import psycopg2
+import psycopg2.extras
+import requests
+
+from bench.fake_email import FakeEmailService
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SEED_DOMAIN = "bench.example"
+ADMIN_PASSWORD = "bench-admin"
+ERROR_TYPES = ["payment_failed", "wrong_deduction", "not_credited", "bank_one_loading", "other"]
+SEARCH_TERMS = ["transfer", "debited", "pending", "reversal", "airtime", "0123"]
+WORDS = ("my transfer was debited but not received please help reversal pending airtime card "
+         "failed twice charged account balance still shows wrong amount since yesterday").split()
+
+CSRF_INPUT = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+CSRF_META = re.compile(r'name="csrf-token" content="([^"]+)"')
+OTP_CODE = re.compile(r">(\d{6})<")
+NEXT_CURSOR = re.compile(r"[?&]cursor=([A-Za-z0-9_\-]+)")
+
+
+# ---- Measurement ---- #
+class Recorder:
+    def __init__(self, warmup):
+        self.measure_from = time.monotonic() + warmup
+        self.measure_until = None
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._errors = {}
+
+    def request(self, session, label, method, url, expect=(200,), **kwargs):
+        started = time.monotonic()
+        try:
+            response = session.request(method, url, timeout=30, allow_redirects=False, **kwargs)
+        except requests.RequestException as e:
+            self.error(label, type(e).__name__, started)
+            return None
+        elapsed = time.monotonic() - started
+        if response.status_code not in expect:
+            self.error(label, f"HTTP {response.status_code}", started)
+            return response
+        if started >= self.measure_from:
+            with self._lock:
+                self._samples.setdefault(label, []).append(elapsed)
+        return response
+
+    def error(self, label, reason, started=None):
+        if started is not None and started < self.measure_from:
+            return
+        with self._lock:
+            errors = self._errors.setdefault(label, {})
+            errors[reason] = errors.get(reason, 0) + 1
+
+    def report(self):
+        duration = max(1e-9, (self.measure_until or time.monotonic()) - self.measure_from)
+        routes = {}
+        with self._lock:
+            labels = set(self._samples) | set(self._errors)
+            for label in sorted(labels):
+                latencies = sorted(self._samples.get(label, []))
+                errors = self._errors.get(label, {})
+                routes[label] = {
+                    "count": len(latencies),
+                    "errors": sum(errors.values()),
+                    "error_reasons": errors,
+                    "throughput_rps": round(len(latencies) / duration, 3),
+                    "p50_ms": percentile(latencies, 50),
+                    "p95_ms": percentile(latencies, 95),
+                    "p99_ms": percentile(latencies, 99),
+                    "max_ms": round(latencies[-1] * 1000, 2) if latencies else None,
+                }
+        total = sum(r["count"] for r in routes.values())
+        return {"measured_seconds": round(duration, 2), "total_requests": total,
+                "total_throughput_rps": round(total / duration, 3), "routes": routes}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile in milliseconds."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return round(sorted_values[rank - 1] * 1000, 2)
+
+
+# ---- Fixtures ---- #
+def make_png(width=480, height=320):
+    """A valid, poorly compressible PNG (~450 KB), similar to a phone screenshot."""
+    raw = b"".join(b"\x00" + os.urandom(width * 3) for _ in range(height))
+
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data) & 0xFFFFFFFF)
+
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(raw, 6))
+            + chunk(b"IEND", b""))
+
+
+def sentence(n):
+    return " ".join(random.choice(WORDS) for _ in range(n)).capitalize() + "."
+
+
+def seed(database_url, tickets, users):
+    """Top the database up to ``tickets`` seeded tickets. Returns {email: [ticket_id, ...]}."""
+    conn = psycopg2.connect(database_url)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM tickets WHERE email LIKE %s", (f"%@{SEED_DOMAIN}",))
+        missing = tickets - cursor.fetchone()[0]
+        if missing > 0:
+            print(f"Seeding {missing} tickets...")
+            rows, messages = [], []
+            for i in range(missing):
+                ticket_id = f"TICKET-b{random.getrandbits(32):08x}"
+                user = random.randrange(users)
+                description = sentence(random.randint(8, 40))
+                rows.append((ticket_id, f"Bench User {user}", f"{random.randrange(10**10):010d}",
+                             f"user{user}@{SEED_DOMAIN}", f"REF{random.randrange(10**8)}",
+                             random.choice(ERROR_TYPES), description,
+                             "Closed" if random.random() < 0.6 else "Open",
+                             random.randint(0, 90 * 24 * 3600)))
+                messages.append((ticket_id, "user", description))
+                for _ in range(random.randint(0, 6)):
+                    messages.append((ticket_id, random.choice(["user", "admin"]), sentence(random.randint(4, 25))))
+            psycopg2.extras.execute_values(cursor, """
+                INSERT INTO tickets (ticket_id, fullname, account_number, email, reference, error_type,
+                                     description, status, created_at)
+                SELECT v.ticket_id, v.fullname, v.account, v.email, v.reference, v.error_type,
+                       v.description, v.status, NOW() - make_interval(secs => v.age)
+                FROM (VALUES %s) AS v (ticket_id, fullname, account, email, reference, error_type,
+                                       description, status, age)
+                ON CONFLICT DO NOTHING
+            """, rows, page_size=1000)
+            psycopg2.extras.execute_values(
+                cursor, "INSERT INTO messages (ticket_id, sender_type, content) VALUES %s", messages, page_size=1000)
+            cursor.execute("UPDATE tickets SET closed_at = created_at + INTERVAL '1 day' "
+                           "WHERE status = 'Closed' AND closed_at IS NULL")
+            conn.commit()
+
+        cursor.execute("SELECT email, ticket_id FROM tickets WHERE email LIKE %s", (f"%@{SEED_DOMAIN}",))
+        by_user = {}
+        for email, ticket_id in cursor.fetchall():
+            by_user.setdefault(email, []).append(ticket_id)
+        return by_user
+    finally:
+        conn.close()
+
+
+# ---- Scenarios ---- #
+class Context:
+    def __init__(self, base_url, recorder, email_service, users, stop, png, attach_ratio, reply_ratio):
+        self.base_url = base_url
+        self.recorder = recorder
+        self.email_service = email_service
+        self.users = users
+        self.ticket_ids = [t for tickets in users.values() for t in tickets]
+        self.stop = stop
+        self.png = png
+        self.attach_ratio = attach_ratio
+        self.reply_ratio = reply_ratio
+
+    def url(self, path):
+        return self.base_url + path
+
+    def get(self, session, label, path, **kwargs):
+        return self.recorder.request(session, label, "GET", self.url(path), **kwargs)
+
+    def post(self, session, label, path, **kwargs):
+        return self.recorder.request(session, label, "POST", self.url(path), **kwargs)
+
+
+def csrf_from(response, pattern=CSRF_INPUT):
+    match = pattern.search(response.text) if response is not None else None
+    return match.group(1) if match else None
+
+
+def admin_session(ctx):
+    session = requests.Session()
+    page = ctx.get(session, "GET /tickets (login page)", "/tickets")
+    ctx.post(session, "POST /tickets (admin login)", "/tickets", expect=(302,),
+             data={"password": ADMIN_PASSWORD, "csrf_token": csrf_from(page)})
+    return session
+
+
+def submitter(ctx, vu):
+    session = requests.Session()
+    while not ctx.stop.is_set():
+        page = ctx.get(session, "GET /", "/")
+        token = csrf_from(page)
+        if token:
+            user = random.randrange(1000)
+            data = {
+                "csrf_token": token,
+                "name": f"Load Tester {user}",
+                "account": f"{random.randrange(10**10):010d}",
+                "email": f"submitter{user}@{SEED_DOMAIN}",
+                "reference": f"REF{random.randrange(10**8)}",
+                "error_type": random.choice(ERROR_TYPES),
+                "description": sentence(random.randint(10, 60)),
+            }
+            if random.random() < ctx.attach_ratio:
+                ctx.post(session, "POST / (with attachment)", "/", expect=(302,), data=data,
+                         files={"file": ("screenshot.png", ctx.png, "image/png")})
+            else:
+                ctx.post(session, "POST /", "/", expect=(302,), data=data)
+        ctx.stop.wait(random.uniform(2, 5))
+
+
+def login_user(ctx, vu, emails):
+    while not ctx.stop.is_set():
+        email = random.choice(emails)
+        session = requests.Session()
+        page = ctx.get(session, "GET /auth/login", "/auth/login")
+        requested_at = time.time()
+        verify_page = ctx.post(session, "POST /auth/login", "/auth/login",
+                               data={"email": email, "csrf_token": csrf_from(page)})
+        message = ctx.email_service.wait_for_message(email, after=requested_at)
+        match = OTP_CODE.search(message["html"]) if message else None
+        if not match:
+            ctx.recorder.error("OTP email", "not delivered", time.monotonic())
+        else:
+            ctx.post(session, "POST /auth/verify", "/auth/verify", expect=(302,),
+                     data={"email": email, "code": match.group(1), "csrf_token": csrf_from(verify_page)})
+            ctx.get(session, "GET /my-tickets", "/my-tickets")
+            ctx.get(session, "GET /track/<ticket_id>", f"/track/{random.choice(ctx.users[email])}")
+        ctx.stop.wait(random.uniform(3, 8))
+
+
+def chat_poller(ctx, vu, poll_interval=3.0):
+    session = admin_session(ctx)
+    while not ctx.stop.is_set():
+        ticket_id = random.choice(ctx.ticket_ids)
+        page = ctx.get(session, "GET /ticket/<ticket_id>", f"/ticket/{ticket_id}")
+        token = csrf_from(page, CSRF_META)
+        since, etag = None, None
+        # Stay on one conversation for a while, as an agent would.
+        for _ in range(random.randint(10, 40)):
+            if ctx.stop.wait(poll_interval):
+                return
+            headers = {"If-None-Match": etag} if etag else {}
+            path = f"/api/ticket/{ticket_id}/messages" + (f"?since={since}" if since else "")
+            response = ctx.get(session, "GET /api/ticket/<ticket_id>/messages", path,
+                               expect=(200, 304), headers=headers)
+            if response is not None and response.status_code == 200:
+                etag = response.headers.get("ETag")
+                messages = response.json()
+                if messages:
+                    since = messages[-1]["id"]
+            if token and random.random() < ctx.reply_ratio:
+                ctx.post(session, "POST /api/reply", "/api/reply",
+                         json={"ticket_id": ticket_id, "sender_type": "admin", "message": sentence(12)},
+                         headers={"X-CSRFToken": token})
+
+
+def event_streamer(ctx, vu):
+    session = admin_session(ctx)
+    while not ctx.stop.is_set():
+        ticket_id = random.choice(ctx.ticket_ids)
+        # Timed until the headers arrive; the body is read until the server
+        # recycles the stream or the run ends.
+        response = ctx.get(session, "GET /api/ticket/<ticket_id>/events (connect)",
+                           f"/api/ticket/{ticket_id}/events", stream=True)
+        if response is None or response.status_code != 200:
+            ctx.stop.wait(5)
+            continue
+        try:
+            for _ in response.iter_lines():
+                if ctx.stop.is_set():
+                    break
+        except requests.RequestException:
+            pass
+        finally:
+            response.close()
+
+
+def admin_browser(ctx, vu):
+    session = admin_session(ctx)
+    while not ctx.stop.is_set():
+        page = ctx.get(session, "GET /tickets", "/tickets")
+        match = NEXT_CURSOR.search(page.text) if page is not None else None
+        if match:
+            ctx.get(session, "GET /tickets?cursor", f"/tickets?cursor={match.group(1)}")
+        ctx.get(session, "GET /tickets?status&error_type",
+                f"/tickets?status=Open&error_type={random.choice(ERROR_TYPES)}")
+        ctx.get(session, "GET /ticket/<ticket_id>", f"/ticket/{random.choice(ctx.ticket_ids)}")
+        ctx.get(session, "GET /tickets/search", f"/tickets/search?q={random.choice(SEARCH_TERMS)}")
+        ctx.stop.wait(random.uniform(1, 3))
+
+
+# ---- Orchestration ---- #
+def app_env(args, email_service, upload_dir):
+    env = dict(os.environ)
+    env.update({
+        "DATABASE_URL": args.database_url,
+        "EMAIL_SERVICE_URL": email_service.url,
+        "STORAGE_BACKEND": "local",
+        "LOCAL_UPLOAD_DIR": upload_dir,
+        "MAIL_USERNAME": f"admin@{SEED_DOMAIN}",
+        "ADMIN_PASSWORD": ADMIN_PASSWORD,
+        "SECRET_KEY": "bench-secret",
+        "RATELIMIT_ENABLED": "false",
+        "THUMBNAILS_ENABLED": "true" if args.thumbnails else "false",
+        "WSGI_THREADS": str(args.threads),
+    })
+    env.pop("SUPABASE_URL", None)
+    return env
+
+
+def start_server(args, env, log_path):
+    if args.server == "gunicorn":
+        cmd = [sys.executable, "-m", "gunicorn", "app:create_app()", "-b", f"127.0.0.1:{args.port}",
+               "-w", str(args.workers), "--worker-class", "gthread", "--threads", str(args.threads)]
+    elif args.server == "asgi":
+        cmd = [sys.executable, "-m", "uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", str(args.port),
+               "--workers", str(args.workers), "--no-access-log"]
+    else:
+        cmd = [sys.executable, "-m", "flask", "--app", "app", "run", "--port", str(args.port)]
+    log = open(log_path, "wb")
+    process = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    base_url = f"http://127.0.0.1:{args.port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"Server exited during startup; see {log_path}")
+        try:
+            if requests.get(base_url + "/healthz/db", timeout=2).status_code == 200:
+                return process, base_url
+        except requests.RequestException:
+            pass
+        time.sleep(0.25)
+    process.terminate()
+    raise SystemExit(f"Server did not become healthy; see {log_path}")
+
+
+def server_stats(base_url):
+    stats = {}
+    for name in ("db", "outbox", "events", "cache", "jobs", "async"):
+        try:
+            response = requests.get(f"{base_url}/healthz/{name}", timeout=5)
+            if response.ok:
+                stats[name] = response.json()
+        except (requests.RequestException, ValueError):
+            pass
+    return stats
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline load test for the ticket app.")
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"))
+    parser.add_argument("--duration", type=float, default=60, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=10, help="seconds excluded from the results")
+    parser.add_argument("--submitters", type=int, default=2)
+    parser.add_argument("--logins", type=int, default=2)
+    parser.add_argument("--pollers", type=int, default=40)
+    parser.add_argument("--admins", type=int, default=3)
+    parser.add_argument("--streamers", type=int, default=0, help="open chat event streams")
+    parser.add_argument("--attach-ratio", type=float, default=0.5)
+    parser.add_argument("--reply-ratio", type=float, default=0.02, help="chance of a reply per poll")
+    parser.add_argument("--email-latency", type=float, default=0.3, help="seconds per fake email call")
+    parser.add_argument("--seed-tickets", type=int, default=5000)
+    parser.add_argument("--seed-users", type=int, default=500)
+    parser.add_argument("--server", choices=["gunicorn", "asgi", "flask"], default="gunicorn")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=32, help="gunicorn threads / asgi WSGI_THREADS")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--thumbnails", action="store_true", help="keep thumbnail generation on")
+    parser.add_argument("--output", help="JSON results path (default bench/results/<time>-<rev>.json)")
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("set BENCH_DATABASE_URL or pass --database-url")
+    return args
+
+
+def main():
+    args = parse_args()
+    revision = git_revision()
+    started_at = datetime.now(timezone.utc)
+    workdir = tempfile.mkdtemp(prefix="ticket-bench-")
+    email_service = FakeEmailService(latency=args.email_latency).start()
+    env = app_env(args, email_service, os.path.join(workdir, "uploads"))
+
+    subprocess.run([sys.executable, "-m", "flask", "--app", "app", "init-db"], cwd=ROOT, env=env, check=True)
+    users = seed(args.database_url, args.seed_tickets, args.seed_users)
+    server, base_url = start_server(args, env, os.path.join(workdir, "server.log"))
+    print(f"Server up at {base_url} (logs in {workdir})")
+
+    stop = threading.Event()
+    recorder = Recorder(args.warmup)
+    ctx = Context(base_url, recorder, email_service, users, stop, make_png(),
+                  args.attach_ratio, args.reply_ratio)
+
+    emails = sorted(users)
+    threads = []
+    for i in range(args.submitters):
+        threads.append(threading.Thread(target=submitter, args=(ctx, i)))
+    for i in range(args.logins):
+        # Disjoint users per virtual user so OTP codes never overwrite each other.
+        threads.append(threading.Thread(target=login_user, args=(ctx, i, emails[i::args.logins])))
+    for i in range(args.pollers):
+        threads.append(threading.Thread(target=chat_poller, args=(ctx, i)))
+    for i in range(args.admins):
+        threads.append(threading.Thread(target=admin_browser, args=(ctx, i)))
+    for i in range(args.streamers):
+        threads.append(threading.Thread(target=event_streamer, args=(ctx, i)))
+
+    try:
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        print(f"Running {len(threads)} virtual users for {args.warmup:.0f}s warm-up + {args.duration:.0f}s...")
+        time.sleep(args.warmup + args.duration)
+        recorder.measure_until = time.monotonic()
+        stop.set()
+        for thread in threads:
+            thread.join(35)
+        results = recorder.report()
+        results["server"] = server_stats(base_url)
+    finally:
+        stop.set()
+        server.terminate()
+        try:
+            server.wait(15)
+        except subprocess.TimeoutExpired:
+            server.kill()
+        email_service.stop()
+
+    results["meta"] = {
+        "revision": revision,
+        "started_at": started_at.isoformat(),
+        "python": platform.python_version(),
+        "email_service": email_service.stats(),
+        "args": {k: v for k, v in vars(args).items() if k != "database_url"},
+    }
+
+    output = args.output or os.path.join(
+        ROOT, "bench", "results", f"{started_at:%Y%m%d-%H%M%S}-{revision}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+    print(f"\n{'route':<44} {'count':>7} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for label, route in results["routes"].items():
+        print(f"{label:<44} {route['count']:>7} {route['errors']:>5} {route['throughput_rps']:>8} "
+              f"{route['p50_ms'] or '-':>8} {route['p95_ms'] or '-':>8} {route['p99_ms'] or '-':>8}")
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
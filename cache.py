@@ -0,0 +1,187 @@
+"""
+Read cache for ticket threads (the ticket row plus its messages).
+
+Entries live in a per-process LRU with a TTL and are tagged with the
+ticket's version number at the time they were loaded. Writers call
+``bump(ticket_id)``; any entry whose tag no longer matches the current
+version is treated as a miss. Callers must read the version *before*
+querying the database (``lookup`` returns it) so a write that lands during
+the query can never be cached under the new version.
+
+Threads read from a replica may predate a write that the version already
+reflects. They are stored with ``from_replica=True`` and a short TTL.
+``lookup(key, replica_ok=False)`` ignores such entries, which is what a
+session that just wrote needs in order to see its own change.
+
+Version numbers come from a pluggable store:
+
+* ``LocalVersionStore`` keeps them in-process. Other gunicorn workers learn
+  about writes through the Postgres NOTIFY channel (see ``handle_event``,
+  which bumps the local version) and, failing that, through the TTL.
+  Writers must therefore publish a ticket event along with the bump.
+* ``RedisVersionStore`` shares them between all workers and hosts.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class LocalVersionStore:
+    """
+    Keeps the ``max_keys`` most recently bumped versions. A forgotten key
+    starts again from 0, so caches registered with ``add_evict_listener``
+    drop their entries for it first; otherwise an entry stored at version 0
+    could match again after the reset.
+    """
+    shared = False
+
+    def __init__(self, max_keys=50000):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._versions = OrderedDict()
+        self._evict_listeners = []
+
+    def add_evict_listener(self, callback):
+        self._evict_listeners.append(callback)
+
+    def get(self, key):
+        with self._lock:
+            return self._versions.get(key, 0)
+
+    def bump(self, key):
+        with self._lock:
+            version = self._versions.pop(key, 0) + 1
+            self._versions[key] = version
+            evicted = []
+            while len(self._versions) > self.max_keys:
+                evicted.append(self._versions.popitem(last=False)[0])
+        for old_key in evicted:
+            for callback in self._evict_listeners:
+                callback(old_key)
+        return version
+
+
+class RedisVersionStore:
+    shared = True
+
+    def __init__(self, url, prefix="ticket-version:", ttl=86400):
+        self.url = url
+        self.prefix = prefix
+        self.ttl = ttl
+        self._client = None
+        self._pid = None
+
+    def _redis(self):
+        if self._client is None or self._pid != os.getpid():
+            import redis
+            self._client = redis.Redis.from_url(self.url, socket_timeout=0.5)
+            self._pid = os.getpid()
+        return self._client
+
+    def get(self, key):
+        # None means "version unknown": the caller bypasses the cache.
+        try:
+            value = self._redis().get(self.prefix + key)
+        except Exception as e:
+            logger.warning(f"Cache version lookup failed: {e}")
+            return None
+        return int(value) if value is not None else 0
+
+    def bump(self, key):
+        try:
+            pipe = self._redis().pipeline()
+            pipe.incr(self.prefix + key)
+            pipe.expire(self.prefix + key, self.ttl)
+            return pipe.execute()[0]
+        except Exception as e:
+            logger.warning(f"Cache version bump failed: {e}")
+            return None
+
+
+class TicketCache:
+    def __init__(self, versions, max_entries=500, ttl=30.0):
+        self.versions = versions
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # key -> (version, expires_at, value, from_replica)
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+        if not versions.shared:
+            versions.add_evict_listener(self._forget)
+
+    def lookup(self, key, replica_ok=True):
+        """Return (value or None, version). Pass the version to ``store``."""
+        version = self.versions.get(key)
+        if version is None:
+            self._count("misses")
+            return None, None
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version and entry[1] > now:
+                if replica_ok or not entry[3]:
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return entry[2], version
+            elif entry is not None:
+                del self._entries[key]
+            self._stats["misses"] += 1
+        return None, version
+
+    def store(self, key, version, value, ttl=None, from_replica=False):
+        if version is None or self.max_entries <= 0:
+            return
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self._lock:
+            self._entries[key] = (version, time.monotonic() + ttl, value, from_replica)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def bump(self, key):
+        """Call after committing any write that changes what a reader of ``key`` would see."""
+        self.versions.bump(key)
+        self.invalidate_local(key)
+
+    def invalidate_local(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+            self._stats["invalidations"] += 1
+
+    def _forget(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def handle_event(self, event):
+        """Listener for TicketEventHub: drop entries other workers changed."""
+        key = event.get("ticket_id")
+        if key is not None and not self.versions.shared:
+            # A local version is this worker's only record of the write; bumping
+            # it also stops a load that started before the write from being
+            # stored afterwards under the old version.
+            self.versions.bump(key)
+        self.invalidate_local(key)
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["max_entries"] = self.max_entries
+        stats["ttl"] = self.ttl
+        stats["shared_versions"] = self.versions.shared
+        return stats
@@ -0,0 +1,254 @@
+"""
+Pooled Postgres connections for the ticket app.
+
+Each gunicorn worker process owns one ConnectionPool. Connections are opened
+lazily, handed out through ``pool.connection()`` and returned to the pool
+when the ``with`` block exits. Idle connections are health-checked before
+reuse and recycled once they get too old, and checkout waits are bounded so
+a saturated pool fails fast instead of hanging a request.
+"""
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+
+class PoolError(Exception):
+    """Base class for pool failures."""
+
+
+class PoolTimeout(PoolError):
+    """No connection became available within the checkout timeout."""
+
+
+class DatabaseUnavailable(PoolError):
+    """A new connection could not be opened."""
+
+
+class _PooledConnection:
+    __slots__ = ("conn", "created_at", "last_used")
+
+    def __init__(self, conn):
+        now = time.monotonic()
+        self.conn = conn
+        self.created_at = now
+        self.last_used = now
+
+
+class ConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool with bounded checkout.
+
+    max_size        hard cap on open connections for this process
+    timeout         seconds a checkout may wait for a free connection
+    max_lifetime    connections older than this are closed and replaced
+    max_idle        connections idle longer than this are closed
+    check_after     idle connections older than this get a ``SELECT 1``
+                    before being handed out
+    """
+
+    def __init__(self, dsn, max_size=5, timeout=5.0,
+                 max_lifetime=1800.0, max_idle=300.0, check_after=30.0,
+                 connect_kwargs=None):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.max_idle = max_idle
+        self.check_after = check_after
+        self.connect_kwargs = connect_kwargs or {}
+
+        self._cond = threading.Condition()
+        self._inherited = []
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = os.getpid()
+        self._idle = []          # LIFO stack of _PooledConnection
+        self._in_use = {}        # id(conn) -> _PooledConnection
+        self._opening = 0
+        self._waiting = 0
+        self._stats = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "connects": 0,
+            "connect_errors": 0,
+            "recycled": 0,
+            "failed_health_checks": 0,
+            "checkout_wait_total": 0.0,
+            "checkout_wait_max": 0.0,
+        }
+
+    def _check_fork(self):
+        # Connections must never be shared across processes. If the pool
+        # was touched before gunicorn forked (e.g. with --preload), drop the
+        # inherited sockets without closing them so the parent's sessions
+        # are left alone.
+        if self._pid != os.getpid():
+            with self._cond:
+                if self._pid != os.getpid():
+                    self._inherited = list(self._idle) + list(self._in_use.values())
+                    self._reset_state()
+
+    # ---- Public API ---- #
+    @contextmanager
+    def connection(self):
+        """
+        Borrow a connection for the duration of the ``with`` block.
+
+        Any transaction still open when the block exits is rolled back, so
+        callers must commit explicitly. Broken connections are discarded
+        instead of being returned to the pool.
+        """
+        pooled = self._checkout()
+        try:
+            yield pooled.conn
+        except BaseException:
+            self._checkin(pooled, rollback=True)
+            raise
+        else:
+            self._checkin(pooled)
+
+    def stats(self):
+        """Snapshot of pool usage for health/metrics endpoints."""
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update({
+                "in_use": len(self._in_use),
+                "idle": len(self._idle),
+                "opening": self._opening,
+                "waiting": self._waiting,
+                "max_size": self.max_size,
+            })
+        checkouts = stats["checkouts"] or 1
+        stats["checkout_wait_avg_ms"] = round(stats.pop("checkout_wait_total") / checkouts * 1000, 3)
+        stats["checkout_wait_max_ms"] = round(stats.pop("checkout_wait_max") * 1000, 3)
+        return stats
+
+    def close(self):
+        """Close every idle connection. In-use connections close on return."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self.max_size = 0
+        for pooled in idle:
+            self._close(pooled)
+
+    # ---- Internals ---- #
+    def _checkout(self):
+        self._check_fork()
+        started = time.monotonic()
+        deadline = started + self.timeout
+
+        while True:
+            pooled = None
+            open_new = False
+            with self._cond:
+                while True:
+                    if self._idle:
+                        pooled = self._idle.pop()
+                        break
+                    if len(self._in_use) + self._opening < self.max_size:
+                        self._opening += 1
+                        open_new = True
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._stats["timeouts"] += 1
+                        raise PoolTimeout(
+                            f"No database connection available after {self.timeout}s "
+                            f"({len(self._in_use)} in use)"
+                        )
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+            if open_new:
+                pooled = self._open()
+            elif not self._usable(pooled):
+                self._close(pooled)
+                with self._cond:
+                    self._stats["recycled"] += 1
+                continue
+
+            waited = time.monotonic() - started
+            with self._cond:
+                self._in_use[id(pooled.conn)] = pooled
+                self._stats["checkouts"] += 1
+                self._stats["checkout_wait_total"] += waited
+                if waited > self._stats["checkout_wait_max"]:
+                    self._stats["checkout_wait_max"] = waited
+            return pooled
+
+    def _open(self):
+        try:
+            conn = psycopg2.connect(self.dsn, **self.connect_kwargs)
+        except Exception as e:
+            with self._cond:
+                self._opening -= 1
+                self._stats["connect_errors"] += 1
+                self._cond.notify()
+            logger.error(f"Database connection failed: {e}")
+            raise DatabaseUnavailable(str(e)) from e
+        with self._cond:
+            self._opening -= 1
+            self._stats["connects"] += 1
+        return _PooledConnection(conn)
+
+    def _usable(self, pooled):
+        now = time.monotonic()
+        if pooled.conn.closed:
+            return False
+        if now - pooled.created_at > self.max_lifetime:
+            return False
+        if now - pooled.last_used > self.max_idle:
+            return False
+        if now - pooled.last_used > self.check_after:
+            try:
+                with pooled.conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                pooled.conn.rollback()
+            except Exception as e:
+                logger.warning(f"Discarding unhealthy pooled connection: {e}")
+                with self._cond:
+                    self._stats["failed_health_checks"] += 1
+                return False
+        return True
+
+    def _checkin(self, pooled, rollback=False):
+        conn = pooled.conn
+        keep = not conn.closed
+        if keep:
+            try:
+                status = conn.get_transaction_status()
+                if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                    keep = False
+                elif rollback or status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except Exception:
+                keep = False
+
+        with self._cond:
+            self._in_use.pop(id(conn), None)
+            if keep and os.getpid() == self._pid and len(self._idle) < self.max_size:
+                pooled.last_used = time.monotonic()
+                self._idle.append(pooled)
+                pooled = None
+            self._cond.notify()
+
+        if pooled is not None:
+            self._close(pooled)
+
+    @staticmethod
+    def _close(pooled):
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
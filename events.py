@@ -0,0 +1,187 @@
+"""
+Push channel for ticket chat.
+
+Writers call ``hub.publish(cursor, ticket_id, message_id)`` inside their
+transaction; Postgres delivers the NOTIFY only if that transaction commits.
+Each worker process runs a single listener thread on a dedicated connection
+which fans notifications out to the in-process subscribers of that ticket,
+so an idle chat costs no queries at all. Other in-process consumers (the
+read cache) can register with ``add_listener`` to see every event.
+
+Every open stream occupies one request thread, so the number of streams per
+process is capped (``max_streams``). Once the cap is reached ``subscribe``
+raises ``StreamLimitReached`` and clients fall back to polling.
+"""
+import json
+import logging
+import os
+import queue
+import select
+import threading
+import time
+
+import psycopg2
+import psycopg2.extensions
+
+logger = logging.getLogger(__name__)
+
+
+class StreamLimitReached(Exception):
+    """This process is already serving ``max_streams`` event streams."""
+
+
+class Subscription:
+    def __init__(self, ticket_id):
+        self.ticket_id = ticket_id
+        self.queue = queue.Queue(maxsize=100)
+
+    def push(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # A client that is this far behind will resync on its next fetch.
+            pass
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class TicketEventHub:
+    def __init__(self, dsn, channel="ticket_events", max_streams=20):
+        self.dsn = dsn
+        self.channel = channel
+        self.max_streams = max_streams
+
+        self._lock = threading.Lock()
+        self._subscribers = {}   # ticket_id -> set of Subscription
+        self._listeners = []
+        self._count = 0
+        self._pid = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    # ---- Publishing ---- #
+    def publish(self, cursor, ticket_id, message_id=None, kind="message"):
+        payload = json.dumps({"ticket_id": ticket_id, "message_id": message_id, "type": kind})
+        cursor.execute("SELECT pg_notify(%s, %s)", (self.channel, payload))
+
+    def publish_many(self, cursor, ticket_ids, kind):
+        """One statement, one event per ticket; used by bulk admin actions."""
+        if not ticket_ids:
+            return
+        cursor.execute("""
+            SELECT pg_notify(%s, json_build_object('ticket_id', t, 'message_id', NULL, 'type', %s)::text)
+            FROM unnest(%s::text[]) AS t
+        """, (self.channel, kind, list(ticket_ids)))
+
+    # ---- Subscribing ---- #
+    def add_listener(self, callback):
+        """Call ``callback(event)`` on the listener thread for every event, any ticket."""
+        self._listeners.append(callback)
+
+    def start(self):
+        self._ensure_listener()
+
+    def subscribe(self, ticket_id):
+        self._ensure_listener()
+        with self._lock:
+            if self._count >= self.max_streams:
+                raise StreamLimitReached(f"{self._count} event streams already open")
+            sub = Subscription(ticket_id)
+            self._subscribers.setdefault(ticket_id, set()).add(sub)
+            self._count += 1
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subscribers.get(sub.ticket_id)
+            if subs and sub in subs:
+                subs.discard(sub)
+                self._count -= 1
+                if not subs:
+                    del self._subscribers[sub.ticket_id]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "open_streams": self._count,
+                "max_streams": self.max_streams,
+                "tickets_watched": len(self._subscribers),
+                "listener_running": bool(self._thread is not None and self._thread.is_alive()
+                                         and self._pid == os.getpid()),
+            }
+
+    # ---- Listener ---- #
+    def _ensure_listener(self):
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # Subscribers from a parent process are meaningless after fork.
+                self._subscribers = {}
+                self._count = 0
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._listen_forever, name="ticket-events-listener",
+                                            daemon=True)
+            self._thread.start()
+
+    def _listen_forever(self):
+        backoff = 1
+        while not self._stop.is_set():
+            conn = None
+            try:
+                conn = psycopg2.connect(self.dsn, connect_timeout=5)
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {self.channel}")
+                logger.info(f"Listening for ticket events on '{self.channel}' (pid {os.getpid()})")
+                backoff = 1
+                # Anything published while we were disconnected was missed.
+                self._broadcast({"type": "resync"})
+
+                while not self._stop.is_set():
+                    if select.select([conn], [], [], 5) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._dispatch(conn.notifies.pop(0).payload)
+            except Exception as e:
+                logger.error(f"Ticket event listener error: {e}; reconnecting in {backoff}s")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    def _dispatch(self, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        self._notify_listeners(event)
+        with self._lock:
+            subs = list(self._subscribers.get(event.get("ticket_id"), ()))
+        for sub in subs:
+            sub.push(event)
+
+    def _broadcast(self, event):
+        self._notify_listeners(event)
+        with self._lock:
+            subs = [sub for group in self._subscribers.values() for sub in group]
+        for sub in subs:
+            sub.push(dict(event, ticket_id=sub.ticket_id))
+
+    def _notify_listeners(self, event):
+        for callback in self._listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.error(f"Ticket event listener callback failed: {e}")
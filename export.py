@@ -0,0 +1,112 @@
+"""
+Streaming export of tickets with their conversations.
+
+Rows come from a named (server-side) cursor, fetched ``batch_size`` at a
+time, and are written out as they arrive, so an export holds one batch and
+one output chunk in memory however many tickets match.
+
+* CSV has one row per message, with the ticket columns repeated; tickets
+  without messages get a single row with empty message columns.
+* NDJSON has one line per ticket with its messages as a list. Rows arrive
+  ordered by ticket, so only the current ticket's thread is held.
+"""
+import csv
+import io
+import json
+import uuid
+
+TICKET_FIELDS = ["ticket_id", "fullname", "account_number", "email", "reference",
+                 "error_type", "status", "created_at", "closed_at", "description"]
+MESSAGE_FIELDS = ["message_id", "sender_type", "message_created_at", "content"]
+
+FORMATS = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+}
+
+# Output is flushed to the client in chunks of roughly this many characters.
+CHUNK_SIZE = 64 * 1024
+
+# Archived tickets are included; filters apply to both tables.
+EXPORT_SQL = """
+SELECT t.ticket_id, t.fullname, t.account_number, t.email, t.reference,
+       t.error_type, t.status, t.created_at, t.closed_at, t.description,
+       m.id, m.sender_type, m.created_at, m.content
+FROM (
+    SELECT {columns}, FALSE AS archived FROM tickets WHERE {where}
+    UNION ALL
+    SELECT {columns}, TRUE FROM tickets_archive WHERE {where}
+) t
+LEFT JOIN LATERAL (
+    SELECT id, sender_type, created_at, content FROM messages
+    WHERE ticket_id = t.ticket_id AND NOT t.archived
+    UNION ALL
+    SELECT id, sender_type, created_at, content FROM messages_archive
+    WHERE ticket_id = t.ticket_id AND t.archived
+) m ON TRUE
+ORDER BY t.created_at, t.ticket_id, m.id
+"""
+
+
+def _value(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
+
+
+def iter_rows(pool, clauses, params, batch_size=2000):
+    """Yield export rows from a server-side cursor, holding one pooled connection throughout."""
+    with pool.connection() as conn:
+        cursor = conn.cursor(name=f"export_{uuid.uuid4().hex[:12]}")
+        cursor.itersize = batch_size
+        where = " AND ".join(clauses) or "TRUE"
+        cursor.execute(EXPORT_SQL.format(columns=", ".join(TICKET_FIELDS), where=where), list(params) * 2)
+        try:
+            for row in cursor:
+                yield [_value(v) for v in row]
+        finally:
+            cursor.close()
+
+
+def _chunked(pieces):
+    buffer, size = [], 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_SIZE:
+            yield "".join(buffer)
+            buffer, size = [], 0
+    if buffer:
+        yield "".join(buffer)
+
+
+def _csv_lines(rows):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(TICKET_FIELDS + MESSAGE_FIELDS)
+    for row in rows:
+        writer.writerow(row)
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+    yield out.getvalue()
+
+
+def _ndjson_lines(rows):
+    ticket, messages = None, []
+    for row in rows:
+        if ticket is None or row[0] != ticket["ticket_id"]:
+            if ticket is not None:
+                yield json.dumps({**ticket, "messages": messages}) + "\n"
+            ticket, messages = dict(zip(TICKET_FIELDS, row)), []
+        message_id, sender_type, created_at, content = row[len(TICKET_FIELDS):]
+        if message_id is not None:
+            messages.append({"id": message_id, "sender_type": sender_type,
+                             "created_at": created_at, "content": content})
+    if ticket is not None:
+        yield json.dumps({**ticket, "messages": messages}) + "\n"
+
+
+def stream_export(pool, clauses, params, fmt="csv", batch_size=2000):
+    """Generator of text chunks for a ``Response``; ``fmt`` is a key of FORMATS."""
+    rows = iter_rows(pool, clauses, params, batch_size)
+    lines = _csv_lines(rows) if fmt == "csv" else _ndjson_lines(rows)
+    return _chunked(lines)
@@ -0,0 +1,24 @@
+"""
+gunicorn settings, picked up automatically from the working directory:
+
+    gunicorn 'app:create_app()'
+
+Everything is overridable from the environment (or the command line).
+GUNICORN_PRELOAD=true imports the app once in the master before forking.
+Workers then boot and restart without re-importing anything and share the
+imported code copy-on-write. This is safe because the app builds every
+connection, client and thread lazily per process (see ``create_app``).
+"""
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:' + os.getenv('PORT', '8000'))
+workers = int(os.getenv('GUNICORN_WORKERS', 2))
+worker_class = 'gthread'
+# Open chat streams hold a thread each; keep this above SSE_MAX_STREAMS.
+threads = int(os.getenv('GUNICORN_THREADS', 32))
+preload_app = os.getenv('GUNICORN_PRELOAD', 'false').lower() in ('1', 'true', 'yes')
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+# Recycle workers now and then; with preload a restart is just a fork.
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 0))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 0))
@@ -0,0 +1,173 @@
+"""
+Periodic maintenance jobs.
+
+Every web worker runs one scheduler thread, but each job executes at most
+once per interval across the whole deployment:
+
+* a Postgres session advisory lock (keyed by the job name) keeps two
+  processes from running the same job at the same time
+* ``job_runs.last_run_at`` is checked under that lock, so a worker that
+  wakes up just after another one finished skips its turn
+
+Jobs are plain callables taking a pooled connection; they commit as often
+as they like (the advisory lock survives commits) and may return a number
+that is recorded as the run's result, e.g. rows processed.
+"""
+import logging
+import os
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    def __init__(self, name, interval, func):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        # Stable across processes and restarts, unlike hash().
+        self.lock_key = zlib.crc32(f"jobs:{name}".encode())
+        self.next_check = 0.0
+        self.runs = 0
+        self.failures = 0
+
+
+class PeriodicJobs:
+    def __init__(self, pool, tick=5.0, enabled=True):
+        self.pool = pool
+        self.tick = tick
+        self.enabled = enabled
+        self.jobs = {}
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pid = None
+        self._thread = None
+
+    def register(self, name, interval, func):
+        self.jobs[name] = Job(name, interval, func)
+
+    # ---- Lifecycle ---- #
+    def ensure_started(self):
+        if not self.enabled or not self.jobs:
+            return
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="periodic-jobs", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def run_forever(self):
+        """Run the scheduler in the foreground (used by ``flask jobs-worker``)."""
+        self.enabled = True
+        self.ensure_started()
+        try:
+            while self._thread.is_alive():
+                self._thread.join(1)
+        except KeyboardInterrupt:
+            self.stop()
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for job in list(self.jobs.values()):
+                if job.next_check <= now:
+                    try:
+                        self.run_job(job.name)
+                    except Exception as e:
+                        logger.error(f"Job {job.name} scheduling error: {e}")
+                    job.next_check = time.monotonic() + min(job.interval, self.tick * 6)
+            self._stop.wait(self.tick)
+
+    # ---- Execution ---- #
+    def run_job(self, name, force=False):
+        """
+        Run one job if it is due and no other process holds it. Returns the
+        job's result, or None if it was skipped.
+        """
+        job = self.jobs[name]
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", (job.lock_key,))
+            if not cursor.fetchone()[0]:
+                conn.rollback()
+                return None
+            try:
+                cursor.execute("SELECT last_run_at > NOW() - make_interval(secs => %s) FROM job_runs WHERE name = %s",
+                               (job.interval, job.name))
+                row = cursor.fetchone()
+                conn.rollback()
+                if row and row[0] and not force:
+                    return None
+                return self._execute(conn, job)
+            finally:
+                try:
+                    conn.rollback()
+                    cursor = conn.cursor()
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", (job.lock_key,))
+                    conn.commit()
+                except Exception:
+                    # Closing the connection releases the lock server-side.
+                    conn.close()
+
+    def _execute(self, conn, job):
+        started = time.monotonic()
+        result, error = None, None
+        try:
+            result = job.func(conn)
+            conn.commit()
+            job.runs += 1
+        except Exception as e:
+            conn.rollback()
+            job.failures += 1
+            error = str(e)[:500]
+            logger.error(f"Job {job.name} failed: {e}")
+
+        duration_ms = int((time.monotonic() - started) * 1000)
+        cursor = conn.cursor()
+        cursor.execute("""
+            INSERT INTO job_runs (name, last_run_at, last_duration_ms, last_result, last_error)
+            VALUES (%s, NOW(), %s, %s, %s)
+            ON CONFLICT (name) DO UPDATE SET last_run_at = EXCLUDED.last_run_at,
+                last_duration_ms = EXCLUDED.last_duration_ms,
+                last_result = EXCLUDED.last_result, last_error = EXCLUDED.last_error
+        """, (job.name, duration_ms, result if isinstance(result, int) else None, error))
+        conn.commit()
+        if result:
+            logger.info(f"Job {job.name} finished in {duration_ms} ms (result {result})")
+        return result
+
+    def stats(self):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT name, last_run_at, last_duration_ms, last_result, last_error FROM job_runs")
+            runs = {row[0]: row[1:] for row in cursor.fetchall()}
+
+        jobs = {}
+        for name, job in self.jobs.items():
+            last_run_at, duration_ms, result, error = runs.get(name, (None, None, None, None))
+            jobs[name] = {
+                "interval": job.interval,
+                "last_run_at": last_run_at.isoformat() if last_run_at else None,
+                "last_duration_ms": duration_ms,
+                "last_result": result,
+                "last_error": error,
+                "runs_here": job.runs,
+                "failures_here": job.failures,
+            }
+        return {
+            "scheduler_running": bool(self._thread is not None and self._thread.is_alive()
+                                      and self._pid == os.getpid()),
+            "jobs": jobs,
+        }
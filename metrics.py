@@ -0,0 +1,370 @@
+"""
+Prometheus-style metrics and per-request timing breakdowns.
+
+Metrics are module-level objects on a default ``REGISTRY`` so any module can
+record without plumbing (``metrics.EMAIL_SEND_SECONDS.observe(...)``);
+``REGISTRY.render()`` produces the Prometheus text format for ``/metrics``.
+
+Each gunicorn worker has its own counters. When ``METRICS_DIR`` is set,
+workers write a snapshot there every few seconds and ``/metrics`` merges all
+of them, so a scrape that lands on any worker sees the whole server.
+
+Timing helpers also feed a thread-local *trace*: between ``begin_trace()``
+and ``end_trace()`` (one request) every ``timed()`` block and SQL statement
+adds its duration to a per-component total, which the app logs for slow
+requests.
+
+SQL statements are timed by ``TimedConnection``, a psycopg2 connection
+class that hands out timing cursors (pass it as ``connection_factory``).
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+
+import psycopg2.extensions
+import psycopg2.extras
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+# ---- Metric types ---- #
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self):
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, then sum and count.
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def samples(self):
+        with self._lock:
+            return [[list(key), [list(state[0]), state[1], state[2]]] for key, state in self._values.items()]
+
+
+# ---- Registry ---- #
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.directory = None
+        self.write_interval = 5.0
+        self._pid = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def snapshot(self):
+        return {name: metric.samples() for name, metric in self.metrics.items()}
+
+    # ---- Multi-process ---- #
+    def ensure_exporter(self):
+        """Start writing this process's snapshot to ``directory`` (once per pid)."""
+        if not self.directory or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._export_forever, name="metrics-exporter", daemon=True)
+            self._thread.start()
+
+    def _export_forever(self):
+        while True:
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                logger.error(f"Metrics snapshot failed: {e}")
+            time.sleep(self.write_interval)
+
+    def write_snapshot(self):
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(path + ".tmp", path)
+
+    def collect(self):
+        """Samples for every metric, merged across worker snapshots when configured."""
+        if not self.directory:
+            return self.snapshot()
+
+        self.write_snapshot()
+        merged = {}
+        for entry in os.listdir(self.directory):
+            if not entry.endswith(".json"):
+                continue
+            pid = int(entry[:-5]) if entry[:-5].isdigit() else None
+            try:
+                with open(os.path.join(self.directory, entry)) as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            alive = pid is not None and _pid_alive(pid)
+            for name, samples in snapshot.items():
+                metric = self.metrics.get(name)
+                if metric is None or (metric.kind == "gauge" and not alive):
+                    # A dead worker's counters still count; its gauges do not.
+                    continue
+                target = merged.setdefault(name, {})
+                for labels, value in samples:
+                    key = tuple(labels)
+                    if metric.kind == "histogram":
+                        state = target.setdefault(key, [[0] * len(metric.buckets), 0.0, 0])
+                        state[0] = [a + b for a, b in zip(state[0], value[0])]
+                        state[1] += value[1]
+                        state[2] += value[2]
+                    else:
+                        target[key] = target.get(key, 0) + value
+        return {name: [[list(k), v] for k, v in samples.items()] for name, samples in merged.items()}
+
+    # ---- Exposition ---- #
+    def render(self):
+        collected = self.collect()
+        lines = []
+        for name, metric in self.metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for labels, value in collected.get(name, []):
+                pairs = list(zip(metric.labelnames, labels))
+                if metric.kind == "histogram":
+                    counts, total, count = value
+                    cumulative = 0
+                    for bound, bucket_count in zip(metric.buckets, counts):
+                        cumulative += bucket_count
+                        lines.append(f"{name}_bucket{_labels(pairs + [('le', _number(bound))])} {cumulative}")
+                    lines.append(f"{name}_bucket{_labels(pairs + [('le', '+Inf')])} {count}")
+                    lines.append(f"{name}_sum{_labels(pairs)} {_number(total)}")
+                    lines.append(f"{name}_count{_labels(pairs)} {count}")
+                else:
+                    lines.append(f"{name}{_labels(pairs)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_SECONDS = REGISTRY.histogram(
+    "http_request_duration_seconds", "Time to produce a response, by route.", ("method", "route", "status"))
+HTTP_REQUEST_ERRORS = REGISTRY.counter(
+    "http_request_errors_total", "Responses with a 5xx status or an unhandled exception.", ("method", "route"))
+HTTP_REQUESTS_IN_FLIGHT = REGISTRY.gauge(
+    "http_requests_in_flight", "Requests currently being handled.")
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "db_query_duration_seconds", "Time spent executing SQL statements, by statement label.", ("statement",))
+DB_QUERY_ERRORS = REGISTRY.counter(
+    "db_query_errors_total", "SQL statements that raised.", ("statement",))
+EMAIL_SEND_SECONDS = REGISTRY.histogram(
+    "email_send_duration_seconds", "Calls to the email service.", ("outcome",))
+STORAGE_SAVE_SECONDS = REGISTRY.histogram(
+    "storage_save_duration_seconds", "Attachment uploads to the storage backend.", ("backend", "outcome"))
+
+
+# ---- Request traces ---- #
+_local = threading.local()
+
+
+def begin_trace():
+    _local.trace = {}
+
+
+def end_trace():
+    """Return and clear this thread's {component: [seconds, calls]} totals."""
+    trace = getattr(_local, "trace", None)
+    _local.trace = None
+    return trace or {}
+
+
+def add_to_trace(component, seconds):
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        entry = trace.setdefault(component, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+
+
+@contextmanager
+def timed(histogram, component, **labels):
+    """
+    Time the block into ``histogram`` with ``outcome`` set to "ok" or
+    "error", and add it to the current request trace under ``component``.
+    """
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - started
+        histogram.observe(elapsed, outcome=outcome, **labels)
+        add_to_trace(component, elapsed)
+
+
+# ---- SQL timing ---- #
+_STATEMENT_PATTERNS = [
+    re.compile(r"^\s*(insert)\s+into\s+([\w.]+)", re.I),
+    re.compile(r"^\s*(update)\s+([\w.]+)", re.I),
+    re.compile(r"^\s*(delete)\s+from\s+([\w.]+)", re.I),
+    re.compile(r"^\s*(select|with)\b.*?\bfrom\s+([\w.]+)", re.I | re.S),
+]
+
+
+# execute_values() inlines its rows after VALUES, so each call has a different text.
+# Labels only depend on what comes before that, so cache on that prefix (capped)
+# rather than on the whole statement.
+_VALUES = re.compile(r"\bvalues\b", re.I)
+STATEMENT_KEY_CHARS = 1024
+
+
+def statement_label(query):
+    """'select tickets', 'insert messages', ... A leading /* label */ comment wins."""
+    match = _VALUES.search(query, 0, STATEMENT_KEY_CHARS)
+    return _statement_label(query[:match.start() if match else STATEMENT_KEY_CHARS])
+
+
+@lru_cache(maxsize=512)
+def _statement_label(query):
+    explicit = re.match(r"^\s*/\*\s*([\w\- ]+?)\s*\*/", query)
+    if explicit:
+        return explicit.group(1)
+    for pattern in _STATEMENT_PATTERNS:
+        match = pattern.match(query)
+        if match:
+            return f"{match.group(1).lower()} {match.group(2).lower()}"
+    words = query.split()
+    return words[0].lower() if words else "unknown"
+
+
+class _TimedCursorMixin:
+    def execute(self, query, vars=None):
+        text = query.decode() if isinstance(query, bytes) else str(query)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        except Exception:
+            DB_QUERY_ERRORS.inc(statement=statement_label(text))
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_QUERY_SECONDS.observe(elapsed, statement=statement_label(text))
+            add_to_trace("db", elapsed)
+
+
+class TimedCursor(_TimedCursorMixin, psycopg2.extensions.cursor):
+    pass
+
+
+class TimedRealDictCursor(_TimedCursorMixin, psycopg2.extras.RealDictCursor):
+    pass
+
+
+_TIMED_FACTORIES = {
+    None: TimedCursor,
+    psycopg2.extensions.cursor: TimedCursor,
+    psycopg2.extras.RealDictCursor: TimedRealDictCursor,
+}
+
+
+class TimedConnection(psycopg2.extensions.connection):
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get("cursor_factory")
+        kwargs["cursor_factory"] = _TIMED_FACTORIES.get(factory, factory)
+        return super().cursor(*args, **kwargs)
@@ -0,0 +1,27 @@
+-- Core tables. Existing deployments already have them; this lets a fresh
+-- database (development, benchmarks) be built with init-db alone.
+CREATE TABLE IF NOT EXISTS tickets (
+    ticket_id TEXT PRIMARY KEY,
+    fullname TEXT NOT NULL,
+    account_number TEXT NOT NULL,
+    email TEXT NOT NULL,
+    reference TEXT,
+    error_type TEXT NOT NULL,
+    description TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'Open',
+    file_path TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    closed_at TIMESTAMPTZ
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id SERIAL PRIMARY KEY,
+    ticket_id TEXT NOT NULL REFERENCES tickets (ticket_id) ON DELETE CASCADE,
+    sender_type TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE TABLE IF NOT EXISTS otps (
+    email TEXT PRIMARY KEY,
+    code TEXT NOT NULL,
+    expires_at TIMESTAMPTZ NOT NULL
+);
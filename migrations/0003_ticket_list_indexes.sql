@@ -0,0 +1,6 @@
+-- Keyset pagination for the admin list and "My Tickets" walks these
+-- indexes directly instead of sorting the whole table.
+CREATE INDEX IF NOT EXISTS tickets_admin_list_idx
+    ON tickets ((CASE WHEN status = 'Open' THEN 1 ELSE 0 END), created_at, ticket_id);
+CREATE INDEX IF NOT EXISTS tickets_email_created_idx
+    ON tickets (email, created_at, ticket_id);
@@ -0,0 +1,6 @@
+-- Ticket form submissions: a repeated idempotency key maps back to the
+-- original ticket, and near-duplicates point at the earlier ticket.
+ALTER TABLE tickets ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+ALTER TABLE tickets ADD COLUMN IF NOT EXISTS duplicate_of TEXT;
+CREATE UNIQUE INDEX IF NOT EXISTS tickets_idempotency_key_idx ON tickets (idempotency_key);
+CREATE INDEX IF NOT EXISTS tickets_near_duplicate_idx ON tickets (account_number, error_type, created_at);
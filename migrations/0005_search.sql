@@ -0,0 +1,14 @@
+ALTER TABLE tickets ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(fullname, '') || ' ' || coalesce(account_number, '')
+                                        || ' ' || coalesce(reference, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED;
+CREATE INDEX IF NOT EXISTS tickets_search_idx ON tickets USING GIN (search_vector);
+
+ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('english', coalesce(content, ''))) STORED;
+CREATE INDEX IF NOT EXISTS messages_search_idx ON messages USING GIN (search_vector);
+
+CREATE INDEX IF NOT EXISTS tickets_account_prefix_idx ON tickets (account_number text_pattern_ops);
+CREATE INDEX IF NOT EXISTS tickets_reference_prefix_idx ON tickets (reference text_pattern_ops);
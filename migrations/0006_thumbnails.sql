@@ -0,0 +1,2 @@
+ALTER TABLE tickets ADD COLUMN IF NOT EXISTS thumbnail_path TEXT;
+ALTER TABLE tickets ADD COLUMN IF NOT EXISTS preview_path TEXT;
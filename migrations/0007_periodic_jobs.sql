@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS job_runs (
+    name TEXT PRIMARY KEY,
+    last_run_at TIMESTAMPTZ NOT NULL,
+    last_duration_ms INTEGER,
+    last_result BIGINT,
+    last_error TEXT
+);
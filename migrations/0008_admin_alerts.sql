@@ -0,0 +1,13 @@
+CREATE TABLE IF NOT EXISTS admin_alerts (
+    id BIGSERIAL PRIMARY KEY,
+    ticket_id TEXT NOT NULL,
+    error_type TEXT NOT NULL,
+    fullname TEXT,
+    account_number TEXT,
+    tracking_link TEXT,
+    immediate BOOLEAN NOT NULL,
+    digested_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS admin_alerts_type_created_idx ON admin_alerts (error_type, created_at);
+CREATE INDEX IF NOT EXISTS admin_alerts_pending_idx ON admin_alerts (id) WHERE digested_at IS NULL;
@@ -0,0 +1,2 @@
+ALTER TABLE otps ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+CREATE INDEX IF NOT EXISTS otps_expires_at_idx ON otps (expires_at);
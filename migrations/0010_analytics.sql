@@ -0,0 +1,26 @@
+ALTER TABLE tickets ADD COLUMN IF NOT EXISTS first_admin_reply_at TIMESTAMPTZ;
+
+CREATE TABLE IF NOT EXISTS ticket_daily_stats (
+    day DATE NOT NULL,
+    error_type TEXT NOT NULL,
+    opened INTEGER NOT NULL DEFAULT 0,
+    closed INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, error_type)
+);
+CREATE TABLE IF NOT EXISTS ticket_backlog (
+    error_type TEXT PRIMARY KEY,
+    open_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS ticket_duration_stats (
+    metric TEXT NOT NULL,
+    day DATE NOT NULL,
+    error_type TEXT NOT NULL,
+    bucket SMALLINT NOT NULL,
+    count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (metric, day, error_type, bucket)
+);
+
+CREATE OR REPLACE FUNCTION analytics_bucket(seconds DOUBLE PRECISION) RETURNS SMALLINT
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT FLOOR(LN(GREATEST(seconds, 1)) / LN(1.25))::SMALLINT
+$$;
@@ -0,0 +1,31 @@
+CREATE TABLE IF NOT EXISTS tickets_archive (
+    ticket_id TEXT PRIMARY KEY,
+    fullname TEXT NOT NULL,
+    account_number TEXT NOT NULL,
+    email TEXT NOT NULL,
+    reference TEXT,
+    error_type TEXT NOT NULL,
+    description TEXT NOT NULL,
+    status TEXT NOT NULL,
+    file_path TEXT,
+    thumbnail_path TEXT,
+    preview_path TEXT,
+    first_admin_reply_at TIMESTAMPTZ,
+    created_at TIMESTAMPTZ NOT NULL,
+    closed_at TIMESTAMPTZ,
+    archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS tickets_archive_email_idx ON tickets_archive (email);
+
+CREATE TABLE IF NOT EXISTS messages_archive (
+    id INTEGER PRIMARY KEY,
+    ticket_id TEXT NOT NULL REFERENCES tickets_archive (ticket_id) ON DELETE CASCADE,
+    sender_type TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at TIMESTAMPTZ NOT NULL
+);
+CREATE INDEX IF NOT EXISTS messages_archive_ticket_idx ON messages_archive (ticket_id, id);
+
+CREATE INDEX IF NOT EXISTS tickets_closed_at_idx ON tickets (closed_at) WHERE status = 'Closed';
+-- The ON DELETE CASCADE from tickets looks messages up by ticket_id once per deleted row.
+CREATE INDEX IF NOT EXISTS messages_ticket_idx ON messages (ticket_id, id);
@@ -0,0 +1,25 @@
+-- Deployments that predate 0001 may have messages with no foreign key
+-- to tickets, or one without ON DELETE CASCADE. Deleting a ticket then left
+-- its messages behind. Drop those orphans and replace the constraint.
+DO $$
+DECLARE
+    fk RECORD;
+BEGIN
+    FOR fk IN
+        SELECT conname FROM pg_constraint
+        WHERE conrelid = 'messages'::regclass AND confrelid = 'tickets'::regclass
+          AND contype = 'f' AND confdeltype <> 'c'
+    LOOP
+        EXECUTE format('ALTER TABLE messages DROP CONSTRAINT %I', fk.conname);
+    END LOOP;
+
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 'messages'::regclass AND confrelid = 'tickets'::regclass AND contype = 'f'
+    ) THEN
+        DELETE FROM messages m WHERE NOT EXISTS (SELECT 1 FROM tickets t WHERE t.ticket_id = m.ticket_id);
+        ALTER TABLE messages ADD CONSTRAINT messages_ticket_id_fkey
+            FOREIGN KEY (ticket_id) REFERENCES tickets (ticket_id) ON DELETE CASCADE;
+    END IF;
+END
+$$;
@@ -0,0 +1,7 @@
+CREATE TABLE IF NOT EXISTS ticket_reads (
+    ticket_id TEXT NOT NULL REFERENCES tickets (ticket_id) ON DELETE CASCADE,
+    reader TEXT NOT NULL,
+    last_read_id INTEGER NOT NULL DEFAULT 0,
+    read_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    PRIMARY KEY (ticket_id, reader)
+);
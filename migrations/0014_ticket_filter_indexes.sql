@@ -0,0 +1,10 @@
+-- Filtered admin list pages. An error type filter walks its own slice of the
+-- status-ranked order; account and date filters start from the matching rows
+-- and sort only those. Status filters need no index of their own: they add
+-- the rank to the WHERE clause and start inside tickets_admin_list_idx.
+CREATE INDEX IF NOT EXISTS tickets_error_type_list_idx
+    ON tickets (error_type, (CASE WHEN status = 'Open' THEN 1 ELSE 0 END), created_at, ticket_id);
+CREATE INDEX IF NOT EXISTS tickets_account_created_idx
+    ON tickets (account_number, created_at);
+CREATE INDEX IF NOT EXISTS tickets_created_idx
+    ON tickets (created_at);
@@ -0,0 +1,118 @@
+"""
+One-time login codes.
+
+Issuing and verifying are each a single statement:
+
+* ``issue`` checks that the email owns a ticket (active or archived),
+  upserts the code and queues the email in ``email_outbox``, all in one
+  round trip. Nothing is written for unknown emails, and the caller cannot
+  tell the difference.
+* ``verify`` consumes a matching code and counts a failed attempt otherwise,
+  again in one round trip. After ``max_attempts`` failures the code is dead.
+
+Codes are stored as HMAC-SHA256 digests keyed with the app secret, never in
+plain text. Comparing keyed digests reveals nothing through timing: an
+attacker cannot choose the bytes being compared, so the database's ordinary
+equality check is as safe as ``hmac.compare_digest``.
+
+Expired and exhausted codes are removed in batches by ``sweep``, registered
+as a periodic job.
+"""
+import hashlib
+import hmac
+
+# The outbox insert mirrors EmailOutbox.enqueue.
+ISSUE_SQL = """
+WITH owner AS (
+    (SELECT 1 FROM tickets WHERE email = %(email)s LIMIT 1)
+    UNION ALL
+    (SELECT 1 FROM tickets_archive WHERE email = %(email)s LIMIT 1)
+    LIMIT 1
+), issued AS (
+    INSERT INTO otps (email, code, expires_at, attempts)
+    SELECT %(email)s, %(digest)s, NOW() + make_interval(secs => %(ttl)s), 0
+    FROM owner
+    ON CONFLICT (email) DO UPDATE
+        SET code = EXCLUDED.code, expires_at = EXCLUDED.expires_at, attempts = 0
+    RETURNING email
+), queued AS (
+    INSERT INTO email_outbox (recipient, subject, html_body)
+    SELECT email, %(subject)s, %(html)s FROM issued
+    RETURNING id
+)
+SELECT COUNT(*) FROM queued
+"""
+
+VERIFY_SQL = """
+WITH target AS (
+    SELECT email, code = %(digest)s AS matched
+    FROM otps
+    WHERE email = %(email)s AND expires_at > NOW() AND attempts < %(max_attempts)s
+    FOR UPDATE
+), consumed AS (
+    DELETE FROM otps o USING target t
+    WHERE o.email = t.email AND t.matched
+    RETURNING o.email
+), failed AS (
+    UPDATE otps o SET attempts = o.attempts + 1
+    FROM target t
+    WHERE o.email = t.email AND NOT t.matched
+    RETURNING o.email
+)
+SELECT EXISTS (SELECT 1 FROM consumed)
+"""
+
+SWEEP_SQL = """
+DELETE FROM otps WHERE email IN (
+    SELECT email FROM otps
+    WHERE expires_at < NOW() OR attempts >= %s
+    LIMIT %s
+    FOR UPDATE SKIP LOCKED
+)
+"""
+
+
+class OtpStore:
+    def __init__(self, secret, ttl=600, max_attempts=5, sweep_batch=1000):
+        self._key = secret.encode() if isinstance(secret, str) else secret
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.sweep_batch = sweep_batch
+
+    def digest(self, email, code):
+        return hmac.new(self._key, f"{email}:{code}".encode(), hashlib.sha256).hexdigest()
+
+    def issue(self, cursor, email, code, subject, html_body):
+        """
+        Store ``code`` for ``email`` and queue its email, if the email owns a
+        ticket. Returns True when a code was issued. The caller commits.
+        """
+        cursor.execute(ISSUE_SQL, {
+            "email": email,
+            "digest": self.digest(email, code),
+            "ttl": self.ttl,
+            "subject": subject,
+            "html": html_body,
+        })
+        return cursor.fetchone()[0] > 0
+
+    def verify(self, cursor, email, code):
+        """Consume the code if it matches; otherwise count a failed attempt. The caller commits."""
+        cursor.execute(VERIFY_SQL, {
+            "email": email,
+            "digest": self.digest(email, code),
+            "max_attempts": self.max_attempts,
+        })
+        return bool(cursor.fetchone()[0])
+
+    def sweep(self, conn):
+        """Periodic job: delete expired or exhausted codes in batches. Returns rows deleted."""
+        cursor = conn.cursor()
+        total = 0
+        while True:
+            cursor.execute(SWEEP_SQL, (self.max_attempts, self.sweep_batch))
+            deleted = cursor.rowcount
+            conn.commit()
+            total += deleted
+            if deleted < self.sweep_batch:
+                return total
@@ -0,0 +1,301 @@
+"""
+Durable email outbox.
+
+Routes never talk to the email microservice directly. They call
+``outbox.enqueue(cursor, ...)`` inside the same transaction as the ticket or
+message they are writing, so an email exists if and only if the row it is
+about was committed. A small pool of background threads per process then
+drains the table:
+
+* rows are claimed with ``FOR UPDATE SKIP LOCKED`` so several gunicorn
+  workers (or a dedicated ``flask outbox-worker`` process) can share the
+  queue without sending anything twice
+* claiming pushes ``next_attempt_at`` forward by a lease, so rows held by a
+  crashed process simply become due again
+* failures are retried with capped exponential backoff plus jitter and
+  moved to ``status = 'dead'`` after ``max_attempts``
+* deliveries reuse one keep-alive HTTP session with bounded concurrency
+"""
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2.extras
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class EmailDeliveryError(Exception):
+    """The email service rejected or failed to process a message."""
+
+
+class EmailOutbox:
+    def __init__(self, pool, service_url, concurrency=4, batch_size=20,
+                 max_attempts=8, backoff_base=30.0, backoff_max=3600.0,
+                 poll_interval=5.0, lease=120.0, request_timeout=10.0,
+                 keep_sent_days=7):
+        self.pool = pool
+        self.service_url = service_url
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.request_timeout = request_timeout
+        self.keep_sent_days = keep_sent_days
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._pid = None
+        self._thread = None
+        self._executor = None
+        self._http = None
+        self._counters = {
+            "sent": 0,
+            "failed_attempts": 0,
+            "retries_scheduled": 0,
+            "dead_lettered": 0,
+            "delivery_seconds_total": 0.0,
+        }
+
+    # ---- Producer side ---- #
+    def enqueue(self, cursor, recipient, subject, html_body):
+        """
+        Queue an email using the caller's cursor. Nothing is sent until the
+        caller commits; call ``wake()`` afterwards for prompt delivery.
+        """
+        cursor.execute(
+            "INSERT INTO email_outbox (recipient, subject, html_body) VALUES (%s, %s, %s)",
+            (recipient, subject, html_body),
+        )
+
+    def enqueue_many(self, cursor, emails):
+        """Queue (recipient, subject, html_body) tuples with one INSERT."""
+        if emails:
+            psycopg2.extras.execute_values(
+                cursor, "INSERT INTO email_outbox (recipient, subject, html_body) VALUES %s", emails, page_size=500)
+
+    def wake(self):
+        self._wake.set()
+
+    # ---- Worker lifecycle ---- #
+    def ensure_started(self):
+        """Start the dispatcher in this process if it is not running yet."""
+        if self.concurrency <= 0:
+            return
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            # Threads and sockets do not survive fork; build fresh ones here.
+            self._pid = os.getpid()
+            self._stop.clear()
+            self._http = self._build_session()
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency,
+                                                thread_name_prefix="email-outbox")
+            self._thread = threading.Thread(target=self._run, name="email-outbox-dispatcher",
+                                            daemon=True)
+            self._thread.start()
+            logger.info(f"Email outbox dispatcher started (pid {self._pid}, concurrency {self.concurrency})")
+
+    def stop(self, timeout=10):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def run_forever(self):
+        """Run the dispatcher in the foreground (used by ``flask outbox-worker``)."""
+        self.ensure_started()
+        try:
+            while self._thread.is_alive():
+                self._thread.join(1)
+        except KeyboardInterrupt:
+            self.stop()
+
+    def _build_session(self):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    # ---- Dispatcher ---- #
+    def _run(self):
+        last_purge = 0.0
+        while not self._stop.is_set():
+            claimed = 0
+            try:
+                claimed = self.drain_once()
+                if time.monotonic() - last_purge > 3600:
+                    self._purge_sent()
+                    last_purge = time.monotonic()
+            except Exception as e:
+                logger.error(f"Email outbox dispatcher error: {e}")
+
+            # A full batch means there is probably more waiting.
+            if claimed < self.batch_size:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def drain_once(self):
+        """Claim one batch of due emails, deliver them and record results."""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE email_outbox
+                SET attempts = attempts + 1,
+                    next_attempt_at = NOW() + make_interval(secs => %s)
+                WHERE id IN (
+                    SELECT id FROM email_outbox
+                    WHERE status = 'pending' AND next_attempt_at <= NOW()
+                    ORDER BY next_attempt_at
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, recipient, subject, html_body, attempts
+            """, (self.lease, self.batch_size))
+            batch = cursor.fetchall()
+            conn.commit()
+
+        if not batch:
+            return 0
+
+        results = list(self._executor.map(self._deliver_row, batch))
+
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            for (row_id, _, _, _, attempts), error in zip(batch, results):
+                if error is None:
+                    cursor.execute(
+                        "UPDATE email_outbox SET status = 'sent', sent_at = NOW(), last_error = NULL WHERE id = %s",
+                        (row_id,))
+                elif attempts >= self.max_attempts:
+                    cursor.execute(
+                        "UPDATE email_outbox SET status = 'dead', last_error = %s WHERE id = %s",
+                        (error, row_id))
+                    self._count("dead_lettered")
+                    logger.error(f"Email {row_id} dead-lettered after {attempts} attempts: {error}")
+                else:
+                    delay = self._backoff(attempts)
+                    cursor.execute(
+                        "UPDATE email_outbox SET next_attempt_at = NOW() + make_interval(secs => %s), last_error = %s WHERE id = %s",
+                        (delay, error, row_id))
+                    self._count("retries_scheduled")
+                    logger.warning(f"Email {row_id} failed (attempt {attempts}), retrying in {delay:.0f}s: {error}")
+            conn.commit()
+        return len(batch)
+
+    def _deliver_row(self, row):
+        _, recipient, subject, html_body, _ = row
+        started = time.monotonic()
+        try:
+            self.send(recipient, subject, html_body)
+        except Exception as e:
+            self._count("failed_attempts")
+            return str(e)[:500]
+        finally:
+            self._count("delivery_seconds_total", time.monotonic() - started)
+        self._count("sent")
+        return None
+
+    def send(self, recipient, subject, html_body):
+        """POST one email to the email microservice. Raises on any failure."""
+        if not self.service_url:
+            raise EmailDeliveryError("EMAIL_SERVICE_URL not set in environment variables")
+
+        http = self._http or self._build_session()
+        with metrics.timed(metrics.EMAIL_SEND_SECONDS, "email"):
+            response = http.post(
+                self.service_url,
+                json={
+                    "to": recipient,
+                    "subject": subject,
+                    "html": html_body
+                },
+                timeout=self.request_timeout,
+            )
+            try:
+                res_json = response.json()
+            except ValueError:
+                raise EmailDeliveryError(f"Email service returned HTTP {response.status_code}")
+
+            if not res_json.get("success"):
+                raise EmailDeliveryError(f"Email service returned error: {res_json.get('error')}")
+        logger.info(f"Email sent successfully to {recipient} via service")
+
+    def _backoff(self, attempts):
+        delay = min(self.backoff_base * (2 ** (attempts - 1)), self.backoff_max)
+        return delay * random.uniform(0.5, 1.0)
+
+    def _purge_sent(self):
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "DELETE FROM email_outbox WHERE status = 'sent' AND sent_at < NOW() - make_interval(days => %s)",
+                (self.keep_sent_days,))
+            conn.commit()
+
+    # ---- Maintenance & metrics ---- #
+    def requeue_dead(self):
+        """Give every dead-lettered email a fresh set of attempts."""
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE email_outbox SET status = 'pending', attempts = 0, next_attempt_at = NOW()
+                WHERE status = 'dead'
+            """)
+            count = cursor.rowcount
+            conn.commit()
+        self.wake()
+        return count
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def stats(self):
+        """In-process delivery counters plus queue depth from the table."""
+        with self._lock:
+            stats = dict(self._counters)
+        attempts = stats["sent"] + stats["failed_attempts"]
+        stats["delivery_avg_ms"] = round(stats.pop("delivery_seconds_total") / (attempts or 1) * 1000, 3)
+        stats["dispatcher_running"] = bool(self._thread is not None and self._thread.is_alive()
+                                           and self._pid == os.getpid())
+
+        with self.pool.connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT status,
+                       COUNT(*),
+                       COUNT(*) FILTER (WHERE attempts > 0),
+                       EXTRACT(EPOCH FROM NOW() - MIN(created_at))
+                FROM email_outbox
+                WHERE status <> 'sent'
+                GROUP BY status
+            """)
+            rows = cursor.fetchall()
+
+        queue = {"pending": 0, "retrying": 0, "dead": 0, "oldest_pending_seconds": 0}
+        for status, count, retried, oldest in rows:
+            if status == 'pending':
+                queue["pending"] = count
+                queue["retrying"] = retried
+                queue["oldest_pending_seconds"] = round(float(oldest or 0), 1)
+            elif status == 'dead':
+                queue["dead"] = count
+        stats["queue"] = queue
+        return stats
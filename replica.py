@@ -0,0 +1,132 @@
+"""
+Read-replica routing.
+
+Read-only routes ask ``ReplicaRouter.pool()`` for a pool. They get the
+replica pool while the replica is healthy and within ``max_lag`` seconds of
+the primary, and the primary pool otherwise. Writes always use the primary.
+
+Lag is measured on the replica itself every ``check_interval`` seconds by a
+background thread in each process, so a slow or unreachable replica never
+holds up a request; until the first check succeeds reads go to the primary. A
+replica that is streaming from the primary and has replayed everything it
+received counts as caught up even when the primary has been idle for a
+while. One with no streaming WAL receiver has lost the primary and would
+only ever look caught up, so it is skipped like one that is unreachable or
+too far behind, until a later check finds it healthy again. Reading
+``pg_stat_wal_receiver.status`` needs the ``pg_read_all_stats`` role (or
+``pg_monitor``) for a non-superuser; without it the replica is never used.
+
+Read-your-writes is the caller's job: a session that wrote within
+``pin_seconds`` should read from the primary (see ``pinned``). A replica
+within ``max_lag`` at the last check is at most ``max_lag + check_interval``
+behind now, so that is the default pin.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# NULL: a standby that is not streaming, whose lag cannot be known.
+LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN NOT EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') THEN NULL
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+class ReplicaRouter:
+    def __init__(self, primary, replica=None, max_lag=5.0, check_interval=2.0, pin_seconds=None):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.pin_seconds = max_lag + check_interval if pin_seconds is None else pin_seconds
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+        self._lag = None          # seconds, or None when the last check failed
+        self._healthy = False
+        self._stats = {"replica_reads": 0, "primary_reads": 0, "skipped": 0, "check_errors": 0}
+
+    @property
+    def enabled(self):
+        return self.replica is not None
+
+    def pinned(self, wrote_at):
+        """True while a write made at ``wrote_at`` (epoch seconds) may not have reached the replica."""
+        return bool(wrote_at) and time.time() - wrote_at < self.pin_seconds
+
+    def pool(self, wrote_at=None):
+        """Pool for a read: the replica when it is usable and the caller is not pinned."""
+        use_replica = self.enabled and not self.pinned(wrote_at) and self._replica_usable()
+        with self._lock:
+            self._stats["replica_reads" if use_replica else "primary_reads"] += 1
+        return self.replica if use_replica else self.primary
+
+    def _replica_usable(self):
+        self._ensure_checker()
+        with self._lock:
+            return self._healthy
+
+    def _ensure_checker(self):
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            if self._pid != os.getpid():
+                # A parent's measurement says nothing about this process's connections.
+                self._lag, self._healthy = None, False
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._check_forever, name="replica-lag-check", daemon=True)
+            self._thread.start()
+
+    def _check_forever(self):
+        while True:
+            self._check()
+            time.sleep(self.check_interval)
+
+    def _check(self):
+        try:
+            with self.replica.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(LAG_SQL)
+                lag = cursor.fetchone()[0]
+            if lag is None:
+                raise RuntimeError("replica has no streaming WAL receiver")
+            lag = float(lag)
+        except Exception as e:
+            logger.warning(f"Replica lag check failed; reading from the primary: {e}")
+            with self._lock:
+                self._lag, self._healthy = None, False
+                self._stats["check_errors"] += 1
+            return
+
+        healthy = lag <= self.max_lag
+        with self._lock:
+            if self._healthy and not healthy:
+                logger.warning(f"Replica is {lag:.1f}s behind (limit {self.max_lag}s); reading from the primary")
+            elif not self._healthy and healthy and self._lag is not None:
+                logger.info(f"Replica caught up ({lag:.1f}s behind); reading from it again")
+            if not healthy:
+                self._stats["skipped"] += 1
+            self._lag, self._healthy = lag, healthy
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update({
+                "enabled": self.enabled,
+                "healthy": self._healthy,
+                "lag_seconds": round(self._lag, 3) if self._lag is not None else None,
+                "max_lag": self.max_lag,
+                "pin_seconds": self.pin_seconds,
+            })
+        if self.enabled:
+            stats["pool"] = self.replica.stats()
+        return stats
@@ -0,0 +1,88 @@
+"""
+Versioned schema migrations, applied by ``flask --app app init-db``.
+
+``MIGRATIONS`` is an append-only list of (version, name, sql), one per
+``migrations/NNNN_name.sql`` file. The SQL is frozen in those files rather
+than taken from the feature modules, so later edits to a module can never
+change what an old version runs. ``migrate`` records each applied version
+in ``schema_migrations`` and runs only the pending ones, each in its own
+transaction. A session advisory lock keeps two deploys from migrating at
+once.
+
+Versions 1-11 are the idempotent DDL that ``init-db`` ran before the schema
+was versioned. A database set up that way replays them as no-ops and picks
+up only the later versions. Never edit a migration that has shipped; add a
+new one.
+"""
+import os
+import re
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+
+
+def _load_migrations(directory=MIGRATIONS_DIR):
+    """(version, name, sql) for each ``NNNN_name.sql`` in ``directory``, in version order."""
+    migrations = []
+    for filename in os.listdir(directory):
+        match = re.fullmatch(r"(\d+)_(\w+)\.sql", filename)
+        if match is None:
+            continue
+        with open(os.path.join(directory, filename), encoding="utf-8") as f:
+            sql = f.read()
+        migrations.append((int(match.group(1)), match.group(2).replace("_", " "), sql))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise RuntimeError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+MIGRATIONS = _load_migrations()
+
+MIGRATIONS_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+)
+"""
+
+# Any constant works as long as nothing else takes the same advisory lock.
+MIGRATION_LOCK_ID = 7_318_420_001
+
+
+def migrate(pool):
+    """Apply pending migrations in order. Returns the versions applied."""
+    applied = []
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+        try:
+            cursor.execute(MIGRATIONS_TABLE)
+            cursor.execute("SELECT version FROM schema_migrations")
+            done = {row[0] for row in cursor.fetchall()}
+            conn.commit()
+            for version, name, sql in MIGRATIONS:
+                if version in done:
+                    continue
+                cursor.execute(sql)
+                cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+                conn.commit()
+                applied.append(version)
+        finally:
+            # Clears a failed migration's transaction so the unlock can run.
+            conn.rollback()
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+            conn.commit()
+    return applied
+
+
+def current_version(pool):
+    """Highest applied version, or 0 for an unversioned database."""
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+        if not cursor.fetchone()[0]:
+            return 0
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+        return cursor.fetchone()[0]
@@ -0,0 +1,85 @@
+"""
+Admin full-text search over tickets and their messages.
+
+Both tables carry a stored ``search_vector`` column generated by Postgres,
+so vectors stay current on every insert/update without application code,
+and GIN indexes answer ``@@`` lookups without scanning. Account numbers and
+transaction references additionally get prefix matching through
+``text_pattern_ops`` btree indexes.
+"""
+from markupsafe import Markup, escape
+
+# Exact identifier hits outrank any text match.
+PREFIX_MATCH_RANK = 10.0
+MESSAGE_RANK_WEIGHT = 0.8
+
+_START_SEL = "[[["
+_STOP_SEL = "]]]"
+
+SEARCH_SQL = f"""
+WITH q AS (
+    -- Names, account numbers and references are indexed unstemmed, so match
+    -- the stemmed and the literal form of the query.
+    SELECT websearch_to_tsquery('english', %(q)s) || websearch_to_tsquery('simple', %(q)s) AS query
+),
+matches AS (
+    SELECT t.ticket_id, ts_rank(t.search_vector, q.query) AS rank, 0 AS message_hit
+    FROM tickets t, q
+    WHERE t.search_vector @@ q.query
+    UNION ALL
+    SELECT m.ticket_id, ts_rank(m.search_vector, q.query) * {MESSAGE_RANK_WEIGHT}, 1
+    FROM messages m, q
+    WHERE m.search_vector @@ q.query
+    UNION ALL
+    SELECT ticket_id, {PREFIX_MATCH_RANK}, 0
+    FROM tickets
+    WHERE %(prefix)s IS NOT NULL
+      AND (account_number LIKE %(prefix)s OR reference LIKE %(prefix)s)
+),
+best AS (
+    SELECT ticket_id, MAX(rank) AS rank, SUM(message_hit) AS message_hits
+    FROM matches
+    GROUP BY ticket_id
+    ORDER BY rank DESC, ticket_id
+    LIMIT %(limit)s OFFSET %(offset)s
+)
+SELECT t.ticket_id, t.fullname, t.account_number, t.reference, t.error_type, t.status,
+       t.created_at, best.rank, best.message_hits,
+       ts_headline('english', t.description, q.query,
+                   'StartSel={_START_SEL}, StopSel={_STOP_SEL}, MaxWords=30, MinWords=10') AS snippet
+FROM best
+JOIN tickets t USING (ticket_id)
+CROSS JOIN q
+ORDER BY best.rank DESC, t.ticket_id
+"""
+
+
+def _prefix_pattern(q):
+    """LIKE pattern for identifier-looking queries (no spaces, 3+ chars)."""
+    term = q.strip()
+    if len(term) < 3 or ' ' in term:
+        return None
+    term = term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return term + '%'
+
+
+def highlight(snippet):
+    """Escape a ts_headline snippet and turn its markers into <mark> tags."""
+    if not snippet:
+        return Markup('')
+    escaped = str(escape(snippet))
+    return Markup(escaped.replace(_START_SEL, '<mark>').replace(_STOP_SEL, '</mark>'))
+
+
+def search_tickets(cursor, q, limit, offset=0):
+    """
+    Ranked search. ``cursor`` must be a RealDictCursor. Returns up to
+    ``limit`` rows; callers ask for one extra to know if there is a next page.
+    """
+    cursor.execute(SEARCH_SQL, {
+        "q": q,
+        "prefix": _prefix_pattern(q),
+        "limit": limit,
+        "offset": offset,
+    })
+    return cursor.fetchall()
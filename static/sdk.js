@@ -4,6 +4,7 @@
     // 1. HTTPS Enforced
     const API_URL = "https://ticket-0kzh.onrender.com/api";
     let chatInterval = null;
+    let requestKey = null; // sent with the new-ticket form so a retried submit opens one ticket
 
     // 2. Inject CSS
     const style = document.createElement('style');
@@ -85,9 +86,19 @@
         }
     }
 
+    // Every ticket call after the first carries the token /init_ticket returned.
+    function authHeaders() {
+        return { 'X-Ticket-Token': localStorage.getItem('current_ticket_token') || '' };
+    }
+
+    function forgetTicket() {
+        localStorage.removeItem('current_ticket_id');
+        localStorage.removeItem('current_ticket_token');
+    }
+
     function checkState() {
         const ticketId = localStorage.getItem('current_ticket_id');
-        if (ticketId) {
+        if (ticketId && localStorage.getItem('current_ticket_token')) {
             showChat(ticketId);
         } else {
             showForm();
@@ -97,6 +108,7 @@
     function showForm() {
         footer.style.display = 'none';
         stopPolling();
+        requestKey = window.crypto && crypto.randomUUID ? crypto.randomUUID() : `${Date.now()}-${Math.random()}`;
         body.innerHTML = `
             <div id="form-error" class="error-text"></div>
             <div class="form-group"><label for="t-name">Name</label><input type="text" id="t-name" required></div>
@@ -129,7 +141,7 @@
             return;
         }
 
-        const data = { name, email, account, description: desc };
+        const data = { name, email, account, description: desc, idempotency_key: requestKey };
 
         try {
             const btn = document.getElementById('submit-ticket');
@@ -145,6 +157,7 @@
             
             if (result.status === 'success') {
                 localStorage.setItem('current_ticket_id', result.ticket_id);
+                localStorage.setItem('current_ticket_token', result.token);
                 showChat(result.ticket_id);
             } else {
                 throw new Error(result.message || 'Unknown error');
@@ -183,17 +196,18 @@
 
     async function loadMessages(ticketId) {
         try {
-            const res = await fetch(`${API_URL}/ticket/${ticketId}/history`);
+            // no-cache revalidates with the ETag, so an unchanged thread comes back as 304.
+            const res = await fetch(`${API_URL}/ticket/${ticketId}/history`, { headers: authHeaders(), cache: 'no-cache' });
             if (!res.ok) {
-                if(res.status === 404) {
-                    // Ticket closed or deleted
-                    localStorage.removeItem('current_ticket_id');
+                if (res.status === 404 || res.status === 403) {
+                    // Ticket deleted, or its token expired
+                    forgetTicket();
                     showForm();
                     return;
                 }
                 throw new Error('Failed to load');
             }
-            const messages = await res.json();
+            const { messages } = await res.json();
             
             // Only update DOM if content changed (simple check)
             const currentHTML = messages.map(msg => 
@@ -218,15 +232,12 @@
         input.disabled = true;
         
         try {
-            await fetch(`${API_URL}/reply`, {
+            const res = await fetch(`${API_URL}/ticket/${ticketId}/reply`, {
                 method: 'POST',
-                headers: {'Content-Type': 'application/json'},
-                body: JSON.stringify({
-                    ticket_id: ticketId,
-                    sender_type: 'user',
-                    message: msg
-                })
+                headers: { 'Content-Type': 'application/json', ...authHeaders() },
+                body: JSON.stringify({ message: msg })
             });
+            if (!res.ok) throw new Error('Failed to send');
             input.value = '';
             loadMessages(ticketId);
         } catch (err) {
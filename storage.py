@@ -0,0 +1,222 @@
+"""
+Attachment storage.
+
+Uploads go through two steps:
+
+1. ``stage_upload`` copies the request's file stream to a temporary file in
+   fixed-size chunks, enforcing the size limit and sniffing the real content
+   type from the first bytes. Nothing is held in memory beyond one chunk.
+2. ``UploadManager.submit`` hands the staged file to a ``StorageBackend``,
+   either inline or on a background thread, then records the public URL on
+   the ticket row.
+
+Backends implement ``save(name, fileobj, content_type) -> public URL``.
+``SupabaseStorage`` is the production backend; ``LocalStorage`` writes to a
+directory (``static/uploads`` by default) for development, tests and
+offline benchmarks.
+"""
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+# Leading bytes of the formats the ticket form accepts.
+MAGIC_NUMBERS = [
+    (b"\x89PNG\r\n\x1a\n", "image/png", {"png"}),
+    (b"\xff\xd8\xff", "image/jpeg", {"jpg", "jpeg"}),
+    (b"%PDF-", "application/pdf", {"pdf"}),
+]
+
+
+class UploadRejected(Exception):
+    """The uploaded file is too large or not what its extension claims."""
+
+
+class StagedUpload:
+    def __init__(self, path, filename, content_type, size):
+        self.path = path
+        self.filename = filename
+        self.content_type = content_type
+        self.size = size
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def sniff_content_type(head):
+    for magic, content_type, _ in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return content_type
+    return None
+
+
+def stage_upload(file_storage, filename, max_bytes, tmp_dir=None):
+    """
+    Copy an incoming werkzeug FileStorage to a temp file chunk by chunk.
+    Raises UploadRejected if it exceeds ``max_bytes`` or its bytes do not
+    match its extension.
+    """
+    extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    fd, path = tempfile.mkstemp(prefix="upload-", dir=tmp_dir)
+    size = 0
+    content_type = None
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while True:
+                chunk = file_storage.stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if size == 0:
+                    content_type = sniff_content_type(chunk)
+                    allowed = {ct for _, ct, exts in MAGIC_NUMBERS if extension in exts}
+                    if content_type not in allowed:
+                        raise UploadRejected("File contents do not match an allowed image or PDF type.")
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadRejected(f"File is larger than {max_bytes // (1024 * 1024)} MB.")
+                out.write(chunk)
+        if size == 0:
+            raise UploadRejected("Uploaded file is empty.")
+    except BaseException:
+        os.remove(path)
+        raise
+    return StagedUpload(path, filename, content_type, size)
+
+
+# ---- Backends ---- #
+class StorageBackend:
+    def save(self, name, fileobj, content_type):
+        """Store ``fileobj`` under ``name`` and return its public URL."""
+        raise NotImplementedError
+
+    def timed_save(self, name, fileobj, content_type):
+        with metrics.timed(metrics.STORAGE_SAVE_SECONDS, "storage", backend=type(self).__name__):
+            return self.save(name, fileobj, content_type)
+
+
+class SupabaseStorage(StorageBackend):
+    def __init__(self, url, key, bucket="uploads"):
+        self.url = url
+        self.key = key
+        self.bucket = bucket
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def client(self):
+        # Built on first use in each process: keeps import/boot cheap and
+        # never shares an HTTP connection pool across a fork.
+        if self._client is None or self._pid != os.getpid():
+            with self._lock:
+                if self._client is None or self._pid != os.getpid():
+                    from supabase import create_client
+                    self._client = create_client(self.url, self.key)
+                    self._pid = os.getpid()
+        return self._client
+
+    def save(self, name, fileobj, content_type):
+        bucket = self.client().storage.from_(self.bucket)
+        # A file object is streamed by the HTTP client rather than read into memory.
+        bucket.upload(name, fileobj, {"content-type": content_type})
+        return bucket.get_public_url(name)
+
+
+class LocalStorage(StorageBackend):
+    def __init__(self, root, url_prefix):
+        self.root = root
+        self.url_prefix = url_prefix.rstrip("/")
+        os.makedirs(root, exist_ok=True)
+
+    def save(self, name, fileobj, content_type):
+        target = os.path.join(self.root, name)
+        with open(target, "wb") as out:
+            shutil.copyfileobj(fileobj, out, CHUNK_SIZE)
+        return f"{self.url_prefix}/{name}"
+
+
+# ---- Upload hand-off ---- #
+class UploadManager:
+    """
+    Moves staged uploads into storage and records ``tickets.file_path``.
+
+    With ``background=True`` the ticket row is committed first and the
+    upload happens on a small per-process thread pool; ``file_path`` is
+    filled in when it finishes. If a ``derivatives`` manager is given, the
+    staged file is passed on to it for thumbnail generation afterwards.
+    ``on_change(ticket_id)`` is called after the ticket row is updated, and
+    ``events`` (a TicketEventHub) gets an "attachment" event in the same
+    transaction so other workers drop their cached copy. A background upload
+    that fails calls ``on_failure(ticket_id, name)``; inline callers see the
+    None return instead.
+    """
+
+    def __init__(self, backend, pool, background=True, workers=2, derivatives=None, on_change=None,
+                 events=None, on_failure=None):
+        self.backend = backend
+        self.pool = pool
+        self.background = background
+        self.workers = workers
+        self.derivatives = derivatives
+        self.on_change = on_change
+        self.events = events
+        self.on_failure = on_failure
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, ticket_id, staged, name):
+        """Returns the public URL when uploading inline, else None."""
+        if not self.background:
+            return self._store(ticket_id, staged, name)
+        self._get_executor().submit(self._store, ticket_id, staged, name)
+        return None
+
+    def _get_executor(self):
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix="uploads")
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _store(self, ticket_id, staged, name):
+        handed_off = False
+        recorded = False   # file_path is committed; later failures only cost the thumbnails
+        try:
+            with open(staged.path, "rb") as fileobj:
+                public_url = self.backend.timed_save(name, fileobj, staged.content_type)
+
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("UPDATE tickets SET file_path = %s WHERE ticket_id = %s", (public_url, ticket_id))
+                if self.events is not None:
+                    self.events.publish(cursor, ticket_id, kind="attachment")
+                conn.commit()
+            recorded = True
+            if self.on_change is not None:
+                self.on_change(ticket_id)
+
+            if self.derivatives is not None and self.derivatives.accepts(staged.content_type):
+                self.derivatives.submit(ticket_id, staged, name)
+                handed_off = True
+            return public_url
+        except Exception as e:
+            logger.error(f"Upload error for {ticket_id}: {e}")
+            if self.background and self.on_failure is not None and not recorded:
+                self.on_failure(ticket_id, name)
+            return None
+        finally:
+            if not handed_off:
+                staged.discard()
@@ -0,0 +1,151 @@
+"""
+Query-plan regression tests for the hot paths.
+
+Migrates a scratch schema in the database at TEST_DATABASE_URL, seeds it
+with enough rows that the planner has a real choice, and EXPLAINs each hot
+query. A sequential scan of tickets, messages or otps means an index the
+query relies on is missing or no longer matches. Skipped when
+TEST_DATABASE_URL is unset:
+
+    TEST_DATABASE_URL=postgresql://localhost/ticket_test python -m pytest tests
+"""
+import os
+import uuid
+from datetime import date, timedelta
+
+import pytest
+
+DATABASE_URL = os.getenv("TEST_DATABASE_URL")
+if not DATABASE_URL:
+    pytest.skip("TEST_DATABASE_URL is not set", allow_module_level=True)
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+import app  # noqa: E402
+import archive  # noqa: E402
+import dashboard  # noqa: E402
+import db  # noqa: E402
+import otp  # noqa: E402
+import schema  # noqa: E402
+
+SEEDED_TABLES = {"tickets", "messages", "otps"}
+
+SEED_SQL = """
+INSERT INTO tickets (ticket_id, fullname, account_number, email, reference, error_type,
+                     description, status, created_at, closed_at)
+SELECT 'TKT-' || lpad(i::text, 8, '0'), 'Customer ' || i, lpad((i % 5000)::text, 10, '0'),
+       'user' || (i % 2000) || '@example.com', 'REF' || i, (ARRAY['transfer', 'card', 'login', 'other'])[1 + i % 4],
+       'Description of ticket ' || i,
+       CASE WHEN i % 10 < 7 THEN 'Closed' ELSE 'Open' END,
+       NOW() - make_interval(mins => i * 50),
+       CASE WHEN i % 10 < 7 THEN NOW() - make_interval(mins => i * 50 - 2880) END
+FROM generate_series(1, 20000) AS i;
+
+INSERT INTO messages (ticket_id, sender_type, content, created_at)
+SELECT t.ticket_id, CASE WHEN n % 2 = 0 THEN 'admin' ELSE 'user' END, 'Message ' || n,
+       t.created_at + make_interval(mins => n)
+FROM tickets t, generate_series(1, 5) AS n;
+
+INSERT INTO otps (email, code, expires_at)
+SELECT 'user' || i || '@example.com', md5(i::text), NOW() + interval '5 minutes'
+FROM generate_series(1, 5000) AS i;
+
+ANALYZE tickets;
+ANALYZE messages;
+ANALYZE otps;
+"""
+
+TICKET = "TKT-00001234"
+OWNER = "user42@example.com"
+NEW_TICKET = {"ticket_id": "TKT-NEW", "name": "n", "account": "0000001234", "email": OWNER,
+              "reference": "REF1234", "error_type": "card", "description": "d", "key": None, "window": 600}
+
+
+def admin_list(**filters):
+    """The admin list query and params for query-string ``filters``, built by the app."""
+    clauses, params, _ = app.ticket_filters(filters)
+    return app.ADMIN_LIST_SQL.format(where=f"WHERE {' AND '.join(clauses)}"), (*params, 51)
+
+
+# (name, sql, params): the statements app.py, dashboard.py, otp.py and archive.py run,
+# imported rather than copied so the test follows them.
+HOT_QUERIES = [
+    ("ticket by id", app.TICKET_SQL, (TICKET,)),
+    ("ticket thread", app.THREAD_MESSAGES_SQL, (TICKET,)),
+    ("thread head", app.THREAD_HEAD_SQL, {"ticket_id": TICKET}),
+    ("new messages since", app.MESSAGES_SINCE_SQL.format(messages="messages"), (TICKET, 100)),
+    ("dashboard summary", dashboard.SUMMARY_SQL.format(where="email = %s"), (OWNER, 51)),
+    ("dashboard summary, next page",
+     dashboard.SUMMARY_SQL.format(where=f"email = %s AND {app.MY_TICKETS_AFTER_SQL}"),
+     (OWNER, "2020-01-01T00:00:00+00:00", "TKT-00000001", 51)),
+    ("read marker", dashboard.MARK_READ_SQL, (TICKET, "user", 3)),
+    ("admin list", app.ADMIN_LIST_SQL.format(where=""), (51,)),
+    ("admin list, closed only", *admin_list(status="Closed")),
+    ("admin list, by error type", *admin_list(error_type="card")),
+    ("admin list, by account", *admin_list(account="0000001234")),
+    ("admin list, one month a year ago",
+     *admin_list(**{"from": (date.today() - timedelta(days=365)).isoformat(),
+                    "to": (date.today() - timedelta(days=335)).isoformat()})),
+    ("admin list, next page",
+     app.ADMIN_LIST_SQL.format(where=f"WHERE {app.ADMIN_LIST_AFTER_SQL}"),
+     (1, "2020-01-01T00:00:00+00:00", "TKT-00000001", 51)),
+    ("ticket insert with near-duplicate lookup", app.INSERT_TICKET_SQL, NEW_TICKET),
+    ("login code issue",
+     otp.ISSUE_SQL,
+     {"email": OWNER, "digest": "x", "ttl": 300, "subject": "s", "html": "h"}),
+    ("login code verify",
+     otp.VERIFY_SQL,
+     {"email": OWNER, "digest": "x", "max_attempts": 5}),
+    ("archive candidates", archive.CANDIDATES_SQL, (180, 500)),
+]
+
+
+@pytest.fixture(scope="module")
+def pool():
+    name = f"query_plans_{uuid.uuid4().hex[:8]}"
+    admin = psycopg2.connect(DATABASE_URL)
+    admin.autocommit = True
+    admin.cursor().execute(f"CREATE SCHEMA {name}")
+    pool = db.ConnectionPool(DATABASE_URL, max_size=2, connect_kwargs={"options": f"-c search_path={name}"})
+    try:
+        schema.migrate(pool)
+        with pool.connection() as conn:
+            conn.cursor().execute(SEED_SQL)
+            conn.commit()
+        yield pool
+    finally:
+        pool.close()
+        admin.cursor().execute(f"DROP SCHEMA {name} CASCADE")
+        admin.close()
+
+
+def _plan_nodes(node):
+    yield node
+    for child in node.get("Plans", ()):
+        yield from _plan_nodes(child)
+
+
+@pytest.mark.parametrize("sql, params", [q[1:] for q in HOT_QUERIES], ids=[q[0] for q in HOT_QUERIES])
+def test_hot_query_uses_an_index(pool, sql, params):
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()[0][0]["Plan"]
+
+    seq_scans = [node["Relation Name"] for node in _plan_nodes(plan)
+                 if node["Node Type"] == "Seq Scan" and node.get("Relation Name") in SEEDED_TABLES]
+    assert not seq_scans, f"sequential scan of {', '.join(seq_scans)}:\n{plan}"
+
+
+def test_migrations_are_recorded_and_idempotent(pool):
+    assert schema.migrate(pool) == []
+    assert schema.current_version(pool) == schema.MIGRATIONS[-1][0]
+
+
+def test_deleting_a_ticket_deletes_its_messages(pool):
+    with pool.connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM tickets WHERE ticket_id = %s", ("TKT-00000007",))
+        cursor.execute("SELECT COUNT(*) FROM messages WHERE ticket_id = %s", ("TKT-00000007",))
+        assert cursor.fetchone()[0] == 0
+        conn.rollback()
@@ -0,0 +1,63 @@
+"""
+ReplicaRouter health decisions, driven by a stand-in replica pool that
+answers the lag query with a fixed value. No database needed.
+"""
+from contextlib import contextmanager
+
+import replica
+
+
+class FakeCursor:
+    def __init__(self, lag):
+        self.lag = lag
+
+    def execute(self, sql, params=None):
+        assert sql == replica.LAG_SQL
+
+    def fetchone(self):
+        return (self.lag,)
+
+
+class FakePool:
+    def __init__(self, lag):
+        self.lag = lag
+
+    @contextmanager
+    def connection(self):
+        yield self
+
+    def cursor(self):
+        return FakeCursor(self.lag)
+
+    def stats(self):
+        return {}
+
+
+def checked_router(lag):
+    router = replica.ReplicaRouter(FakePool(0), FakePool(lag), max_lag=5.0)
+    router._check()
+    return router
+
+
+def test_caught_up_replica_is_used():
+    router = checked_router(0)
+    stats = router.stats()
+    assert stats["healthy"] and stats["lag_seconds"] == 0
+
+
+def test_lagging_replica_is_skipped():
+    router = checked_router(30)
+    stats = router.stats()
+    assert not stats["healthy"] and stats["skipped"] == 1
+
+
+def test_replica_without_streaming_receiver_is_skipped():
+    # LAG_SQL yields NULL when the standby's WAL receiver is not streaming.
+    router = checked_router(None)
+    stats = router.stats()
+    assert not stats["healthy"]
+    assert stats["lag_seconds"] is None and stats["check_errors"] == 1
+
+
+def test_lag_query_requires_a_streaming_receiver():
+    assert "pg_stat_wal_receiver" in replica.LAG_SQL and "'streaming'" in replica.LAG_SQL
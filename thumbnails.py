@@ -0,0 +1,150 @@
+"""
+Downscaled derivatives for ticket attachments.
+
+After an attachment is stored, ``DerivativeManager`` renders a small
+thumbnail (for the admin list) and a screen-sized preview (for the ticket
+page) in a process pool, uploads them next to the original through the same
+storage backend and records them on the ticket row. PDFs get a preview of
+their first page.
+
+Pillow is required for any derivatives; PyMuPDF (``fitz``) is additionally
+needed for PDF previews. Without them the manager disables itself and pages
+fall back to the original file.
+"""
+import importlib.util
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+PDF_RENDER_DPI = 110
+
+
+def pillow_available():
+    return importlib.util.find_spec("PIL") is not None
+
+
+def pdf_available():
+    return importlib.util.find_spec("fitz") is not None
+
+
+def make_derivatives(src_path, content_type, out_dir, sizes):
+    """
+    Runs in a worker process. Writes one file per entry in ``sizes``
+    ({kind: max_edge_px}) into ``out_dir`` and returns
+    {kind: (path, content_type)}.
+    """
+    from PIL import Image, ImageOps, features
+
+    if content_type == "application/pdf":
+        import fitz
+        with fitz.open(src_path) as doc:
+            if doc.page_count == 0:
+                return {}
+            pixmap = doc.load_page(0).get_pixmap(dpi=PDF_RENDER_DPI)
+            image = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+    else:
+        image = Image.open(src_path)
+        image = ImageOps.exif_transpose(image)
+
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    use_webp = features.check("webp")
+    extension, fmt, mime = ("webp", "WEBP", "image/webp") if use_webp else ("jpg", "JPEG", "image/jpeg")
+
+    results = {}
+    for kind, edge in sizes.items():
+        derivative = image.copy()
+        derivative.thumbnail((edge, edge), Image.LANCZOS)
+        path = os.path.join(out_dir, f"{kind}.{extension}")
+        derivative.save(path, fmt, quality=80, optimize=True)
+        results[kind] = (path, mime)
+    return results
+
+
+class DerivativeManager:
+    def __init__(self, backend, pool, workers=1, thumbnail_size=320, preview_size=1280, on_change=None,
+                 events=None):
+        self.backend = backend
+        self.pool = pool
+        self.on_change = on_change
+        self.events = events
+        self.workers = workers
+        self.sizes = {"thumb": thumbnail_size, "preview": preview_size}
+        self.enabled = pillow_available()
+        if not self.enabled:
+            logger.warning("Pillow is not installed; attachment thumbnails are disabled.")
+        elif not pdf_available():
+            logger.warning("PyMuPDF (pymupdf) is not installed; PDF attachments get no preview.")
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._processes = None
+        self._uploader = None
+
+    def accepts(self, content_type):
+        if not self.enabled:
+            return False
+        if content_type == "application/pdf":
+            return pdf_available()
+        return content_type.startswith("image/")
+
+    def _executors(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    # Spawned children do not inherit the web worker's threads,
+                    # sockets or connection pool.
+                    self._processes = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                    )
+                    self._uploader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="derivatives")
+                    self._pid = os.getpid()
+        return self._processes, self._uploader
+
+    def submit(self, ticket_id, staged, name):
+        """
+        Queue derivative generation for a stored attachment. Takes ownership
+        of ``staged`` and removes its temp file when done.
+        """
+        processes, uploader = self._executors()
+        out_dir = tempfile.mkdtemp(prefix="derivatives-")
+        future = processes.submit(make_derivatives, staged.path, staged.content_type, out_dir, self.sizes)
+        # Done-callbacks run on the process pool's management thread; keep
+        # the storage round trips off it.
+        future.add_done_callback(
+            lambda f: uploader.submit(self._store, ticket_id, staged, name, out_dir, f))
+
+    def _store(self, ticket_id, staged, name, out_dir, future):
+        try:
+            derivatives = future.result()
+            urls = {}
+            for kind, (path, mime) in derivatives.items():
+                extension = path.rsplit(".", 1)[-1]
+                with open(path, "rb") as fileobj:
+                    urls[kind] = self.backend.timed_save(f"{name}.{kind}.{extension}", fileobj, mime)
+
+            if urls:
+                with self.pool.connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(
+                        "UPDATE tickets SET thumbnail_path = %s, preview_path = %s WHERE ticket_id = %s",
+                        (urls.get("thumb"), urls.get("preview"), ticket_id))
+                    if self.events is not None:
+                        self.events.publish(cursor, ticket_id, kind="attachment")
+                    conn.commit()
+                if self.on_change is not None:
+                    self.on_change(ticket_id)
+        except Exception as e:
+            logger.error(f"Derivative generation failed for {ticket_id}: {e}")
+        finally:
+            staged.discard()
+            for entry in os.listdir(out_dir):
+                os.remove(os.path.join(out_dir, entry))
+            os.rmdir(out_dir)